@@ -0,0 +1,112 @@
+import os
+import time
+import errno
+import shutil
+import asyncio
+import fnmatch
+from contextlib import contextmanager
+
+
+# Thời gian lưu giữ (giây) cho từng loại file tạm, cấu hình qua biến môi trường
+TEMP_TTL_SECONDS = int(os.environ.get("TEMP_TTL_SECONDS", 3600))
+SIGNATURE_TTL_SECONDS = int(os.environ.get("SIGNATURE_TTL_SECONDS", 24 * 3600))
+LOCAL_UPLOAD_TTL_SECONDS = int(os.environ.get("LOCAL_UPLOAD_TTL_SECONDS", 7 * 24 * 3600))
+JANITOR_INTERVAL_SECONDS = int(os.environ.get("JANITOR_INTERVAL_SECONDS", 600))
+
+PDF_HEADER = b"%PDF-"
+
+
+def publish_file(src: str, dest: str) -> None:
+    """Đưa file đã ghi xong vào vị trí đích bằng rename nguyên tử"""
+    try:
+        os.replace(src, dest)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Khác ổ đĩa: chép sang file tạm cạnh đích rồi rename
+        part_path = f"{dest}.part"
+        shutil.copyfile(src, part_path)
+        os.replace(part_path, dest)
+        os.remove(src)
+
+
+@contextmanager
+def atomic_write(dest: str):
+    """Mở file để ghi, chỉ xuất hiện tại dest khi ghi xong không lỗi"""
+    part_path = f"{dest}.part"
+    try:
+        with open(part_path, "wb") as f:
+            yield f
+        os.replace(part_path, dest)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+
+def check_pdf_header(header: bytes, label: str = "File") -> None:
+    """Kiểm tra header PDF trên các byte đã có sẵn trong bộ nhớ"""
+    if not header.startswith(PDF_HEADER):
+        header_hex = ' '.join([f'{b:02x}' for b in header[:10]])
+        raise Exception(f"{label} không phải PDF hợp lệ, header: {header_hex}")
+
+
+# Mỗi quy tắc: (thư mục, mẫu tên file, thời gian lưu giữ); mẫu bắt đầu bằng
+# "**/" được áp dụng cho cả các thư mục con, ví dụ các thư mục phân mảnh của kho
+JANITOR_RULES = [
+    ("temp", "*", TEMP_TTL_SECONDS),
+    ("static/pdfs", "**/*.part", TEMP_TTL_SECONDS),
+    ("static/signatures", "*.png", SIGNATURE_TTL_SECONDS),
+    ("static/signatures", "*.part", TEMP_TTL_SECONDS),
+    ("static/pdfs", "local_*.pdf", LOCAL_UPLOAD_TTL_SECONDS),
+]
+
+
+def _scan_files(directory: str, recursive: bool):
+    """Các file trong thư mục, kể cả thư mục con nếu recursive"""
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    yield entry
+                elif recursive and entry.is_dir(follow_symlinks=False):
+                    yield from _scan_files(entry.path, recursive)
+    except FileNotFoundError:
+        return
+
+
+def sweep(rules=None, now=None) -> int:
+    """Xóa các file quá hạn theo quy tắc, trả về số file đã xóa"""
+    rules = JANITOR_RULES if rules is None else rules
+    now = time.time() if now is None else now
+    removed = 0
+    for directory, pattern, ttl in rules:
+        if ttl <= 0 or not os.path.isdir(directory):
+            continue
+        recursive = pattern.startswith("**/")
+        if recursive:
+            pattern = pattern[3:]
+        for entry in _scan_files(directory, recursive):
+            if not fnmatch.fnmatch(entry.name, pattern):
+                continue
+            try:
+                if now - entry.stat().st_mtime > ttl:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                continue
+    if removed:
+        print(f"Janitor đã xóa {removed} file quá hạn")
+    return removed
+
+
+async def run_janitor(interval: int = JANITOR_INTERVAL_SECONDS, tasks=()) -> None:
+    """Chạy dọn dẹp định kỳ trong nền, kèm các tác vụ dọn dẹp bổ sung"""
+    loop = asyncio.get_running_loop()
+    while True:
+        for task in (sweep, *tasks):
+            try:
+                await loop.run_in_executor(None, task)
+            except Exception as e:
+                print(f"Lỗi khi dọn dẹp file tạm: {str(e)}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,404 @@
+"""Benchmark tải cho API: /convert, /sign-pdf và /view
+
+Chạy app thật từ main.py, trong cùng process (ASGI transport của httpx) hoặc
+qua uvicorn trên cổng local, với backend chuyển đổi giả nên không cần Office.
+Kết quả (throughput, p50/p95/p99, RSS đỉnh) được lưu thành JSON để so sánh.
+Cần cài thêm httpx. Chạy từ thư mục backend:
+
+    python benchmarks/bench_service.py --mode both --requests 200 --concurrency 8
+    python benchmarks/bench_service.py --compare benchmarks/results/truoc.json
+    python benchmarks/bench_service.py --mode uvicorn --scenarios view --startup-runs 5
+"""
+import os
+import sys
+import json
+import time
+import base64
+import socket
+import asyncio
+import argparse
+import platform
+import resource
+import statistics
+import subprocess
+import tempfile
+import contextlib
+from io import BytesIO
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx
+from PIL import Image, ImageDraw
+from reportlab.pdfgen import canvas
+
+
+STUB_BACKEND = "benchmarks.stub_backend:StubConversionBackend"
+PAGE_COUNTS = (1, 50, 500)
+
+
+def make_pdf(path: str, pages: int) -> None:
+    c = canvas.Canvas(path)
+    for number in range(1, pages + 1):
+        c.drawString(72, 770, f"Trang {number}/{pages}")
+        c.drawString(72, 740, "Nội dung mẫu cho benchmark " * 3)
+        c.showPage()
+    c.save()
+
+
+def make_signature_data_url() -> str:
+    img = Image.new("RGBA", (900, 600), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.line((50, 500, 850, 100), fill=(0, 0, 160, 255), width=12)
+    buffer = BytesIO()
+    img.save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def prepare_workdir(workdir: str) -> None:
+    """Tạo PDF mẫu 1/50/500 trang trong static/pdfs của thư mục làm việc"""
+    os.makedirs(os.path.join(workdir, "static", "pdfs"), exist_ok=True)
+    for pages in PAGE_COUNTS:
+        make_pdf(os.path.join(workdir, "static", "pdfs", f"bench_{pages}.pdf"), pages)
+
+
+def percentile(samples, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, int(round(fraction * len(samples))) - 1))
+    return samples[index]
+
+
+def reset_peak_rss(pid: str = "self") -> None:
+    # Linux cho phép đặt lại VmHWM để đo RSS đỉnh theo từng kịch bản
+    try:
+        with open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb(pid: str = "self") -> float:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid == "self":
+        # ru_maxrss tính bằng KB trên Linux, byte trên macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+    return 0.0
+
+
+def scenarios(signature_data_url: str, view_size: int = 0) -> dict:
+    """Mỗi kịch bản là hàm tạo request thứ i"""
+    range_size = 64 * 1024
+
+    def convert(i):
+        # Nội dung khác nhau mỗi request để không trúng cache chuyển đổi
+        body = b"PK\x03\x04" + os.urandom(16) + b"\x00" * 4096
+        return "POST", "/convert", {"files": {"file": (f"doc_{i}.docx", body, "application/octet-stream")}}
+
+    def convert_cached(i):
+        body = b"PK\x03\x04benchmark-cache" + b"\x00" * 4096
+        return "POST", "/convert", {"files": {"file": ("cached.docx", body, "application/octet-stream")}}
+
+    def sign(pages):
+        def build(i):
+            return "POST", "/sign-pdf", {"data": {
+                "pdf_id": f"bench_{pages}",
+                "signature_a_data": signature_data_url,
+                "signature_a_name": "Nguyễn Văn A",
+                "signature_b_data": signature_data_url,
+                "signature_b_name": "Trần Thị B",
+            }}
+        return build
+
+    def sign_layout(pages):
+        # Bốn bên ký: đóng dấu lên trang đầu và trang cuối, hai bên trên trang nối thêm
+        layout = json.dumps({"parties": [
+            {"name": "Nguyễn Văn A", "signature_field": "signature_a_data", "page": 1, "box": [350, 60, 180, 90]},
+            {"name": "Trần Thị B", "signature_field": "signature_a_data", "page": -1, "box": [60, 60, 180, 90]},
+            {"label": "BÊN C", "name": "Lê Văn C", "signature_field": "signature_a_data"},
+            {"label": "BÊN D", "name": "Phạm Thị D", "signature_field": "signature_a_data"},
+        ]}, ensure_ascii=False)
+
+        def build(i):
+            return "POST", "/sign-pdf", {"data": {
+                "pdf_id": f"bench_{pages}",
+                "signature_a_data": signature_data_url,
+                "layout": layout,
+            }}
+        return build
+
+    def view(i):
+        return "GET", "/view/bench_500", {}
+
+    def view_range(i):
+        # Đọc từng đoạn 64KiB như viewer tải dần tài liệu
+        start = (i * range_size) % max(1, view_size - range_size)
+        return "GET", "/view/bench_500", {"headers": {"Range": f"bytes={start}-{start + range_size - 1}"}}
+
+    result = {"convert": convert, "convert_cached": convert_cached}
+    for pages in PAGE_COUNTS:
+        result[f"sign_{pages}"] = sign(pages)
+    for pages in PAGE_COUNTS:
+        result[f"sign_layout_{pages}"] = sign_layout(pages)
+    result["view"] = view
+    result["view_range"] = view_range
+    return result
+
+
+async def run_scenario(client: httpx.AsyncClient, build, requests: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            method, url, options = build(i)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, **options)
+                await response.aread()
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    # Chạy thử vài request để loại bỏ chi phí khởi tạo
+    for i in range(min(3, requests)):
+        method, url, options = build(i)
+        await client.request(method, url, **options)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(requests / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(statistics.mean(latencies), 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50), 2),
+        "p95_ms": round(percentile(latencies, 0.95), 2),
+        "p99_ms": round(percentile(latencies, 0.99), 2),
+    }
+
+
+async def run_inprocess(names, args) -> list:
+    # main.py dùng đường dẫn tương đối nên phải chdir trước khi import
+    with open(os.devnull, "w") as devnull:
+        # Bỏ log của app để bảng kết quả dễ đọc
+        with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(devnull):
+            return await _run_inprocess(names, args)
+
+
+async def _run_inprocess(names, args) -> list:
+    import main
+    builders = scenarios(make_signature_data_url(), os.path.getsize("static/pdfs/bench_500.pdf"))
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for name in names:
+            reset_peak_rss()
+            result = await run_scenario(client, builders[name], args.requests, args.concurrency)
+            result.update({"scenario": name, "mode": "inprocess", "peak_rss_mb": round(peak_rss_mb(), 1)})
+            print_result(result)
+            results.append(result)
+    main.conversion_engine.shutdown()
+    main.signing_engine.shutdown()
+    return results
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_for_server(base_url: str, process: subprocess.Popen, timeout: float = 30,
+                          interval: float = 0.1) -> None:
+    deadline = time.time() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.time() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError("uvicorn đã dừng khi khởi động")
+            try:
+                await client.get("/")
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(interval)
+    raise RuntimeError("uvicorn không khởi động kịp")
+
+
+def start_uvicorn(workdir: str, port: int) -> subprocess.Popen:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [BACKEND_DIR, env.get("PYTHONPATH")]))
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def run_startup(runs: int, workdir: str) -> dict:
+    """Đo thời gian từ lúc chạy uvicorn tới khi GET / đầu tiên thành công"""
+    samples = []
+    peak = 0.0
+    for _ in range(runs):
+        port = free_port()
+        started = time.perf_counter()
+        process = start_uvicorn(workdir, port)
+        try:
+            await wait_for_server(f"http://127.0.0.1:{port}", process, interval=0.01)
+            samples.append((time.perf_counter() - started) * 1000)
+            peak = max(peak, peak_rss_mb(str(process.pid)))
+        finally:
+            process.terminate()
+            process.wait()
+    samples.sort()
+    result = {
+        "scenario": "startup",
+        "mode": "uvicorn",
+        "requests": runs,
+        "concurrency": 1,
+        "errors": 0,
+        "duration_s": round(sum(samples) / 1000, 3),
+        "throughput_rps": 0.0,
+        "mean_ms": round(statistics.mean(samples), 2),
+        "p50_ms": round(percentile(samples, 0.50), 2),
+        "p95_ms": round(percentile(samples, 0.95), 2),
+        "p99_ms": round(percentile(samples, 0.99), 2),
+        "peak_rss_mb": round(peak, 1),
+    }
+    print_result(result)
+    return result
+
+
+async def run_uvicorn(names, args, workdir: str) -> list:
+    port = free_port()
+    process = start_uvicorn(workdir, port)
+    base_url = f"http://127.0.0.1:{port}"
+    results = []
+    try:
+        await wait_for_server(base_url, process)
+        builders = scenarios(make_signature_data_url(),
+                             os.path.getsize(os.path.join(workdir, "static", "pdfs", "bench_500.pdf")))
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=limits) as client:
+            for name in names:
+                reset_peak_rss(str(process.pid))
+                result = await run_scenario(client, builders[name], args.requests, args.concurrency)
+                result.update({"scenario": name, "mode": "uvicorn",
+                               "peak_rss_mb": round(peak_rss_mb(str(process.pid)), 1)})
+                print_result(result)
+                results.append(result)
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+
+def print_result(result: dict) -> None:
+    print(f"{result['mode']:<10}{result['scenario']:<16}{result['throughput_rps']:>10.1f} req/s"
+          f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f} ms"
+          f"{result['peak_rss_mb']:>10.1f} MB  lỗi {result['errors']}", file=sys.__stdout__, flush=True)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(report: dict, baseline_path: str) -> None:
+    """In mức thay đổi throughput và p95 so với một lần chạy trước"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["mode"], r["scenario"]): r for r in json.load(f)["results"]}
+    print(f"\nSo với {baseline_path}:")
+    for result in report["results"]:
+        before = baseline.get((result["mode"], result["scenario"]))
+        if before is None:
+            continue
+        throughput = (result["throughput_rps"] / before["throughput_rps"] - 1) * 100 if before["throughput_rps"] else 0.0
+        p95 = (result["p95_ms"] / before["p95_ms"] - 1) * 100 if before["p95_ms"] else 0.0
+        print(f"{result['mode']:<10}{result['scenario']:<16}throughput {throughput:+7.1f}%   p95 {p95:+7.1f}%")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=["inprocess", "uvicorn", "both"], default="both")
+    parser.add_argument("--scenarios", default="all",
+                        help="danh sách phân tách bằng dấu phẩy: convert, convert_cached, "
+                             "sign_1, sign_50, sign_500, sign_layout_1, sign_layout_50, "
+                             "sign_layout_500, view, view_range")
+    parser.add_argument("--requests", type=int, default=100, help="số request mỗi kịch bản")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--output", default=None, help="file JSON kết quả")
+    parser.add_argument("--compare", default=None, help="file JSON của lần chạy trước để so sánh")
+    parser.add_argument("--startup-runs", type=int, default=0,
+                        help="số lần đo thời gian khởi động uvicorn tới request đầu tiên")
+    parser.add_argument("--verbose", action="store_true", help="hiện log của app khi chạy trong process")
+    args = parser.parse_args()
+
+    names = list(scenarios("").keys())
+    if args.scenarios != "all":
+        names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+        unknown = set(names) - set(scenarios("").keys())
+        if unknown:
+            parser.error(f"Kịch bản không tồn tại: {', '.join(sorted(unknown))}")
+
+    os.environ.setdefault("CONVERSION_BACKEND", STUB_BACKEND)
+    os.environ.setdefault("CONVERSION_PREWARM", "0")
+    output = args.output or os.path.join(BACKEND_DIR, "benchmarks", "results",
+                                         f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench_") as workdir:
+        prepare_workdir(workdir)
+        print(f"{'chế độ':<10}{'kịch bản':<16}{'throughput':>16}{'p50':>10}{'p95':>10}{'p99':>10} ms{'RSS đỉnh':>13}")
+        if args.startup_runs > 0:
+            results.append(asyncio.run(run_startup(args.startup_runs, workdir)))
+        if args.mode in ("uvicorn", "both"):
+            results += asyncio.run(run_uvicorn(names, args, workdir))
+        if args.mode in ("inprocess", "both"):
+            previous = os.getcwd()
+            os.chdir(workdir)
+            try:
+                results += asyncio.run(run_inprocess(names, args))
+            finally:
+                os.chdir(previous)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "conversion_backend": os.environ["CONVERSION_BACKEND"],
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu kết quả: {output}")
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Đo độ trễ dựng trang chữ ký: vẽ toàn bộ mỗi lần so với mẫu dựng sẵn
+
+Chạy từ thư mục backend:
+
+    python benchmarks/bench_signature_page.py --iterations 200
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+from signing_resources import get_signature_template
+
+
+def make_signature_image(path: str) -> None:
+    img = Image.new("RGBA", (900, 600), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.line((50, 500, 850, 100), fill=(0, 0, 160, 255), width=12)
+    img.save(path)
+
+
+def measure(render, iterations: int, signature_path) -> dict:
+    # Chạy thử vài lần để loại bỏ chi phí khởi tạo
+    for _ in range(3):
+        render(signature_path, "Nguyễn Văn A", signature_path, "Trần Thị B")
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        render(signature_path, "Nguyễn Văn A", signature_path, "Trần Thị B")
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "mean_ms": statistics.mean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p95_ms": samples[int(len(samples) * 0.95) - 1],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100)
+    args = parser.parse_args()
+
+    signature_template = get_signature_template()
+    with tempfile.TemporaryDirectory() as tmp:
+        signature_path = os.path.join(tmp, "signature.png")
+        make_signature_image(signature_path)
+        for scenario, path in (("chỉ có tên", None), ("có ảnh chữ ký", signature_path)):
+            before = measure(signature_template.render_full, args.iterations, path)
+            after = measure(signature_template.render, args.iterations, path)
+
+            print(f"\n[{scenario}]")
+            print(f"{'':<22}{'mean':>10}{'p50':>10}{'p95':>10}")
+            for label, result in (("vẽ toàn bộ (trước)", before), ("mẫu dựng sẵn (sau)", after)):
+                print(f"{label:<22}{result['mean_ms']:>8.2f}ms{result['p50_ms']:>8.2f}ms{result['p95_ms']:>8.2f}ms")
+            print(f"Tăng tốc p50: {before['p50_ms'] / after['p50_ms']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""Backend chuyển đổi giả cho benchmark, không cần Word hay LibreOffice
+
+Dùng qua CONVERSION_BACKEND=benchmarks.stub_backend:StubConversionBackend
+"""
+import os
+import time
+
+from reportlab.pdfgen import canvas
+
+from conversion_backends import ConversionBackend
+
+
+# Độ trễ giả lập cho mỗi lần chuyển đổi (giây)
+STUB_CONVERT_DELAY = float(os.environ.get("STUB_CONVERT_DELAY", 0))
+
+
+class StubConversionBackend(ConversionBackend):
+    """Tạo PDF một trang ghi kích thước file DOCX đầu vào"""
+
+    name = "stub"
+
+    def convert(self, docx_path: str, pdf_path: str) -> None:
+        if STUB_CONVERT_DELAY:
+            time.sleep(STUB_CONVERT_DELAY)
+        c = canvas.Canvas(pdf_path)
+        c.drawString(72, 770, f"{os.path.basename(docx_path)}: {os.path.getsize(docx_path)} bytes")
+        c.showPage()
+        c.save()
@@ -0,0 +1,322 @@
+import os
+import abc
+import time
+import uuid
+import queue
+import atexit
+import signal
+import shutil
+import tempfile
+import importlib
+import threading
+import subprocess
+from typing import Optional
+
+
+# Cấu hình backend chuyển đổi qua biến môi trường
+CONVERSION_BACKEND = os.environ.get("CONVERSION_BACKEND", "auto")
+LIBREOFFICE_BINARY = os.environ.get("LIBREOFFICE_BINARY", "")
+LIBREOFFICE_WORKERS = int(os.environ.get("LIBREOFFICE_WORKERS", os.cpu_count() or 2))
+LIBREOFFICE_MAX_JOBS = int(os.environ.get("LIBREOFFICE_MAX_JOBS", 200))
+LIBREOFFICE_TIMEOUT = int(os.environ.get("LIBREOFFICE_TIMEOUT", 120))
+LIBREOFFICE_START_TIMEOUT = int(os.environ.get("LIBREOFFICE_START_TIMEOUT", 60))
+
+
+class ConversionTimeout(Exception):
+    """Job chuyển đổi chạy quá thời gian cho phép"""
+
+
+class ConversionBackend(abc.ABC):
+    """Giao diện chung của các backend chuyển đổi DOCX sang PDF"""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def convert(self, docx_path: str, pdf_path: str) -> None:
+        """Chuyển docx_path thành PDF tại pdf_path"""
+
+    def prewarm(self) -> None:
+        """Khởi động trước tài nguyên cần thiết, mặc định không làm gì"""
+
+    def close(self) -> None:
+        """Giải phóng tài nguyên của backend"""
+
+
+class Docx2PdfBackend(ConversionBackend):
+    """Dùng docx2pdf, mỗi lần gọi khởi động Word/LibreOffice mới"""
+
+    name = "docx2pdf"
+
+    def convert(self, docx_path: str, pdf_path: str) -> None:
+        from docx2pdf import convert
+        convert(docx_path, pdf_path)
+
+
+def _find_soffice() -> Optional[str]:
+    if LIBREOFFICE_BINARY:
+        return LIBREOFFICE_BINARY
+    return shutil.which("soffice") or shutil.which("libreoffice")
+
+
+def _uno_available() -> bool:
+    try:
+        import uno  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _uno_properties(**values):
+    from com.sun.star.beans import PropertyValue
+    properties = []
+    for name, value in values.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        properties.append(prop)
+    return tuple(properties)
+
+
+def _kill_process_group(process: subprocess.Popen) -> None:
+    # soffice là script khởi chạy soffice.bin, cần kill cả nhóm process
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    process.wait()
+
+
+class _SofficeWorker:
+    """Một process soffice headless với profile riêng, dùng lại cho nhiều job
+
+    Khi có module uno, process được giữ chạy và nhận lệnh qua pipe URP. Khi
+    không có uno, mỗi job chạy soffice --convert-to nhưng vẫn dùng profile đã
+    khởi tạo sẵn nên bỏ qua được bước tạo profile tốn vài giây.
+    """
+
+    def __init__(self, binary: str, use_uno: bool):
+        self.binary = binary
+        self.use_uno = use_uno
+        self.profile_dir = tempfile.mkdtemp(prefix="soffice_profile_")
+        self.pipe_name = f"flutter_app_{uuid.uuid4().hex}"
+        self.process: Optional[subprocess.Popen] = None
+        self.desktop = None
+        self.profile_ready = False
+        self.jobs = 0
+
+    def _base_command(self):
+        return [
+            self.binary,
+            f"-env:UserInstallation=file://{self.profile_dir}",
+            "--headless", "--invisible", "--nologo", "--norestore",
+            "--nodefault", "--nolockcheck", "--nofirststartwizard",
+        ]
+
+    @property
+    def alive(self) -> bool:
+        if not self.use_uno:
+            return True
+        return self.process is not None and self.process.poll() is None and self.desktop is not None
+
+    def start(self) -> None:
+        started_at = time.time()
+        if not self.use_uno:
+            # Chạy một lần để LibreOffice tạo sẵn profile
+            subprocess.run(self._base_command() + ["--terminate_after_init"],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                           timeout=LIBREOFFICE_START_TIMEOUT)
+            self.profile_ready = True
+            print(f"Đã khởi tạo profile LibreOffice trong {time.time() - started_at:.1f}s")
+            return
+
+        import uno
+        self.process = subprocess.Popen(
+            self._base_command() + [f"--accept=pipe,name={self.pipe_name};urp;StarOffice.ComponentContext"],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+        )
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        while True:
+            try:
+                context = resolver.resolve(f"uno:pipe,name={self.pipe_name};urp;StarOffice.ComponentContext")
+                break
+            except Exception:
+                if self.process.poll() is not None:
+                    raise Exception("soffice đã dừng trong lúc khởi động")
+                if time.time() - started_at > LIBREOFFICE_START_TIMEOUT:
+                    self.stop()
+                    raise ConversionTimeout("soffice không khởi động kịp")
+                time.sleep(0.1)
+        self.desktop = context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+        self.jobs = 0
+        print(f"Đã khởi động soffice (pid {self.process.pid}) trong {time.time() - started_at:.1f}s")
+
+    def ensure_started(self) -> None:
+        if self.use_uno:
+            if not self.alive:
+                self.stop()
+                self.start()
+        elif not self.profile_ready:
+            self.start()
+
+    def stop(self) -> None:
+        self.desktop = None
+        if self.process is not None:
+            _kill_process_group(self.process)
+        self.process = None
+
+    def close(self) -> None:
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def convert(self, docx_path: str, pdf_path: str, timeout: int) -> None:
+        if not self.use_uno:
+            self._convert_cli(docx_path, pdf_path, timeout)
+            return
+
+        import uno
+        # Hết thời gian thì kill process, lệnh UNO đang chờ sẽ lỗi ngay
+        timed_out = threading.Event()
+
+        def on_timeout():
+            timed_out.set()
+            self.stop()
+
+        timer = threading.Timer(timeout, on_timeout)
+        timer.start()
+        try:
+            document = self.desktop.loadComponentFromURL(
+                uno.systemPathToFileUrl(os.path.abspath(docx_path)), "_blank", 0,
+                _uno_properties(Hidden=True, ReadOnly=True)
+            )
+            if document is None:
+                raise Exception(f"LibreOffice không mở được file: {docx_path}")
+            try:
+                document.storeToURL(uno.systemPathToFileUrl(os.path.abspath(pdf_path)),
+                                    _uno_properties(FilterName="writer_pdf_Export"))
+            finally:
+                document.close(True)
+        except Exception:
+            if timed_out.is_set():
+                raise ConversionTimeout(f"Chuyển đổi quá {timeout} giây: {docx_path}")
+            raise
+        finally:
+            timer.cancel()
+
+    def _convert_cli(self, docx_path: str, pdf_path: str, timeout: int) -> None:
+        out_dir = tempfile.mkdtemp(prefix="soffice_out_")
+        process = subprocess.Popen(
+            self._base_command() + ["--convert-to", "pdf", "--outdir", out_dir, docx_path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+        )
+        try:
+            try:
+                process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                _kill_process_group(process)
+                raise ConversionTimeout(f"Chuyển đổi quá {timeout} giây: {docx_path}")
+            if process.returncode != 0:
+                raise Exception(f"LibreOffice lỗi (mã {process.returncode}) khi chuyển đổi {docx_path}")
+            output = os.path.join(out_dir, os.path.splitext(os.path.basename(docx_path))[0] + ".pdf")
+            if not os.path.exists(output):
+                raise Exception(f"LibreOffice không tạo ra file PDF cho {docx_path}")
+            shutil.move(output, pdf_path)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+
+class LibreOfficeBackend(ConversionBackend):
+    """Pool các process soffice headless chạy lâu dài
+
+    Mỗi job mượn một process rảnh; process được khởi động lại sau max_jobs
+    job, khi bị crash hoặc khi job vượt quá timeout.
+    """
+
+    name = "libreoffice"
+
+    def __init__(self, size: int = LIBREOFFICE_WORKERS, max_jobs: int = LIBREOFFICE_MAX_JOBS,
+                 timeout: int = LIBREOFFICE_TIMEOUT, binary: Optional[str] = None):
+        self.binary = binary or _find_soffice()
+        if not self.binary:
+            raise Exception("Không tìm thấy soffice/libreoffice")
+        self.use_uno = _uno_available()
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self._workers = [_SofficeWorker(self.binary, self.use_uno) for _ in range(max(1, size))]
+        self._idle = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+        mode = "UNO" if self.use_uno else "--convert-to"
+        print(f"Backend LibreOffice: {self.binary}, {len(self._workers)} process, chế độ {mode}")
+
+    def prewarm(self) -> None:
+        workers = [self._idle.get() for _ in self._workers]
+        try:
+            for worker in workers:
+                worker.ensure_started()
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+
+    def convert(self, docx_path: str, pdf_path: str) -> None:
+        worker = self._idle.get()
+        try:
+            worker.ensure_started()
+            worker.convert(docx_path, pdf_path, self.timeout)
+            worker.jobs += 1
+            if worker.use_uno and worker.jobs >= self.max_jobs:
+                print(f"Khởi động lại soffice sau {worker.jobs} job")
+                worker.stop()
+        except Exception:
+            # Process có thể đã hỏng, khởi động lại ở job sau
+            worker.stop()
+            raise
+        finally:
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.close()
+
+
+BACKENDS = {
+    "docx2pdf": Docx2PdfBackend,
+    "libreoffice": LibreOfficeBackend,
+}
+
+_backend: Optional[ConversionBackend] = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name: str = CONVERSION_BACKEND) -> ConversionBackend:
+    """Tạo backend theo tên, hoặc theo đường dẫn dạng module:Class"""
+    if name == "auto":
+        name = "libreoffice" if _find_soffice() else "docx2pdf"
+    if name in BACKENDS:
+        return BACKENDS[name]()
+    module_name, _, class_name = name.partition(":")
+    if not class_name:
+        raise ValueError(f"Backend chuyển đổi không hợp lệ: {name}")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def get_backend() -> ConversionBackend:
+    """Backend dùng chung trong process hiện tại, tạo khi dùng lần đầu"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+
+def close_backend() -> None:
+    global _backend
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+            _backend = None
+
+
+atexit.register(close_backend)
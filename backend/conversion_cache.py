@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+
+CONVERSION_CACHE_DIR = os.environ.get("CONVERSION_CACHE_DIR", "cache")
+CONVERSION_CACHE_MAX_ENTRIES = int(os.environ.get("CONVERSION_CACHE_MAX_ENTRIES", 1000))
+CONVERSION_CACHE_MAX_BYTES = int(os.environ.get("CONVERSION_CACHE_MAX_BYTES", 2 * 1024 * 1024 * 1024))
+
+
+class ConversionCache:
+    """Cache kết quả chuyển đổi theo hash nội dung file DOCX
+
+    Index lưu trên đĩa dạng JSON, thứ tự các entry chính là thứ tự LRU.
+    Lần trúng cache chỉ cập nhật thứ tự trong bộ nhớ; index được ghi lại khi
+    thêm entry, theo chu kỳ của janitor (flush) và khi tắt service.
+    Khi vượt giới hạn số entry hoặc tổng dung lượng, entry ít dùng nhất bị
+    loại khỏi index; file PDF vẫn giữ nguyên vì URL /view đã được trả cho client.
+    """
+
+    def __init__(self, cache_dir: str = CONVERSION_CACHE_DIR,
+                 max_entries: int = CONVERSION_CACHE_MAX_ENTRIES,
+                 max_bytes: int = CONVERSION_CACHE_MAX_BYTES,
+                 exists=None):
+        self.index_path = os.path.join(cache_dir, "conversion_index.json")
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # Hàm kiểm tra PDF của entry còn tồn tại, mặc định kiểm tra pdf_path trên đĩa
+        self.exists = exists or (lambda entry: os.path.exists(entry["pdf_path"]))
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        # Thứ tự LRU trong bộ nhớ đã thay đổi nhưng chưa ghi xuống index
+        self._dirty = False
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+            for entry in sorted(entries, key=lambda e: e.get("last_used", 0)):
+                self._entries[entry["digest"]] = entry
+                self._total_bytes += entry.get("size", 0)
+            print(f"Đã nạp cache chuyển đổi: {len(self._entries)} entry")
+        except Exception as e:
+            print(f"Không thể đọc index cache chuyển đổi: {str(e)}")
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def _save(self) -> None:
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(self._entries.values()), f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+
+    def flush(self) -> None:
+        """Ghi index nếu thứ tự LRU đã thay đổi kể từ lần ghi trước"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def lookup(self, digest: str) -> Optional[dict]:
+        """Trả về entry nếu đã có PDF cho nội dung này, None nếu chưa có"""
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and not self.exists(entry):
+                # File PDF đã bị xóa bên ngoài, bỏ entry
+                self._remove(digest)
+                self._dirty = True
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_used"] = time.time()
+            self._entries.move_to_end(digest)
+            self._dirty = True
+            return dict(entry)
+
+    def store(self, digest: str, pdf_id: str, pdf_path: str, size: int) -> None:
+        with self._lock:
+            if digest in self._entries:
+                self._remove(digest)
+            now = time.time()
+            self._entries[digest] = {
+                "digest": digest,
+                "pdf_id": pdf_id,
+                "pdf_path": pdf_path,
+                "size": size,
+                "created": now,
+                "last_used": now,
+            }
+            self._total_bytes += size
+            self._evict()
+            self._save()
+
+    def _remove(self, digest: str) -> None:
+        entry = self._entries.pop(digest)
+        self._total_bytes -= entry.get("size", 0)
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self._total_bytes > self.max_bytes):
+            digest = next(iter(self._entries))
+            self._remove(digest)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,284 @@
+import os
+import time
+import uuid
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Optional
+
+from artifacts import check_pdf_header
+from conversion_backends import get_backend
+from job_events import JobProgress, progress_context, report_progress
+from metrics import record_stage, stage
+from pdf_optimize import PDF_OPTIMIZE, optimize_pdf
+
+
+# Cấu hình pool chuyển đổi qua biến môi trường
+CONVERSION_WORKERS = int(os.environ.get("CONVERSION_WORKERS", os.cpu_count() or 2))
+CONVERSION_QUEUE_SIZE = int(os.environ.get("CONVERSION_QUEUE_SIZE", 16))
+CONVERSION_EXECUTOR = os.environ.get("CONVERSION_EXECUTOR", "thread")
+CONVERSION_RETRY_AFTER = int(os.environ.get("CONVERSION_RETRY_AFTER", 5))
+JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", 3600))
+
+
+# Tên hàng đợi hiện trong thông báo lỗi theo tên pool
+QUEUE_LABELS = {
+    "convert": "chuyển đổi",
+    "sign": "ký PDF",
+}
+
+
+class QueueFullError(Exception):
+    """Hàng đợi của pool đã đầy, client cần thử lại sau"""
+
+    def __init__(self, retry_after: int, pool: str = "convert"):
+        super().__init__(f"Hàng đợi {QUEUE_LABELS.get(pool, pool)} đã đầy, thử lại sau {retry_after} giây")
+        self.retry_after = retry_after
+        self.pool = pool
+
+
+def convert_docx_file(docx_path: str, pdf_temp_path: str) -> int:
+    """Chuyển đổi DOCX sang PDF trong worker, trả về kích thước file PDF
+
+    PDF được để lại tại pdf_temp_path, endpoint đưa vào kho lưu trữ sau đó.
+    """
+    report_progress("converting")
+    # Backend được tạo trong chính worker nên mỗi process con có pool riêng
+    with stage("docx2pdf"):
+        get_backend().convert(docx_path, pdf_temp_path)
+
+    # Kiểm tra xem file PDF đã được tạo chưa
+    if not os.path.exists(pdf_temp_path):
+        raise Exception(f"Không thể tạo file PDF: {pdf_temp_path}")
+
+    # Kiểm tra kích thước file PDF
+    pdf_size = os.path.getsize(pdf_temp_path)
+    if pdf_size == 0:
+        raise Exception(f"File PDF được tạo nhưng rỗng: {pdf_temp_path}")
+
+    with open(pdf_temp_path, "rb") as f:
+        check_pdf_header(f.read(8), "File chuyển đổi")
+    # File DOCX không còn cần nữa
+    os.remove(docx_path)
+    if PDF_OPTIMIZE:
+        result = optimize_pdf(pdf_temp_path, "converted")
+        pdf_size = result["after"]
+        report_progress("optimized", before=result["before"], after=result["after"])
+    return pdf_size
+
+
+def _timed_call(stage_name: str, submitted_at: float, fn, *args):
+    # Thời gian job nằm chờ trong hàng đợi trước khi có worker nhận
+    record_stage(stage_name, time.perf_counter() - submitted_at)
+    return fn(*args)
+
+
+class ConversionJob:
+    """Thông tin một job chuyển đổi hoặc ký trong hàng đợi"""
+
+    def __init__(self, job_id: str, filename: str, pdf_id: str, kind: str = "convert",
+                 callback_url: Optional[str] = None):
+        self.job_id = job_id
+        self.filename = filename
+        self.pdf_id = pdf_id
+        self.kind = kind
+        self.progress = JobProgress(job_id, callback_url)
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        # work: việc chuyển đổi trên pool; future: xong khi PDF đã được lưu
+        self.work = None
+        self.future = None
+
+    @property
+    def status(self) -> str:
+        if self.future is not None and self.future.done():
+            if self.future.cancelled() or self.future.exception() is not None:
+                return "error"
+            return "done"
+        work = self.work or self.future
+        if work is not None and (work.running() or work.done()):
+            return "running"
+        return "queued"
+
+    @property
+    def error(self) -> Optional[str]:
+        if self.status != "error":
+            return None
+        if self.future.cancelled():
+            return "Job đã bị hủy"
+        return str(self.future.exception())
+
+    def to_dict(self) -> dict:
+        data = {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "stage": self.progress.stage,
+            "progress": self.progress.events[-1]["progress"] if self.progress.events else 0.0,
+            "filename": self.filename,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "events_url": f"/jobs/{self.job_id}/events",
+        }
+        if data["status"] == "done":
+            data["pdf_id"] = self.pdf_id
+            data["view_url"] = f"/view/{self.pdf_id}"
+            data["result_url"] = f"/jobs/{self.job_id}/result"
+        elif data["status"] == "error":
+            data["error"] = self.error
+        return data
+
+    def publish_result(self) -> None:
+        """Phát sự kiện kết thúc (done hoặc error) kèm kết quả, gửi webhook nếu client yêu cầu"""
+        data = self.to_dict()
+        self.progress.publish(data["status"], **{
+            key: data[key] for key in ("pdf_id", "view_url", "result_url", "error") if key in data
+        })
+
+
+class ConversionEngine:
+    """Pool worker có giới hạn cho việc chuyển đổi DOCX sang PDF
+
+    Số job đang chờ và đang chạy không vượt quá max_workers + queue_size,
+    vượt quá thì submit() ném QueueFullError để endpoint trả về 429.
+    Cùng cơ chế này cũng được dùng cho pool ký PDF.
+    """
+
+    def __init__(self, max_workers: int = CONVERSION_WORKERS,
+                 queue_size: int = CONVERSION_QUEUE_SIZE,
+                 executor: str = CONVERSION_EXECUTOR,
+                 retry_after: int = CONVERSION_RETRY_AFTER,
+                 name: str = "convert"):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self.queue_size = max(0, queue_size)
+        self.executor_kind = executor
+        self.retry_after = retry_after
+        self._executor = None
+        self._pending = 0
+        self._running = set()
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=self.name)
+            print(f"Khởi tạo pool {self.name} ({self.executor_kind}), "
+                  f"{self.max_workers} worker, hàng đợi {self.queue_size}")
+        return self._executor
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def in_flight(self) -> int:
+        """Số job đang được worker xử lý"""
+        with self._lock:
+            futures = list(self._running)
+        return sum(1 for future in futures if future.running())
+
+    def _acquire_slot(self) -> None:
+        with self._lock:
+            if self._pending >= self.max_workers + self.queue_size:
+                raise QueueFullError(self.retry_after, self.name)
+            self._pending += 1
+
+    def _release_slot(self, future=None) -> None:
+        with self._lock:
+            self._pending -= 1
+            self._running.discard(future)
+
+    def submit(self, fn, *args):
+        """Đưa một hàm vào pool, ném QueueFullError nếu hàng đợi đầy"""
+        self._acquire_slot()
+        try:
+            if self.executor_kind == "thread":
+                # Chạy trong bản sao context để các bước đo trong worker gắn với request
+                future = self.executor.submit(
+                    contextvars.copy_context().run, _timed_call,
+                    f"{self.name}_queue_wait", time.perf_counter(), fn, *args
+                )
+            else:
+                future = self.executor.submit(fn, *args)
+        except Exception:
+            self._release_slot()
+            raise
+        with self._lock:
+            self._running.add(future)
+        future.add_done_callback(self._release_slot)
+        return future
+
+    async def run(self, fn, *args):
+        """Chạy hàm trên pool và chờ kết quả mà không chặn event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def submit_job(self, filename: str, pdf_id: str, fn, *args,
+                   on_success: Optional[Callable[[object], None]] = None,
+                   callback_url: Optional[str] = None) -> ConversionJob:
+        """Tạo job nền chạy fn(*args) trên pool, trả về ngay để client theo dõi qua job id
+
+        on_success nhận kết quả của fn và lưu PDF; job chỉ chuyển sang done
+        sau khi on_success chạy xong. Tiến độ được phát qua job.progress.
+        """
+        self._prune_jobs()
+        job = ConversionJob(str(uuid.uuid4()), filename, pdf_id, self.name, callback_url)
+        job.future = Future()
+        job.progress.publish("uploaded")
+        job.progress.publish("queued")
+        # Worker chạy trong bản sao context nên báo được tiến độ của chính job này
+        with progress_context(job.progress):
+            job.work = self.submit(fn, *args)
+
+        def _finish(work):
+            try:
+                result = work.result()
+                if on_success is not None:
+                    on_success(result)
+            except BaseException as e:
+                print(f"Lỗi khi xử lý job {job.job_id}: {str(e)}")
+                job.finished_at = time.time()
+                job.future.set_exception(e)
+            else:
+                job.finished_at = time.time()
+                job.future.set_result(result)
+            job.publish_result()
+
+        job.work.add_done_callback(_finish)
+        self._jobs[job.job_id] = job
+        return job
+
+    def completed_job(self, filename: str, pdf_id: str, pdf_size: int,
+                      callback_url: Optional[str] = None) -> ConversionJob:
+        """Tạo job đã hoàn thành sẵn, dùng khi kết quả có trong cache"""
+        self._prune_jobs()
+        job = ConversionJob(str(uuid.uuid4()), filename, pdf_id, self.name, callback_url)
+        job.future = Future()
+        job.future.set_result(pdf_size)
+        job.finished_at = job.created_at
+        job.progress.publish("uploaded")
+        job.publish_result()
+        self._jobs[job.job_id] = job
+        return job
+
+    def get_job(self, job_id: str) -> Optional[ConversionJob]:
+        return self._jobs.get(job_id)
+
+    def _prune_jobs(self) -> None:
+        # Xóa các job đã xong quá thời gian lưu giữ
+        now = time.time()
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished_at and now - job.finished_at > JOB_TTL_SECONDS]
+        for job_id in expired:
+            self._jobs.pop(job_id, None)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
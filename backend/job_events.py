@@ -0,0 +1,297 @@
+"""Tiến độ của job nền và thông báo khi job xong qua SSE hoặc webhook
+
+Mỗi job giữ lịch sử sự kiện theo từng bước (uploaded, queued, converting hoặc
+signing, optimized, done/error). Client mất kết nối có thể kết nối lại với
+Last-Event-ID để nhận tiếp các bước còn thiếu mà không phải gửi lại file.
+"""
+import os
+import hmac
+import json
+import time
+import asyncio
+import socket
+import hashlib
+import ipaddress
+import threading
+import http.client
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from metrics import REGISTRY, Counter
+
+
+# Chu kỳ gửi comment giữ kết nối SSE (giây), tránh proxy đóng kết nối rảnh
+JOB_EVENTS_KEEPALIVE_SECONDS = float(os.environ.get("JOB_EVENTS_KEEPALIVE_SECONDS", 15))
+WEBHOOK_TIMEOUT_SECONDS = float(os.environ.get("WEBHOOK_TIMEOUT_SECONDS", 10))
+WEBHOOK_RETRIES = int(os.environ.get("WEBHOOK_RETRIES", 3))
+WEBHOOK_RETRY_DELAY_SECONDS = float(os.environ.get("WEBHOOK_RETRY_DELAY_SECONDS", 2))
+# Khi đặt, body webhook được ký HMAC-SHA256 trong header X-Webhook-Signature
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+# Danh sách host được phép nhận webhook, phân tách bằng dấu phẩy; để trống để cho phép mọi host có địa chỉ công khai
+WEBHOOK_ALLOWED_HOSTS = [host.strip().lower() for host in os.environ.get("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()]
+# Cho phép gửi webhook tới địa chỉ nội bộ (loopback, mạng riêng, link-local), chỉ nên bật khi phát triển
+WEBHOOK_ALLOW_PRIVATE = os.environ.get("WEBHOOK_ALLOW_PRIVATE", "0") != "0"
+
+# Tỉ lệ hoàn thành ước lượng của từng bước, client dùng để hiện thanh tiến độ
+STAGE_PROGRESS = {
+    "uploaded": 0.1,
+    "queued": 0.2,
+    "converting": 0.4,
+    "signing": 0.4,
+    "optimized": 0.8,
+    "done": 1.0,
+    "error": 1.0,
+}
+TERMINAL_STAGES = ("done", "error")
+
+WEBHOOK_DELIVERIES = REGISTRY.register(Counter(
+    "pdf_service_webhook_deliveries_total", "Số webhook đã gửi theo kết quả", ["result"]))
+
+_webhook_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="webhook")
+_current_progress: ContextVar[Optional["JobProgress"]] = ContextVar("job_progress", default=None)
+
+
+def _host_allowlisted(host: str) -> bool:
+    # Host được cấu hình rõ ràng thì tin tưởng, kể cả khi là dịch vụ nội bộ
+    return host.lower() in WEBHOOK_ALLOWED_HOSTS
+
+
+def _address_allowed(address: str) -> bool:
+    """Địa chỉ IP có được nhận webhook không: chặn loopback, mạng riêng, link-local (metadata cloud)..."""
+    if WEBHOOK_ALLOW_PRIVATE:
+        return True
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def validate_callback_url(url: str) -> str:
+    """Kiểm tra URL webhook do client gửi, ném ValueError nếu không hợp lệ
+
+    Chỉ kiểm tra được host dạng địa chỉ IP tại đây; tên miền được phân giải và
+    kiểm tra lại ngay lúc kết nối để không bị lách bằng DNS.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("callback_url phải là URL http hoặc https")
+    host = parsed.hostname.lower()
+    if WEBHOOK_ALLOWED_HOSTS:
+        if not _host_allowlisted(host):
+            raise ValueError(f"Host không được phép nhận webhook: {parsed.hostname}")
+        return url
+    if host == "localhost" or host.endswith(".localhost"):
+        if not WEBHOOK_ALLOW_PRIVATE:
+            raise ValueError(f"Không được gửi webhook tới địa chỉ nội bộ: {parsed.hostname}")
+        return url
+    try:
+        allowed = _address_allowed(host)
+    except ValueError:
+        # Tên miền, kiểm tra khi kết nối
+        return url
+    if not allowed:
+        raise ValueError(f"Không được gửi webhook tới địa chỉ nội bộ: {parsed.hostname}")
+    return url
+
+
+def _guarded_connection(address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+    """Như socket.create_connection nhưng chỉ kết nối tới địa chỉ được phép
+
+    Địa chỉ được kiểm tra sau khi phân giải và socket nối thẳng tới địa chỉ đó,
+    nên DNS trả địa chỉ khác giữa lúc kiểm tra và lúc kết nối cũng không lách được.
+    """
+    host, port = address
+    if _host_allowlisted(host):
+        return socket.create_connection(address, timeout, source_address)
+    error = None
+    for family, socktype, proto, _, sockaddr in socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM):
+        if not _address_allowed(sockaddr[0]):
+            error = OSError(f"Không được gửi webhook tới địa chỉ nội bộ: {host} ({sockaddr[0]})")
+            continue
+        sock = socket.socket(family, socktype, proto)
+        try:
+            if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sockaddr)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError(f"Không phân giải được host webhook: {host}")
+
+
+class _GuardedHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # HTTPConnection gán socket.create_connection cho từng instance trong __init__
+        self._create_connection = _guarded_connection
+
+
+class _GuardedHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = _guarded_connection
+
+
+class _GuardedHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(_GuardedHTTPConnection, req)
+
+
+class _GuardedHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(_GuardedHTTPSConnection, req, context=self._context)
+
+
+def _webhook_opener() -> urllib.request.OpenerDirector:
+    """Opener chỉ có HTTP/HTTPS đã chặn địa chỉ nội bộ, không có HTTPRedirectHandler
+
+    Phản hồi 3xx được coi là lỗi thay vì đi theo redirect tới host khác.
+    """
+    opener = urllib.request.OpenerDirector()
+    for handler in (_GuardedHTTPHandler(), _GuardedHTTPSHandler(),
+                    urllib.request.HTTPDefaultErrorHandler(), urllib.request.HTTPErrorProcessor()):
+        opener.add_handler(handler)
+    return opener
+
+
+_opener = _webhook_opener()
+
+
+def deliver_webhook(url: str, payload: dict) -> bool:
+    """POST payload dạng JSON tới url, thử lại với thời gian chờ tăng dần khi lỗi"""
+    body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    headers = {"Content-Type": "application/json", "User-Agent": "pdf-service-webhook"}
+    if WEBHOOK_SECRET:
+        digest = hmac.new(WEBHOOK_SECRET.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        headers["X-Webhook-Signature"] = f"sha256={digest}"
+    for attempt in range(WEBHOOK_RETRIES + 1):
+        if attempt:
+            time.sleep(WEBHOOK_RETRY_DELAY_SECONDS * 2 ** (attempt - 1))
+        request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+        try:
+            with _opener.open(request, timeout=WEBHOOK_TIMEOUT_SECONDS):
+                pass
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Gửi webhook tới {url} thất bại (lần {attempt + 1}): {str(e)}")
+            continue
+        WEBHOOK_DELIVERIES.inc(result="ok")
+        print(f"Đã gửi webhook job {payload.get('job_id')} tới {url}")
+        return True
+    WEBHOOK_DELIVERIES.inc(result="failed")
+    return False
+
+
+class JobProgress:
+    """Lịch sử sự kiện của một job, phát tới các client SSE đang theo dõi
+
+    publish() gọi được từ mọi thread; mỗi subscriber là một asyncio.Queue
+    nhận sự kiện qua call_soon_threadsafe của event loop đã đăng ký.
+    """
+
+    def __init__(self, job_id: str, callback_url: Optional[str] = None):
+        self.job_id = job_id
+        self.callback_url = callback_url
+        self.events = []
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    @property
+    def stage(self) -> Optional[str]:
+        return self.events[-1]["stage"] if self.events else None
+
+    @property
+    def finished(self) -> bool:
+        return self.stage in TERMINAL_STAGES
+
+    def publish(self, stage: str, **data) -> dict:
+        with self._lock:
+            event = {
+                "id": len(self.events) + 1,
+                "job_id": self.job_id,
+                "stage": stage,
+                "progress": STAGE_PROGRESS.get(stage, 0.0),
+                "timestamp": time.time(),
+                **data,
+            }
+            self.events.append(event)
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, event)
+            except RuntimeError:
+                # Event loop của client đã đóng
+                pass
+        if stage in TERMINAL_STAGES and self.callback_url:
+            _webhook_executor.submit(deliver_webhook, self.callback_url, event)
+        return event
+
+    async def stream(self, last_event_id: int = 0, keepalive: float = JOB_EVENTS_KEEPALIVE_SECONDS):
+        """Sinh các sự kiện sau last_event_id rồi chờ sự kiện mới tới khi job xong
+
+        Sinh None sau mỗi keepalive giây không có sự kiện để giữ kết nối.
+        """
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            history = [event for event in self.events if event["id"] > last_event_id]
+            finished = self.finished
+            if not finished:
+                self._subscribers.add(subscriber)
+        try:
+            for event in history:
+                yield event
+            if finished:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber[1].get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if event["id"] <= last_event_id:
+                    continue
+                yield event
+                if event["stage"] in TERMINAL_STAGES:
+                    return
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+
+def sse_message(event: Optional[dict]) -> str:
+    """Định dạng một sự kiện theo chuẩn text/event-stream, None là comment giữ kết nối"""
+    if event is None:
+        return ": keepalive\n\n"
+    return f"id: {event['id']}\nevent: {event['stage']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@contextmanager
+def progress_context(progress: Optional[JobProgress]):
+    """Gắn job với context hiện tại để worker báo tiến độ qua report_progress"""
+    token = _current_progress.set(progress)
+    try:
+        yield
+    finally:
+        _current_progress.reset(token)
+
+
+def report_progress(stage: str, **data) -> None:
+    """Báo một bước của job đang chạy; không làm gì khi không chạy trong job
+
+    Với pool process, context không được chuyển sang process con nên các bước
+    bên trong worker không được báo, client chỉ thấy queued rồi done/error.
+    """
+    progress = _current_progress.get()
+    if progress is not None:
+        progress.publish(stage, **data)
+
+
+def shutdown_webhooks() -> None:
+    _webhook_executor.shutdown(wait=False, cancel_futures=True)
@@ -1,51 +1,49 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
-from fastapi.responses import FileResponse
+import time
+# Mốc bắt đầu import để đo thời gian khởi động
+_import_started = time.perf_counter()
+from fastapi import FastAPI, Request, HTTPException, Query
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
 import uuid
-import shutil
-import time
-import base64
+import json
+import asyncio
 from io import BytesIO
-from docx2pdf import convert
+from concurrent.futures import ThreadPoolExecutor
+from conversion_queue import ConversionEngine, QueueFullError, convert_docx_file
+from conversion_cache import ConversionCache
+from conversion_backends import close_backend, get_backend
+from upload_stream import MAX_BATCH_UPLOAD_BYTES, MAX_UPLOAD_BYTES, UploadRejected, ingest_multipart
+from zip_stream import ZipStreamWriter, extract_docx_entries
+from metrics import REGISTRY, DiskUsage, Gauge, Counter, MetricsMiddleware, stage
+from artifacts import LOCAL_UPLOAD_TTL_SECONDS, atomic_write, check_pdf_header, run_janitor
+from storage import STORAGE_DIR, create_artifact_store
+from pdf_response import content_etag, make_etag, pdf_file_response, segmented_file_response
+from page_render import (
+    IMAGE_FORMATS, PAGE_PREWARM_SIZES, PAGE_RENDER_DEFAULT_FORMAT, PAGE_RENDER_DEFAULT_SIZE,
+    PAGE_RENDER_MAX_SIZE, PAGE_RENDER_MIN_SIZE, RENDER_AVAILABLE, THUMBNAIL_SIZE,
+    PageNotFound, PageRenderCache, RenderUnavailable
+)
+from pdf_optimize import PDF_OPTIMIZE, optimize_pdf
 import urllib.parse
 from fastapi.staticfiles import StaticFiles
-from typing import Optional
-from PyPDF2 import PdfReader, PdfWriter
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.utils import ImageReader
-from PIL import Image
-from datetime import datetime
-import unicodedata
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-VIETNAMESE_FONT_AVAILABLE = False
-try:
-    font_path = os.path.join(os.path.dirname(__file__), 'fonts', 'DejaVuSans.ttf')
-    if os.path.exists(font_path):
-        pdfmetrics.registerFont(TTFont('DejaVuSans', font_path))
-        pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', os.path.join(os.path.dirname(__file__), 'fonts', 'DejaVuSans-Bold.ttf')))
-        VIETNAMESE_FONT_AVAILABLE = True
-        print("Đã đăng ký font DejaVuSans để hỗ trợ tiếng Việt")
-    else:
-        noto_path = os.path.join(os.path.dirname(__file__), 'fonts', 'NotoSans-Regular.ttf')
-        if os.path.exists(noto_path):
-            pdfmetrics.registerFont(TTFont('NotoSans', noto_path))
-            pdfmetrics.registerFont(TTFont('NotoSans-Bold', os.path.join(os.path.dirname(__file__), 'fonts', 'NotoSans-Bold.ttf')))
-            VIETNAMESE_FONT_AVAILABLE = True
-            print("Đã đăng ký font NotoSans để hỗ trợ tiếng Việt")
-        else:
-            raise Exception("Không tìm thấy font hỗ trợ tiếng Việt")
-except Exception as e:
-    VIETNAMESE_FONT_AVAILABLE = False
-    print(f"Không thể đăng ký font hỗ trợ tiếng Việt: {str(e)}")
-    print("Sử dụng font Helvetica mặc định của ReportLab")
-def normalize_vietnamese_text(text):
-    if not VIETNAMESE_FONT_AVAILABLE:
-        text = unicodedata.normalize('NFKD', text)
-        text = ''.join([c for c in text if not unicodedata.combining(c)])
-    return text
+from starlette.concurrency import run_in_threadpool
+from typing import TYPE_CHECKING, Optional
+from signing_resources import get_signature_assets, get_signature_template
+from signature_layout import LayoutError, parse_layout, signature_area
+from job_events import report_progress, shutdown_webhooks, sse_message, validate_callback_url
+from startup import PREWARM_BLOCKING, prewarm_names, process_uptime, record_phase, register_prewarm, run_prewarm
+import signing_resources
+import page_render
+import pdf_optimize
+
+if TYPE_CHECKING:
+    from PyPDF2 import PageObject
+
+# Chế độ ký: "incremental" nối thêm trang chữ ký, "rewrite" ghi lại toàn bộ PDF
+SIGNING_MODE = os.environ.get("SIGNING_MODE", "incremental")
+# Phần tĩnh của trang chữ ký được dựng sẵn một lần, khi ký lần đầu hoặc khi prewarm
+USE_SIGNATURE_TEMPLATE = os.environ.get("SIGNATURE_TEMPLATE", "1") != "0"
 app = FastAPI(title="DOCX to PDF Converter")
 app.add_middleware(
     CORSMiddleware,
@@ -59,59 +57,243 @@ os.makedirs("static/pdfs", exist_ok=True)
 os.makedirs("static/signatures", exist_ok=True)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# Pool chuyển đổi dùng chung, tránh chặn event loop khi docx2pdf chạy lâu
+conversion_engine = ConversionEngine()
+# Pool riêng cho việc ký PDF, dùng cho cả /sign-pdf và /sign-pdf/batch
+signing_engine = ConversionEngine(
+    max_workers=int(os.environ.get("SIGNING_WORKERS", os.cpu_count() or 2)),
+    queue_size=int(os.environ.get("SIGNING_QUEUE_SIZE", 64)),
+    executor=os.environ.get("SIGNING_EXECUTOR", "thread"),
+    name="sign"
+)
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 500))
+
+# Kho PDF phân mảnh, id được phân giải qua chỉ mục metadata
+artifact_store = create_artifact_store()
+# Cache kết quả chuyển đổi theo hash nội dung DOCX, PDF được kiểm tra qua chỉ mục của kho
+conversion_cache = ConversionCache(exists=lambda entry: artifact_store.exists(entry["pdf_id"]))
+# Cache ảnh trang cho xem trước, trang đầu được render sẵn trên một thread riêng
+page_cache = PageRenderCache()
+page_prewarm_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-prewarm")
+
+# Metric được tính khi scrape từ trạng thái của pool, cache và thư mục lưu trữ
+POOLS = {"convert": conversion_engine, "sign": signing_engine}
+REGISTRY.register(Gauge("pdf_service_pool_queued", "Số job đang chờ trong hàng đợi", ["pool"])).set_function(
+    lambda: {name: pool.pending - pool.in_flight for name, pool in POOLS.items()})
+REGISTRY.register(Gauge("pdf_service_pool_in_flight", "Số job đang được worker xử lý", ["pool"])).set_function(
+    lambda: {name: pool.in_flight for name, pool in POOLS.items()})
+REGISTRY.register(Gauge("pdf_service_pool_capacity", "Số job tối đa đang chạy và chờ", ["pool"])).set_function(
+    lambda: {name: pool.max_workers + pool.queue_size for name, pool in POOLS.items()})
+REGISTRY.register(Counter("pdf_service_conversion_cache_hits_total", "Số lần tìm thấy trong cache chuyển đổi")).set_function(
+    lambda: conversion_cache.stats()["hits"])
+REGISTRY.register(Counter("pdf_service_conversion_cache_misses_total", "Số lần không có trong cache chuyển đổi")).set_function(
+    lambda: conversion_cache.stats()["misses"])
+REGISTRY.register(Gauge("pdf_service_conversion_cache_hit_ratio", "Tỉ lệ hit của cache chuyển đổi")).set_function(
+    lambda: conversion_cache.stats()["hit_ratio"])
+REGISTRY.register(Gauge("pdf_service_conversion_cache_bytes", "Tổng kích thước PDF trong cache chuyển đổi")).set_function(
+    lambda: conversion_cache.stats()["bytes"])
+REGISTRY.register(Counter("pdf_service_page_cache_hits_total", "Số lần ảnh trang có sẵn trong cache")).set_function(
+    lambda: page_cache.stats()["hits"])
+REGISTRY.register(Counter("pdf_service_page_cache_misses_total", "Số lần phải render ảnh trang")).set_function(
+    lambda: page_cache.stats()["misses"])
+REGISTRY.register(Gauge("pdf_service_page_cache_bytes", "Tổng kích thước ảnh trang trong cache")).set_function(
+    lambda: page_cache.stats()["bytes"])
+# Cây thư mục phân mảnh của kho có thể chứa hàng triệu file, dung lượng lấy từ chỉ mục thay vì duyệt đĩa
+DISK_USAGE_SIZERS = {STORAGE_DIR: lambda: artifact_store.index.totals(backend="local")["stored"]}
+REGISTRY.register(Gauge("pdf_service_disk_usage_bytes", "Dung lượng đĩa theo thư mục", ["directory"])).set_function(
+    DiskUsage(["temp", STORAGE_DIR, "static/signatures", "cache", "data"], sizers=DISK_USAGE_SIZERS))
+REGISTRY.register(Gauge("pdf_service_storage_bytes", "Tổng kích thước tài liệu (logical) và số byte thực lưu (stored)", ["kind"])).set_function(
+    lambda: artifact_store.index.totals())
+app.add_middleware(MetricsMiddleware)
+
+@app.on_event("startup")
+async def start_janitor():
+    startup_started = time.perf_counter()
+    # Dọn dẹp định kỳ temp/, chữ ký cũ và file local_* quá hạn, kèm ghi lại thứ tự LRU của cache chuyển đổi
+    app.state.janitor_task = asyncio.create_task(run_janitor(tasks=[expire_local_uploads, conversion_cache.flush]))
+    # Các phân hệ nặng được nạp khi dùng lần đầu, PREWARM chọn phân hệ nạp sẵn ngay khi khởi động
+    names = prewarm_names()
+    if os.environ.get("CONVERSION_PREWARM", "1") == "0" and "conversion" in names:
+        names.remove("conversion")
+    if names:
+        prewarm = asyncio.get_running_loop().run_in_executor(None, run_prewarm, names)
+        if PREWARM_BLOCKING:
+            await prewarm
+    record_phase("startup", time.perf_counter() - startup_started)
+    uptime = process_uptime()
+    if uptime is not None:
+        record_phase("ready", uptime)
+        print(f"Sẵn sàng nhận request sau {uptime:.2f}s kể từ khi process khởi động")
+
+def expire_local_uploads():
+    artifact_store.expire("local", LOCAL_UPLOAD_TTL_SECONDS)
+    artifact_store.prune_assembled()
+    # Với S3, bản local chỉ là bộ đệm nên có thể dọn theo thời gian truy cập
+    if artifact_store.backend.name == "s3":
+        artifact_store.backend.prune()
+
+def prewarm_conversion_backend():
+    # Khởi động sẵn backend chuyển đổi (ví dụ pool soffice); với pool process, mỗi process con tự tạo backend
+    if conversion_engine.executor_kind == "thread":
+        get_backend().prewarm()
+
+register_prewarm("conversion", prewarm_conversion_backend)
+register_prewarm("signing", signing_resources.prewarm)
+register_prewarm("render", page_render.prewarm)
+register_prewarm("optimize", pdf_optimize.prewarm)
+
+@app.on_event("shutdown")
+async def shutdown_conversion_engine():
+    app.state.janitor_task.cancel()
+    conversion_engine.shutdown()
+    signing_engine.shutdown()
+    page_prewarm_executor.shutdown(wait=False, cancel_futures=True)
+    shutdown_webhooks()
+    conversion_cache.flush()
+    close_backend()
+
+async def receive_upload(request: Request, upload_dir: str, file_kinds: dict, **options):
+    """Nhận multipart theo luồng, chuyển lỗi upload thành HTTPException"""
+    try:
+        return await ingest_multipart(request, upload_dir, file_kinds, **options)
+    except UploadRejected as e:
+        print(f"Từ chối upload: {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+async def receive_docx_upload(request: Request, docx_path: str):
+    """Nhận file DOCX ghi thẳng vào docx_path, trả về (tên file, hash nội dung, các trường form)"""
+    fields, files = await receive_upload(request, "temp", {"file": "docx"})
+    upload = files.get("file")
+    if upload is None:
+        raise HTTPException(status_code=400, detail="Thiếu file DOCX")
+    if not upload.filename.endswith('.docx'):
+        upload.discard()
+        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file DOCX")
+    os.replace(upload.path, docx_path)
+    return upload.filename, upload.sha256, fields
+
+def queue_full_response(error: QueueFullError) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(error)},
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
 @app.get("/")
 async def read_root():
     return {"message": "DOCX to PDF Converter API"}
 
 @app.get("/view/{pdf_id}")
-async def view_pdf(pdf_id: str):
-    pdf_path = f"static/pdfs/{pdf_id}.pdf"
+async def view_pdf(pdf_id: str, request: Request):
+    record = await run_in_threadpool(artifact_store.get, pdf_id)
+    if record is not None and record["base_size"] is not None:
+        return await view_delta_pdf(request, record)
+
+    # Phân giải id qua chỉ mục, backend S3 có thể phải tải file về bộ đệm
+    pdf_path = await run_in_threadpool(artifact_store.resolve, pdf_id)
     print(f"Yêu cầu xem PDF: {pdf_id}, đường dẫn: {pdf_path}")
+    if pdf_path is None:
+        raise HTTPException(status_code=404, detail="PDF không tồn tại")
     
-    if not os.path.exists(pdf_path):
+    # Header đã được kiểm tra khi file được ghi, không cần đọc lại ở mỗi request
+    try:
+        # File local_* có thể bị client tải lên lại nên chỉ cho cache kèm kiểm tra lại.
+        # ETag lấy từ hash trong chỉ mục để không đổi khi backend S3 tải lại file vào bộ đệm
+        validators = {}
+        if record is not None:
+            validators = {"etag": content_etag(record["sha256"]), "mtime": record["created_at"]}
+        response = pdf_file_response(
+            request, pdf_path, f"{pdf_id}.pdf", immutable=not pdf_id.startswith("local_"), **validators
+        )
+    except FileNotFoundError:
         print(f"PDF không tồn tại: {pdf_path}")
         raise HTTPException(status_code=404, detail="PDF không tồn tại")
-    file_size = os.path.getsize(pdf_path)
-    try:
-        with open(pdf_path, 'rb') as f:
-            header = f.read(10)
-            header_hex = ' '.join([f'{b:02x}' for b in header])
-            print(f"PDF header (hex): {header_hex}")
-            if not header.startswith(b'%PDF-'):
-                print(f"File không phải định dạng PDF, header: {header_hex}")
-                raise HTTPException(status_code=400, detail="File không phải định dạng PDF")
-            
-            # Log phiên bản PDF
-            pdf_version = header[5:8].decode('ascii', errors='ignore')
-            print(f"Phiên bản PDF: {pdf_version}")
-    except Exception as e:
-        print(f"Lỗi khi đọc file PDF: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Lỗi khi đọc file: {str(e)}")
     
-    print(f"Trả về file PDF: {pdf_path}, kích thước: {file_size} bytes")
+    print(f"Trả về PDF: {pdf_path}, mã trạng thái: {response.status_code}")
+    return response
 
-    response = FileResponse(
-        path=pdf_path,
-        media_type="application/pdf",
-        headers={
-            "Content-Type": "application/pdf",
-            "Content-Disposition": f"inline; filename={pdf_id}.pdf",
-            "Content-Length": str(file_size),
-            "Cache-Control": "no-cache",
-            "X-Content-Type-Options": "nosniff"
-        }
-    )
-    
+async def view_delta_pdf(request: Request, record: dict):
+    """Bản ký lưu dạng delta: gửi file gốc rồi phần nối thêm, không ghép ra đĩa"""
+    segments = await run_in_threadpool(artifact_store.segments, record["id"])
+    if segments is None:
+        print(f"Thiếu dữ liệu để ghép PDF: {record['id']}")
+        raise HTTPException(status_code=404, detail="PDF không tồn tại")
+    print(f"Yêu cầu xem PDF: {record['id']}, ghép từ {len(segments)} phần")
+    try:
+        response = segmented_file_response(
+            request, segments, content_etag(record["sha256"]), record["created_at"], f"{record['id']}.pdf"
+        )
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="PDF không tồn tại")
+    print(f"Trả về PDF: {record['id']}, mã trạng thái: {response.status_code}")
     return response
 
-@app.post("/convert")
-async def convert_docx_to_pdf(file: UploadFile = File(...)):
-    # Log để debug
-    print(f"Nhận yêu cầu chuyển đổi file: {file.filename}")
+def render_pdf_page(pdf_id: str, page_number: int, size: int, image_format: str) -> Optional[str]:
+    """Đường dẫn ảnh một trang của PDF đã lưu, None nếu không có PDF"""
+    pdf_path = artifact_store.resolve(pdf_id)
+    if pdf_path is None:
+        return None
+    # Phiên bản của PDF nằm trong khóa cache, file local_* tải lên lại sẽ được render lại
+    record = artifact_store.get(pdf_id)
+    version = record["sha256"] if record is not None else make_etag(os.stat(pdf_path))
+    return page_cache.get_or_render(pdf_path, pdf_id, page_number, size, image_format, version)
 
-    if not file.filename.endswith('.docx'):
-        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file DOCX")
-    
+def prewarm_first_page(pdf_id: str) -> None:
+    for size in PAGE_PREWARM_SIZES:
+        try:
+            render_pdf_page(pdf_id, 1, size, PAGE_RENDER_DEFAULT_FORMAT)
+        except Exception as e:
+            print(f"Không thể render sẵn trang đầu của {pdf_id}: {str(e)}")
+            return
+
+def schedule_page_prewarm(pdf_id: str) -> None:
+    """Render sẵn trang đầu để client xem trước ngay, gọi được từ mọi thread"""
+    if RENDER_AVAILABLE and PAGE_PREWARM_SIZES:
+        page_prewarm_executor.submit(prewarm_first_page, pdf_id)
+
+async def page_image_response(request: Request, pdf_id: str, page_number: int, size: int, image_format: str):
+    if image_format not in IMAGE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Định dạng ảnh không hỗ trợ: {image_format}")
+    if not PAGE_RENDER_MIN_SIZE <= size <= PAGE_RENDER_MAX_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Kích thước phải trong khoảng {PAGE_RENDER_MIN_SIZE}-{PAGE_RENDER_MAX_SIZE} pixel"
+        )
+    # Ảnh có thể bị cache loại bỏ ngay sau khi render, khi đó render lại một lần
+    for attempt in range(2):
+        try:
+            with stage("render_page"):
+                image_path = await run_in_threadpool(render_pdf_page, pdf_id, page_number, size, image_format)
+        except RenderUnavailable as e:
+            raise HTTPException(status_code=501, detail=str(e))
+        except PageNotFound as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        if image_path is None:
+            raise HTTPException(status_code=404, detail="PDF không tồn tại")
+        try:
+            return pdf_file_response(
+                request, image_path, f"{pdf_id}_{page_number}.{image_format}",
+                immutable=not pdf_id.startswith("local_"), media_type=IMAGE_FORMATS[image_format][1]
+            )
+        except FileNotFoundError:
+            print(f"Ảnh trang bị loại khỏi cache trước khi gửi: {image_path} (lần {attempt + 1})")
+    raise HTTPException(status_code=503, detail="Cache ảnh trang đang quá tải, thử lại sau",
+                        headers={"Retry-After": "1"})
+
+@app.get("/view/{pdf_id}/pages/{page_number}")
+async def view_pdf_page(pdf_id: str, page_number: int, request: Request,
+                        size: int = PAGE_RENDER_DEFAULT_SIZE,
+                        image_format: str = Query(PAGE_RENDER_DEFAULT_FORMAT, alias="format")):
+    # Ảnh một trang (đếm từ 1), size là cạnh dài tính bằng pixel
+    return await page_image_response(request, pdf_id, page_number, size, image_format)
+
+@app.get("/view/{pdf_id}/thumbnail")
+async def view_pdf_thumbnail(pdf_id: str, request: Request, size: int = THUMBNAIL_SIZE,
+                             image_format: str = Query(PAGE_RENDER_DEFAULT_FORMAT, alias="format")):
+    return await page_image_response(request, pdf_id, 1, size, image_format)
+
+@app.post("/convert")
+async def convert_docx_to_pdf(request: Request):
     # Tạo ID duy nhất cho file
     file_id = str(uuid.uuid4())
     timestamp = int(time.time())
@@ -120,36 +302,41 @@ async def convert_docx_to_pdf(file: UploadFile = File(...)):
     # Đường dẫn đến file
     docx_path = f"temp/{file_id}.docx"
     pdf_temp_path = f"temp/{file_id}.pdf"
-    pdf_static_path = f"static/pdfs/{pdf_id}.pdf"
     
+    # Nhận file DOCX theo luồng, hash và kiểm tra định dạng trong cùng một lượt ghi
+    with stage("upload"):
+        filename, digest, _ = await receive_docx_upload(request, docx_path)
+
+    # Log để debug
+    print(f"Nhận yêu cầu chuyển đổi file: {filename}")
+    print(f"Đã lưu file DOCX tại: {docx_path}")
+
     try:
-        # Lưu file DOCX tải lên
-        with open(docx_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Log để debug
-        print(f"Đã lưu file DOCX tại: {docx_path}")
-        
-        # Chuyển đổi DOCX sang PDF
-        convert(docx_path, pdf_temp_path)
-        
-        # Kiểm tra xem file PDF đã được tạo chưa
-        if not os.path.exists(pdf_temp_path):
-            raise Exception(f"Không thể tạo file PDF: {pdf_temp_path}")
-            
-        # Kiểm tra kích thước file PDF
-        pdf_size = os.path.getsize(pdf_temp_path)
-        if pdf_size == 0:
-            raise Exception(f"File PDF được tạo nhưng rỗng: {pdf_temp_path}")
-            
-        # Sao chép file vào thư mục static để có thể phục vụ trực tiếp
-        shutil.copy2(pdf_temp_path, pdf_static_path)
-        
-        # Log để debug
-        print(f"Đã chuyển đổi thành công sang PDF: {pdf_static_path}, kích thước: {pdf_size} bytes")
+        # Tìm trong cache theo hash nội dung, file giống hệt không cần chuyển đổi lại
+        with stage("cache_lookup"):
+            cached, response_path = await lookup_converted_pdf(digest)
+        if response_path is not None:
+            os.remove(docx_path)
+            pdf_id = cached["pdf_id"]
+            cache_status = "HIT"
+            print(f"Dùng lại PDF từ cache: {response_path}")
+        else:
+            # Chuyển đổi DOCX sang PDF trên pool worker, không chặn event loop
+            with stage("convert"):
+                pdf_size = await conversion_engine.run(
+                    convert_docx_file, docx_path, pdf_temp_path
+                )
+            with stage("store"):
+                record = await run_in_threadpool(store_converted_pdf, pdf_temp_path, pdf_id, filename, digest)
+            response_path = record["path"]
+            cache_status = "MISS"
+            schedule_page_prewarm(pdf_id)
+
+            # Log để debug
+            print(f"Đã chuyển đổi thành công sang PDF: {response_path}, kích thước: {pdf_size} bytes")
         
         # Xử lý tên file an toàn (không có ký tự đặc biệt) cho header
-        pdf_filename = file.filename.replace('.docx', '.pdf')
+        pdf_filename = filename.replace('.docx', '.pdf')
         safe_filename = urllib.parse.quote(pdf_filename)
         
         # URL để xem PDF trực tiếp
@@ -157,7 +344,7 @@ async def convert_docx_to_pdf(file: UploadFile = File(...)):
         
         # Trả về file PDF với headers chính xác và URL để xem
         response = FileResponse(
-            path=pdf_temp_path, 
+            path=response_path, 
             filename=pdf_filename,
             media_type="application/pdf",
             headers={
@@ -167,7 +354,13 @@ async def convert_docx_to_pdf(file: UploadFile = File(...)):
         )
         response.headers["X-PDF-View-URL"] = view_url
         response.headers["X-PDF-ID"] = pdf_id
+        response.headers["X-Conversion-Cache"] = cache_status
         return response
+    except QueueFullError as e:
+        print(f"Hàng đợi chuyển đổi đầy, từ chối file: {filename}")
+        if os.path.exists(docx_path):
+            os.remove(docx_path)
+        return queue_full_response(e)
     except Exception as e:
         # Xử lý lỗi
         print(f"Lỗi xử lý file: {str(e)}")
@@ -176,65 +369,356 @@ async def convert_docx_to_pdf(file: UploadFile = File(...)):
         if os.path.exists(pdf_temp_path):
             os.remove(pdf_temp_path)
         raise HTTPException(status_code=500, detail=f"Lỗi xử lý: {str(e)}")
-    finally:
-        # Đóng file
-        file.file.close()
+
+def store_converted_pdf(pdf_temp_path: str, pdf_id: str, filename: str, digest: str) -> dict:
+    """Đưa PDF vừa chuyển đổi vào kho và ghi vào cache chuyển đổi"""
+    record = artifact_store.put(pdf_temp_path, pdf_id, "converted", source_name=filename, source_sha256=digest)
+    conversion_cache.store(digest, pdf_id, record["path"], record["size"])
+    return record
+
+def find_converted_pdf(digest: str):
+    cached = conversion_cache.lookup(digest)
+    if cached is None:
+        return None, None
+    pdf_path = artifact_store.resolve(cached["pdf_id"])
+    if pdf_path is None:
+        return None, None
+    return cached, pdf_path
+
+async def lookup_converted_pdf(digest: str):
+    """Tìm PDF đã chuyển đổi theo hash DOCX, trả về (entry cache, đường dẫn) hoặc (None, None)"""
+    # Cache kiểm tra PDF còn trong kho qua chỉ mục SQLite, chạy trên thread pool để không chặn event loop
+    return await run_in_threadpool(find_converted_pdf, digest)
+
+async def receive_batch_documents(request: Request) -> list:
+    """Nhận nhiều file DOCX hoặc ZIP, trả về [(tên file, đường dẫn DOCX, sha256)]"""
+    _, uploads = await receive_upload(request, "temp", {"files": "docx", "file": "docx"}, multiple=True)
+    documents = []
+    # Tổng dung lượng DOCX sau giải nén của cả lô, tránh ZIP nhỏ bung ra hàng chục GB
+    total_bytes = 0
+    try:
+        for upload in uploads:
+            if upload.filename.lower().endswith(".zip"):
+                extracted = await run_in_threadpool(
+                    extract_docx_entries, upload.path, "temp", MAX_BATCH_SIZE - len(documents), MAX_UPLOAD_BYTES,
+                    MAX_BATCH_UPLOAD_BYTES - total_bytes
+                )
+                documents += extracted
+                total_bytes += sum(os.path.getsize(path) for _, path, _ in extracted)
+                upload.discard()
+            elif upload.filename.lower().endswith(".docx"):
+                docx_path = f"temp/{uuid.uuid4()}.docx"
+                os.replace(upload.path, docx_path)
+                documents.append((upload.filename, docx_path, upload.sha256))
+                total_bytes += upload.size
+            else:
+                raise ValueError(f"Chỉ hỗ trợ file .docx hoặc .zip: {upload.filename}")
+        if not documents:
+            raise ValueError("Không có file DOCX nào được gửi lên")
+        if len(documents) > MAX_BATCH_SIZE:
+            raise ValueError(f"Tối đa {MAX_BATCH_SIZE} file mỗi lô")
+    except ValueError as e:
+        for upload in uploads:
+            upload.discard()
+        for _, docx_path, _ in documents:
+            if os.path.exists(docx_path):
+                os.remove(docx_path)
+        raise HTTPException(status_code=400, detail=str(e))
+    return documents
+
+@app.post("/convert/batch")
+async def convert_docx_batch(request: Request):
+    """Chuyển đổi nhiều DOCX song song, trả về ZIP các PDF theo luồng kèm manifest.json"""
+    documents = await receive_batch_documents(request)
+    print(f"Nhận yêu cầu chuyển đổi lô {len(documents)} file")
+
+    # Mỗi lô chỉ chiếm tối đa số worker của pool để không làm đầy hàng đợi
+    batch_slots = asyncio.Semaphore(conversion_engine.max_workers)
+
+    async def convert_one(filename: str, docx_path: str, digest: str) -> dict:
+        file_id = str(uuid.uuid4())
+        pdf_id = f"{int(time.time())}_{file_id[:8]}"
+        pdf_temp_path = f"temp/{file_id}.pdf"
+        try:
+            cached, pdf_path = await lookup_converted_pdf(digest)
+            if pdf_path is not None:
+                os.remove(docx_path)
+                pdf_id, cache_status = cached["pdf_id"], "HIT"
+            else:
+                async with batch_slots:
+                    await conversion_engine.run(convert_docx_file, docx_path, pdf_temp_path)
+                record = await run_in_threadpool(store_converted_pdf, pdf_temp_path, pdf_id, filename, digest)
+                pdf_path, cache_status = record["path"], "MISS"
+        except Exception as e:
+            print(f"Lỗi khi chuyển đổi {filename} trong lô: {str(e)}")
+            for path in (docx_path, pdf_temp_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return {"filename": filename, "status": "error", "error": str(e)}
+        return {"filename": filename, "status": "ok", "pdf_id": pdf_id, "view_url": f"/view/{pdf_id}",
+                "cache": cache_status, "pdf_path": pdf_path}
+
+    async def stream_archive():
+        archive = ZipStreamWriter()
+        manifest = []
+        tasks = [asyncio.ensure_future(convert_one(*document)) for document in documents]
+        try:
+            # Ghi PDF vào ZIP theo thứ tự hoàn thành, không chờ cả lô
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                pdf_path = result.pop("pdf_path", None)
+                if pdf_path is not None:
+                    result["archive_name"] = archive.unique_name(os.path.splitext(result["filename"])[0] + ".pdf")
+                    async for chunk in archive.add_file(result["archive_name"], pdf_path):
+                        if chunk:
+                            yield chunk
+                manifest.append(result)
+        finally:
+            for task in tasks:
+                task.cancel()
+        succeeded = sum(1 for result in manifest if result["status"] == "ok")
+        print(f"Đã chuyển đổi lô: {succeeded}/{len(documents)} file thành công")
+        yield archive.add_bytes("manifest.json", json.dumps({
+            "total": len(documents),
+            "succeeded": succeeded,
+            "failed": len(documents) - succeeded,
+            "files": manifest
+        }, ensure_ascii=False, indent=2).encode("utf-8"))
+        yield archive.close()
+
+    return StreamingResponse(
+        stream_archive(),
+        media_type="application/zip",
+        headers={"Content-Disposition": "attachment; filename=converted_pdfs.zip"}
+    )
+
+@app.post("/jobs/convert", status_code=202)
+async def submit_conversion_job(request: Request):
+    """Tạo job chuyển đổi nền, trả về job id ngay lập tức"""
+    file_id = str(uuid.uuid4())
+    pdf_id = f"{int(time.time())}_{file_id[:8]}"
+    docx_path = f"temp/{file_id}.docx"
+    pdf_temp_path = f"temp/{file_id}.pdf"
+
+    filename, digest, fields = await receive_docx_upload(request, docx_path)
+    try:
+        callback_url = read_callback_url(fields, {})
+    except HTTPException:
+        os.remove(docx_path)
+        raise
+    print(f"Nhận job chuyển đổi file: {filename}")
+
+    try:
+        cached, pdf_path = await lookup_converted_pdf(digest)
+        if pdf_path is not None:
+            os.remove(docx_path)
+            job = conversion_engine.completed_job(filename, cached["pdf_id"], cached["size"],
+                                                  callback_url=callback_url)
+        else:
+            def on_success(pdf_size: int) -> None:
+                store_converted_pdf(pdf_temp_path, pdf_id, filename, digest)
+                schedule_page_prewarm(pdf_id)
+
+            job = conversion_engine.submit_job(
+                filename, pdf_id, convert_docx_file, docx_path, pdf_temp_path,
+                on_success=on_success, callback_url=callback_url
+            )
+    except QueueFullError as e:
+        print(f"Hàng đợi chuyển đổi đầy, từ chối job: {filename}")
+        if os.path.exists(docx_path):
+            os.remove(docx_path)
+        return queue_full_response(e)
+
+    print(f"Đã tạo job chuyển đổi: {job.job_id}")
+    return job_created_response(job)
+
+def job_created_response(job) -> dict:
+    return {
+        "job_id": job.job_id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.job_id}",
+        "events_url": f"/jobs/{job.job_id}/events",
+        "result_url": f"/jobs/{job.job_id}/result"
+    }
+
+def find_job(job_id: str):
+    job = conversion_engine.get_job(job_id) or signing_engine.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job không tồn tại")
+    return job
+
+@app.get("/metrics")
+async def get_metrics():
+    # Tính dung lượng thư mục có thể chạm đĩa nên chạy ngoài event loop
+    body = await run_in_threadpool(REGISTRY.render)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    return conversion_cache.stats()
+
+@app.get("/jobs/{job_id}")
+async def get_conversion_job(job_id: str):
+    return find_job(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str, request: Request):
+    """Luồng SSE tiến độ của job, kết thúc sau sự kiện done hoặc error
+
+    Client kết nối lại gửi header Last-Event-ID để chỉ nhận các sự kiện còn thiếu.
+    """
+    job = find_job(job_id)
+    try:
+        last_event_id = int(request.headers.get("last-event-id", 0))
+    except ValueError:
+        last_event_id = 0
+
+    async def event_stream():
+        async for event in job.progress.stream(last_event_id):
+            yield sse_message(event)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/jobs/{job_id}/result")
+async def get_conversion_job_result(job_id: str):
+    job = find_job(job_id)
+    status = job.status
+    if status == "error":
+        raise HTTPException(status_code=500, detail=f"Lỗi xử lý: {job.error}")
+    if status != "done":
+        raise HTTPException(status_code=409, detail=f"Job chưa hoàn thành, trạng thái: {status}")
+
+    pdf_path = await run_in_threadpool(artifact_store.resolve, job.pdf_id)
+    if pdf_path is None:
+        raise HTTPException(status_code=404, detail="PDF không tồn tại")
+
+    pdf_filename = job.filename.replace('.docx', '.pdf')
+    if job.kind == "sign":
+        pdf_filename = f"signed_{pdf_filename}"
+    safe_filename = urllib.parse.quote(pdf_filename)
+    response = FileResponse(
+        path=pdf_path,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f"attachment; filename*=UTF-8''{safe_filename}"}
+    )
+    response.headers["X-PDF-View-URL"] = f"/view/{job.pdf_id}"
+    response.headers["X-PDF-ID"] = job.pdf_id
+    return response
+
+def require_pdf_id(fields: dict, files: dict) -> str:
+    pdf_id = fields.get("pdf_id")
+    if not pdf_id:
+        for upload in files.values():
+            upload.discard()
+        raise HTTPException(status_code=400, detail="Thiếu pdf_id")
+    return pdf_id
+
+def read_callback_url(fields: dict, files: dict) -> Optional[str]:
+    """Đọc callback_url (webhook khi job xong) của endpoint job nền, trả 400 nếu không hợp lệ"""
+    callback_url = fields.get("callback_url")
+    if not callback_url:
+        return None
+    try:
+        return validate_callback_url(callback_url)
+    except ValueError as e:
+        for upload in files.values():
+            upload.discard()
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def resolve_signing_source(pdf_id: str, file) -> str:
+    """Đường dẫn PDF cần ký; file upload có id local_* được lưu vào kho trước"""
+    # Kiểm tra xem có file upload không
+    if file is not None:
+        print(f"Phát hiện file upload: {file.filename}, kích thước: {file.size} bytes")
+        # Nếu là ID tự tạo (local_*), lưu file vào kho với id là pdf_id
+        if pdf_id.startswith("local_"):
+            record = await run_in_threadpool(
+                artifact_store.put, file.path, pdf_id, "local", source_name=file.filename
+            )
+            print(f"Đã lưu file upload vào: {record['path']}")
+        else:
+            file.discard()
+
+    # Phân giải id qua chỉ mục thay vì dò file
+    original_pdf_path = await run_in_threadpool(artifact_store.resolve, pdf_id)
+    if original_pdf_path is None:
+        error_msg = f"PDF không tồn tại: {pdf_id}"
+        print(error_msg)
+        raise HTTPException(status_code=404, detail=error_msg)
+    return original_pdf_path
+
+def decode_signature_fields(fields: dict) -> tuple:
+    """Lưu ảnh chữ ký từ form, trả về (ảnh A, tên A, ảnh B, tên B)"""
+    signature_a_data = fields.get("signature_a_data")
+    signature_b_data = fields.get("signature_b_data")
+    sig_a_path = None
+    if signature_a_data and signature_a_data.startswith('data:image'):
+        sig_a_path = save_signature_image(signature_a_data)
+
+    sig_b_path = None
+    if signature_b_data and signature_b_data.startswith('data:image'):
+        sig_b_path = save_signature_image(signature_b_data)
+    return sig_a_path, fields.get("signature_a_name"), sig_b_path, fields.get("signature_b_name")
+
+def signing_call(fields: dict, files: dict) -> tuple:
+    """Hàm ký và tham số theo form: bố cục nhiều bên nếu có trường layout, ngược lại hai bên A/B
+
+    Ảnh chữ ký được giải mã và chuẩn hóa tại đây nên phải gọi qua run_in_threadpool.
+    """
+    layout = fields.get("layout")
+    if not layout:
+        return add_signatures_to_pdf, decode_signature_fields(fields)
+    try:
+        parties = parse_layout(layout, fields)
+    except LayoutError as e:
+        for upload in files.values():
+            upload.discard()
+        raise HTTPException(status_code=400, detail=str(e))
+    # Mỗi ảnh chỉ lưu một lần, ở độ phân giải của khung lớn nhất dùng ảnh đó
+    areas = {}
+    for party in parties:
+        if party.signature_data and party.signature_data.startswith('data:image'):
+            width, height = signature_area(party)
+            previous_width, previous_height = areas.get(party.signature_data, (0, 0))
+            areas[party.signature_data] = (max(width, previous_width), max(height, previous_height))
+    paths = {data_url: save_signature_image(data_url, area) for data_url, area in areas.items()}
+    for party in parties:
+        party.signature_path = paths.get(party.signature_data)
+        # Ảnh đã lưu ra đĩa, không cần gửi data URL sang worker
+        party.signature_data = None
+    return add_layout_signatures_to_pdf, (parties,)
 
 @app.post("/sign-pdf")
-async def sign_pdf(
-    pdf_id: str = Form(...),
-    signature_a_data: Optional[str] = Form(None),
-    signature_a_name: Optional[str] = Form(None),
-    signature_b_data: Optional[str] = Form(None),
-    signature_b_name: Optional[str] = Form(None),
-    file: Optional[UploadFile] = File(None)
-):
+async def sign_pdf(request: Request):
+    # Nhận form theo luồng, file PDF upload được ghi thẳng xuống temp/
+    with stage("upload"):
+        fields, files = await receive_upload(request, "temp", {"file": "pdf"})
+    pdf_id = require_pdf_id(fields, files)
+    # Lưu chữ ký nếu có, chuẩn hóa ảnh bằng PIL chạy ngoài event loop
+    with stage("decode_signatures"):
+        sign_fn, sign_args = await run_in_threadpool(signing_call, fields, files)
+
     try:
         # Log để debug
         print(f"Nhận yêu cầu ký PDF: {pdf_id}")
+        original_pdf_path = await resolve_signing_source(pdf_id, files.get("file"))
         
-        # Đường dẫn đến file PDF gốc
-        original_pdf_path = f"static/pdfs/{pdf_id}.pdf"
-        
-        # Kiểm tra xem có file upload không
-        if file is not None and file.filename:
-            print(f"Phát hiện file upload: {file.filename}")
-            # Nếu là ID tự tạo (local_*), lưu file vào static/pdfs với tên là pdf_id.pdf
-            if pdf_id.startswith("local_"):
-                original_pdf_path = f"static/pdfs/{pdf_id}.pdf"
-                # Lưu file
-                with open(original_pdf_path, "wb") as buffer:
-                    shutil.copyfileobj(file.file, buffer)
-                print(f"Đã lưu file upload vào: {original_pdf_path}")
-        
-        # Kiểm tra file tồn tại
-        if not os.path.exists(original_pdf_path):
-            error_msg = f"PDF không tồn tại: {original_pdf_path}"
-            print(error_msg)
-            raise HTTPException(status_code=404, detail=error_msg)
-        
-        # ID cho file đã ký
+        # ID cho file đã ký, ghi ra temp/ rồi đưa vào kho
         signed_id = f"signed_{uuid.uuid4()}"
-        signed_pdf_path = f"static/pdfs/{signed_id}.pdf"
-        
-        # Lưu chữ ký nếu có
-        sig_a_path = None
-        if signature_a_data and signature_a_data.startswith('data:image'):
-            sig_a_path = save_signature_image(signature_a_data, "a")
+        signed_pdf_path = f"temp/{signed_id}.pdf"
         
-        sig_b_path = None
-        if signature_b_data and signature_b_data.startswith('data:image'):
-            sig_b_path = save_signature_image(signature_b_data, "b")
-        
-        # Thêm chữ ký vào PDF
-        add_signatures_to_pdf(
-            original_pdf_path,
-            signed_pdf_path,
-            sig_a_path,
-            signature_a_name,
-            sig_b_path,
-            signature_b_name
-        )
+        # Thêm chữ ký vào PDF trên pool ký, không chặn event loop
+        with stage("sign"):
+            await signing_engine.run(sign_fn, original_pdf_path, signed_pdf_path, *sign_args)
+        with stage("store"):
+            await run_in_threadpool(
+                artifact_store.put, signed_pdf_path, signed_id, "signed", parent_id=pdf_id, delta=True
+            )
+        schedule_page_prewarm(signed_id)
         
         # URL để xem PDF đã ký
         view_url = f"/view/{signed_id}"
@@ -245,256 +729,325 @@ async def sign_pdf(
             "pdf_id": signed_id,
             "view_url": view_url
         }
+    except QueueFullError as e:
+        print(f"Hàng đợi ký đầy, từ chối PDF: {pdf_id}")
+        return queue_full_response(e)
+    except LayoutError as e:
+        print(f"Bố cục chữ ký không khớp với PDF {pdf_id}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Lỗi khi ký PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Lỗi khi ký PDF: {str(e)}")
 
-def save_signature_image(data_url: str, prefix: str) -> str:
-    """Lưu chữ ký từ data URL thành file hình ảnh"""
+@app.post("/jobs/sign", status_code=202)
+async def submit_signing_job(request: Request):
+    """Tạo job ký nền với cùng form như /sign-pdf, trả về job id ngay lập tức"""
+    fields, files = await receive_upload(request, "temp", {"file": "pdf"})
+    pdf_id = require_pdf_id(fields, files)
+    callback_url = read_callback_url(fields, files)
+    sign_fn, sign_args = await run_in_threadpool(signing_call, fields, files)
+    file = files.get("file")
+    filename = file.filename if file is not None else f"{pdf_id}.pdf"
+    print(f"Nhận job ký PDF: {pdf_id}")
+
+    original_pdf_path = await resolve_signing_source(pdf_id, file)
+    signed_id = f"signed_{uuid.uuid4()}"
+    signed_pdf_path = f"temp/{signed_id}.pdf"
+
+    def on_success(_) -> None:
+        artifact_store.put(signed_pdf_path, signed_id, "signed", parent_id=pdf_id, delta=True)
+        schedule_page_prewarm(signed_id)
+
     try:
-        # Tách phần dữ liệu từ data URL
-        header, encoded = data_url.split(",", 1)
-        binary_data = base64.b64decode(encoded)
-        
-        # Tạo tên file duy nhất
-        file_name = f"signature_{prefix}_{uuid.uuid4()}.png"
-        file_path = f"static/signatures/{file_name}"
-        
-        # Lưu file
-        with open(file_path, "wb") as f:
-            f.write(binary_data)
-        
-        return file_path
+        job = signing_engine.submit_job(
+            filename, signed_id, sign_fn, original_pdf_path, signed_pdf_path, *sign_args,
+            on_success=on_success, callback_url=callback_url
+        )
+    except QueueFullError as e:
+        print(f"Hàng đợi ký đầy, từ chối job: {pdf_id}")
+        return queue_full_response(e)
+
+    print(f"Đã tạo job ký: {job.job_id}")
+    return job_created_response(job)
+
+def parse_pdf_ids(value: Optional[str]) -> list:
+    """Đọc danh sách pdf_id dạng mảng JSON hoặc chuỗi phân tách bằng dấu phẩy"""
+    if not value:
+        return []
+    value = value.strip()
+    if value.startswith("["):
+        pdf_ids = json.loads(value)
+    else:
+        pdf_ids = value.split(",")
+    return [str(pdf_id).strip() for pdf_id in pdf_ids if str(pdf_id).strip()]
+
+def sign_with_prepared_page(original_pdf_path: str, signed_pdf_path: str, signature_page_data: bytes) -> None:
+    """Ký một tài liệu bằng trang chữ ký đã dựng sẵn cho cả lô"""
+    from PyPDF2 import PdfReader
+    signature_page = PdfReader(BytesIO(signature_page_data)).pages[0]
+    add_signatures_to_pdf(original_pdf_path, signed_pdf_path, None, None, None, None,
+                          signature_page=signature_page)
+
+@app.post("/sign-pdf/batch")
+async def sign_pdf_batch(request: Request):
+    """Ký nhiều PDF với cùng một bộ chữ ký, trả kết quả từng tài liệu dạng NDJSON"""
+    fields, files = await receive_upload(request, "temp", {})
+    for upload in files.values():
+        upload.discard()
+
+    try:
+        pdf_ids = parse_pdf_ids(fields.get("pdf_ids"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="pdf_ids không hợp lệ")
+    if not pdf_ids:
+        raise HTTPException(status_code=400, detail="Thiếu pdf_ids")
+    if len(pdf_ids) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Tối đa {MAX_BATCH_SIZE} tài liệu mỗi lô")
+    print(f"Nhận yêu cầu ký lô {len(pdf_ids)} PDF")
+
+    # Giải mã chữ ký một lần cho cả lô; với hai bên A/B, trang chữ ký cũng chỉ dựng một lần.
+    # Cả hai bước dùng PIL/ReportLab nên chạy ngoài event loop
+    sign_fn, sign_args = await run_in_threadpool(signing_call, fields, {})
+    if sign_fn is add_signatures_to_pdf:
+        signature_page_data = await run_in_threadpool(render_signature_page_data, *sign_args)
+        sign_fn, sign_args = sign_with_prepared_page, (signature_page_data,)
+
+    # Mỗi lô chỉ chiếm tối đa số worker của pool ký để không làm đầy hàng đợi
+    batch_slots = asyncio.Semaphore(signing_engine.max_workers)
+
+    async def sign_one(pdf_id: str) -> dict:
+        signed_id = f"signed_{uuid.uuid4()}"
+        signed_pdf_path = f"temp/{signed_id}.pdf"
+        try:
+            original_pdf_path = await run_in_threadpool(artifact_store.resolve, pdf_id)
+            if original_pdf_path is None:
+                return {"pdf_id": pdf_id, "status": "error", "error": "PDF không tồn tại"}
+            async with batch_slots:
+                await signing_engine.run(sign_fn, original_pdf_path, signed_pdf_path, *sign_args)
+            await run_in_threadpool(
+                artifact_store.put, signed_pdf_path, signed_id, "signed", parent_id=pdf_id, delta=True
+            )
+        except Exception as e:
+            print(f"Lỗi khi ký PDF {pdf_id} trong lô: {str(e)}")
+            return {"pdf_id": pdf_id, "status": "error", "error": str(e)}
+        return {"pdf_id": pdf_id, "status": "ok", "signed_id": signed_id, "view_url": f"/view/{signed_id}"}
+
+    async def stream_results():
+        succeeded = 0
+        tasks = [asyncio.ensure_future(sign_one(pdf_id)) for pdf_id in pdf_ids]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                result = await next_result
+                if result["status"] == "ok":
+                    succeeded += 1
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+        print(f"Đã ký lô: {succeeded}/{len(pdf_ids)} PDF thành công")
+        yield json.dumps({
+            "done": True,
+            "total": len(pdf_ids),
+            "succeeded": succeeded,
+            "failed": len(pdf_ids) - succeeded
+        }) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+def save_signature_image(data_url: str, box_pt: Optional[tuple] = None) -> Optional[str]:
+    """Lưu chữ ký từ data URL thành ảnh đã chuẩn hóa, dùng lại ảnh trùng nội dung"""
+    try:
+        return get_signature_assets().save_data_url(data_url, box_pt)
     except Exception as e:
         print(f"Lỗi khi lưu chữ ký: {str(e)}")
         return None
 
+def write_signed_pdf_incremental(original_pdf_path: str, output_pdf_path: str, signature_page: "PageObject") -> None:
+    """Nối trang chữ ký bằng incremental update, giữ nguyên các byte của file gốc"""
+    from pdf_incremental import append_pages_incremental
+    with open(original_pdf_path, 'rb') as original:
+        check_pdf_header(original.read(8), "File gốc")
+        with atomic_write(output_pdf_path) as output_file:
+            page_count = append_pages_incremental(original, output_file, [signature_page])
+            file_size = output_file.tell()
+    print(f"Đã ký PDF (incremental update): {output_pdf_path}, số trang: {page_count}, kích thước: {file_size} bytes")
+
+def write_signed_pdf_rewrite(original_pdf_path: str, output_pdf_path: str, signature_page: "PageObject") -> None:
+    """Ghi lại toàn bộ PDF kèm trang chữ ký bằng PdfWriter"""
+    from PyPDF2 import PdfReader, PdfWriter
+    # Đọc file PDF gốc một lần, kiểm tra header trên chính các byte đã đọc
+    with open(original_pdf_path, 'rb') as f:
+        original_data = f.read()
+    check_pdf_header(original_data, "File gốc")
+    reader = PdfReader(BytesIO(original_data))
+    print(f"Đã đọc PDF gốc, số trang: {len(reader.pages)}")
+    
+    # Kiểm tra số trang
+    if len(reader.pages) == 0:
+        raise Exception("PDF gốc không có trang nào")
+    
+    writer = PdfWriter()
+    
+    # Thêm tất cả các trang từ PDF gốc vào writer
+    for i in range(len(reader.pages)):
+        writer.add_page(reader.pages[i])
+        print(f"Đã thêm trang {i+1}/{len(reader.pages)} vào writer")
+    
+    # Thêm trang chữ ký vào PDF
+    writer.add_page(signature_page)
+    print("Đã thêm trang chữ ký vào PDF")
+    
+    # Lưu PDF đã ký: ghi ra file tạm rồi rename vào vị trí đích
+    with atomic_write(output_pdf_path) as output_file:
+        writer.write(output_file)
+        file_size = output_file.tell()
+    print(f"Đã ký PDF thành công: {output_pdf_path}, kích thước: {file_size} bytes")
+    # Chỉ tối ưu bản ghi lại toàn bộ; bản incremental phải giữ nguyên byte của file gốc để lưu dạng delta
+    if PDF_OPTIMIZE:
+        result = optimize_pdf(output_pdf_path, "signed")
+        report_progress("optimized", before=result["before"], after=result["after"])
+
+def render_signature_page(
+    signature_a_path: Optional[str],
+    signature_a_name: Optional[str],
+    signature_b_path: Optional[str],
+    signature_b_name: Optional[str]
+) -> "PageObject":
+    signature_template = get_signature_template()
+    render = signature_template.render if USE_SIGNATURE_TEMPLATE else signature_template.render_full
+    return render(signature_a_path, signature_a_name, signature_b_path, signature_b_name)
+
+def render_signature_page_data(
+    signature_a_path: Optional[str],
+    signature_a_name: Optional[str],
+    signature_b_path: Optional[str],
+    signature_b_name: Optional[str]
+) -> bytes:
+    """Dựng trang chữ ký thành PDF một trang, dùng chung cho nhiều worker"""
+    from PyPDF2 import PdfWriter
+    writer = PdfWriter()
+    writer.add_page(render_signature_page(signature_a_path, signature_a_name, signature_b_path, signature_b_name))
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
 def add_signatures_to_pdf(
     original_pdf_path: str,
     output_pdf_path: str,
     signature_a_path: Optional[str],
     signature_a_name: Optional[str],
     signature_b_path: Optional[str],
-    signature_b_name: Optional[str]
+    signature_b_name: Optional[str],
+    signature_page: Optional["PageObject"] = None
 ) -> None:
-    """Thêm chữ ký vào PDF bằng cách tạo trang mới"""
+    """Thêm chữ ký vào PDF bằng cách tạo trang mới
+
+    signature_page cho phép truyền trang chữ ký đã dựng sẵn, ví dụ khi ký theo lô.
+    """
     try:
+        report_progress("signing")
         print(f"Bắt đầu thêm chữ ký vào PDF: {original_pdf_path}")
-        print(f"Chữ ký A: {signature_a_path}, Tên A: {signature_a_name}")
-        print(f"Chữ ký B: {signature_b_path}, Tên B: {signature_b_name}")
+        if signature_page is None:
+            print(f"Chữ ký A: {signature_a_path}, Tên A: {signature_a_name}")
+            print(f"Chữ ký B: {signature_b_path}, Tên B: {signature_b_name}")
         
         # Kiểm tra file gốc
         if not os.path.exists(original_pdf_path):
             raise Exception(f"File PDF gốc không tồn tại: {original_pdf_path}")
-            
-        # Đọc và kiểm tra file PDF gốc
-        try:
-            with open(original_pdf_path, 'rb') as f:
-                header = f.read(10)
-                header_hex = ' '.join([f'{b:02x}' for b in header])
-                print(f"PDF gốc header (hex): {header_hex}")
-                
-                if not header.startswith(b'%PDF-'):
-                    raise Exception(f"File gốc không phải PDF hợp lệ, header: {header_hex}")
-                    
-            # Đặt lại con trỏ file
-            f.close()
-        except Exception as check_error:
-            print(f"Lỗi khi kiểm tra file PDF gốc: {str(check_error)}")
-            raise check_error
-        
-        # Đọc PDF gốc
-        reader = PdfReader(original_pdf_path)
-        print(f"Đã đọc PDF gốc, số trang: {len(reader.pages)}")
-        
-        # Kiểm tra số trang
-        if len(reader.pages) == 0:
-            raise Exception("PDF gốc không có trang nào")
-        
-        writer = PdfWriter()
-        
-        # Thêm tất cả các trang từ PDF gốc vào writer
-        for i in range(len(reader.pages)):
-            writer.add_page(reader.pages[i])
-            print(f"Đã thêm trang {i+1}/{len(reader.pages)} vào writer")
         
-        # Tạo trang mới cho chữ ký
-        signature_page = BytesIO()
-        c = canvas.Canvas(signature_page, pagesize=A4)
+        # Tạo thư mục đích nếu không tồn tại
+        output_dir = os.path.dirname(output_pdf_path)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+            print(f"Đã tạo thư mục đích: {output_dir}")
         
-        # Kích thước trang A4 (595 x 842 points)
-        width, height = A4
-        print(f"Kích thước trang A4: {width} x {height} points")
+        if signature_page is None:
+            with stage("render"):
+                signature_page = render_signature_page(
+                    signature_a_path, signature_a_name, signature_b_path, signature_b_name
+                )
         
-        # Kiểm tra và sử dụng font phù hợp
-        if VIETNAMESE_FONT_AVAILABLE:
-            # Kiểm tra xem DejaVu hay Noto Sans đang được sử dụng
-            dejavu_path = os.path.join(os.path.dirname(__file__), 'fonts', 'DejaVuSans.ttf')
-            if os.path.exists(dejavu_path):
-                print("Sử dụng font DejaVuSans cho tiếng Việt")
-                main_font = "DejaVuSans"
-                bold_font = "DejaVuSans-Bold"
-            else:
-                print("Sử dụng font NotoSans cho tiếng Việt")
-                main_font = "NotoSans"
-                bold_font = "NotoSans-Bold"
-        else:
-            print("Sử dụng font Helvetica (không hỗ trợ đầy đủ tiếng Việt)")
-            main_font = "Helvetica"
-            bold_font = "Helvetica-Bold"
-            
-        # Các tiêu đề và nhãn tiếng Việt
-        title = normalize_vietnamese_text("TRANG CHỮ KÝ XÁC NHẬN")
-        subtitle = normalize_vietnamese_text("Tài liệu này đã được ký điện tử bởi các bên")
-        party_a = normalize_vietnamese_text("BÊN A")
-        party_b = normalize_vietnamese_text("BÊN B")
-        current_date = datetime.now().strftime("%d/%m/%Y")
-        date_label = normalize_vietnamese_text(f"Ngày ký: {current_date}")
-        
-        # Đặt text rendering mode để tối ưu cho tiếng Việt
-        c.setFillColorRGB(0, 0, 0)  # Đảm bảo màu chữ là đen
-        
-        # Thêm tiêu đề trang chữ ký
-        c.setFont(bold_font, 18)
-        
-        # Vẽ các tiêu đề
-        c.drawString(width/2 - 110, height - 50, title)
-        c.setFont(main_font, 12)
-        c.drawString(width/2 - 140, height - 70, subtitle)
-        
-        # Vẽ đường kẻ ngang
-        c.setLineWidth(1)
-        c.line(50, height - 90, width - 50, height - 90)
-        
-        # Vẽ khung chữ ký
-        # Bên A - Bên trái
-        c.setLineWidth(1)
-        c.rect(50, height/2 - 50, 230, 150)  # Tăng kích thước từ 200x120 lên 230x150
-        c.setFont(bold_font, 14)
-        c.drawString(145, height/2 + 120, party_a)
-        print("Đã vẽ khung chữ ký bên A")
-        
-        # Thêm chữ ký và tên nếu có
-        if signature_a_path:
-            try:
-                if not os.path.exists(signature_a_path):
-                    print(f"CẢNH BÁO: File chữ ký A không tồn tại: {signature_a_path}")
-                else:
-                    img = Image.open(signature_a_path)
-                    img_width, img_height = img.size
-                    print(f"Đã mở ảnh chữ ký A, kích thước: {img_width}x{img_height} px")
-                    
-                    # Căn giữa chữ ký trong khung
-                    sig_width = 180
-                    sig_x = 50 + (230 - sig_width) / 2
-                    sig_y = height/2 - 30
-                    
-                    c.drawImage(ImageReader(img), sig_x, sig_y, width=sig_width, height=120, preserveAspectRatio=True)
-                    print("Đã thêm ảnh chữ ký A vào PDF")
-            except Exception as img_error:
-                print(f"Lỗi khi thêm ảnh chữ ký A: {str(img_error)}")
-                # Tiếp tục mà không dừng lại
-        
-        if signature_a_name:
-            # Căn giữa tên người ký với font lớn hơn
-            c.setFont(bold_font, 12)
-            signature_a_name = normalize_vietnamese_text(signature_a_name)
-            text_width = c.stringWidth(signature_a_name, bold_font, 12)
-            text_x = 50 + (230 - text_width) / 2
-            c.drawString(text_x, height/2 - 45, signature_a_name)
-            print(f"Đã thêm tên A: {signature_a_name}")
-        
-        # Bên B - Bên phải
-        c.setLineWidth(1)
-        c.rect(315, height/2 - 50, 230, 150)  # Tăng kích thước từ 200x120 lên 230x150
-        c.setFont(bold_font, 14)
-        c.drawString(410, height/2 + 120, party_b)
-        print("Đã vẽ khung chữ ký bên B")
-        
-        # Thêm chữ ký và tên nếu có
-        if signature_b_path:
+        # Mặc định chỉ nối thêm trang chữ ký, chi phí không phụ thuộc kích thước tài liệu
+        if SIGNING_MODE == "incremental":
             try:
-                if not os.path.exists(signature_b_path):
-                    print(f"CẢNH BÁO: File chữ ký B không tồn tại: {signature_b_path}")
-                else:
-                    img = Image.open(signature_b_path)
-                    img_width, img_height = img.size
-                    print(f"Đã mở ảnh chữ ký B, kích thước: {img_width}x{img_height} px")
-                    
-                    # Căn giữa chữ ký trong khung
-                    sig_width = 180
-                    sig_x = 315 + (230 - sig_width) / 2
-                    sig_y = height/2 - 30
-                    
-                    c.drawImage(ImageReader(img), sig_x, sig_y, width=sig_width, height=120, preserveAspectRatio=True)
-                    print("Đã thêm ảnh chữ ký B vào PDF")
-            except Exception as img_error:
-                print(f"Lỗi khi thêm ảnh chữ ký B: {str(img_error)}")
-                # Tiếp tục mà không dừng lại
-        
-        if signature_b_name:
-            # Căn giữa tên người ký với font lớn hơn
-            c.setFont(bold_font, 12)
-            signature_b_name = normalize_vietnamese_text(signature_b_name)
-            text_width = c.stringWidth(signature_b_name, bold_font, 12)
-            text_x = 315 + (230 - text_width) / 2
-            c.drawString(text_x, height/2 - 45, signature_b_name)
-            print(f"Đã thêm tên B: {signature_b_name}")
-        
-        # Thêm ngày tháng ở cuối trang
-        c.setFont(main_font, 10)
-        c.drawString(width/2 - 50, 50, date_label)
-        
-        # Lưu canvas
-        c.save()
-        print("Đã lưu canvas trang chữ ký")
-        
-        # Đọc trang chữ ký
-        signature_page.seek(0)
-        try:
-            signature_pdf = PdfReader(signature_page)
-            print(f"Đã đọc trang chữ ký PDF, số trang: {len(signature_pdf.pages)}")
-            
-            # Thêm trang chữ ký vào PDF
-            writer.add_page(signature_pdf.pages[0])
-            print("Đã thêm trang chữ ký vào PDF")
-            
-            # Tạo thư mục đích nếu không tồn tại
-            output_dir = os.path.dirname(output_pdf_path)
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-                print(f"Đã tạo thư mục đích: {output_dir}")
-            
-            # Lưu PDF đã ký
-            with open(output_pdf_path, "wb") as output_file:
-                writer.write(output_file)
-                print(f"Đã ghi PDF đã ký vào: {output_pdf_path}")
-            
-            # Kiểm tra file đã tạo
-            if os.path.exists(output_pdf_path):
-                file_size = os.path.getsize(output_pdf_path)
-                print(f"Đã ký PDF thành công: {output_pdf_path}, kích thước: {file_size} bytes")
-                
-                # Kiểm tra xem file có phải là PDF hợp lệ không
-                with open(output_pdf_path, 'rb') as f:
-                    check_header = f.read(10)
-                    check_header_hex = ' '.join([f'{b:02x}' for b in check_header])
-                    print(f"PDF đã ký header (hex): {check_header_hex}")
-                    
-                    if not check_header.startswith(b'%PDF-'):
-                        print(f"CẢNH BÁO: File đã ký có thể không phải PDF hợp lệ: {check_header_hex}")
-            else:
-                error_msg = f"Lỗi: File PDF đã ký không tồn tại sau khi lưu"
-                print(error_msg)
-                raise Exception(error_msg)
-        except Exception as pdf_error:
-            print(f"Lỗi khi xử lý trang chữ ký PDF: {str(pdf_error)}")
-            raise pdf_error
+                with stage("write"):
+                    write_signed_pdf_incremental(original_pdf_path, output_pdf_path, signature_page)
+                return
+            except Exception as incremental_error:
+                print(f"Không thể ký bằng incremental update, chuyển sang ghi lại toàn bộ: {str(incremental_error)}")
         
+        with stage("write"):
+            write_signed_pdf_rewrite(original_pdf_path, output_pdf_path, signature_page)
     except Exception as e:
         print(f"Lỗi khi thêm chữ ký vào PDF: {str(e)}")
         raise e
 
+def write_layout_rewrite(reader, output_pdf_path: str, overlays: dict, new_pages: list, page_boxes: dict) -> None:
+    """Ghi lại toàn bộ PDF, gộp overlay vào các trang được ký bằng PdfWriter"""
+    from PyPDF2 import PdfWriter, Transformation
+    from PyPDF2.generic import NameObject
+    writer = PdfWriter()
+    for page in reader.pages:
+        writer.add_page(page)
+    for index, overlay in overlays.items():
+        x0, y0, _, _ = page_boxes[index]
+        if x0 or y0:
+            overlay.add_transformation(Transformation().translate(x0, y0))
+        page = writer.pages[index]
+        page.merge_page(overlay)
+        # PyPDF2 để nội dung đã gộp dạng stream trực tiếp trong trang, một số trình đọc không chấp nhận
+        page[NameObject("/Contents")] = writer._add_object(page["/Contents"])
+    for page in new_pages:
+        writer.add_page(page)
+    with atomic_write(output_pdf_path) as output_file:
+        writer.write(output_file)
+        file_size = output_file.tell()
+    print(f"Đã ký PDF thành công: {output_pdf_path}, kích thước: {file_size} bytes")
+    if PDF_OPTIMIZE:
+        result = optimize_pdf(output_pdf_path, "signed")
+        report_progress("optimized", before=result["before"], after=result["after"])
+
+def add_layout_signatures_to_pdf(original_pdf_path: str, output_pdf_path: str, parties: list) -> None:
+    """Ký theo bố cục nhiều bên
+
+    Mọi chữ ký được vẽ trong một lần: mỗi trang được ký có một overlay, các
+    bên còn lại nằm trên trang chữ ký nối thêm. Ở chế độ incremental chỉ các
+    trang được ký được ghi lại, các trang khác giữ nguyên byte.
+    """
+    from PyPDF2 import PdfReader
+    from pdf_incremental import document_page_count, page_box, write_incremental_update
+    from signature_layout import render_layout, resolve_pages
+    report_progress("signing")
+    print(f"Bắt đầu ký PDF theo bố cục {len(parties)} bên: {original_pdf_path}")
+    with open(original_pdf_path, 'rb') as original:
+        check_pdf_header(original.read(8), "File gốc")
+        reader = PdfReader(original)
+        parties = resolve_pages(parties, document_page_count(reader))
+        page_boxes = {party.page: page_box(reader, party.page) for party in parties if party.page is not None}
+
+        with stage("render"):
+            overlay_data, targets, appended_count = render_layout(get_signature_template(), parties, page_boxes)
+        overlay_pages = PdfReader(BytesIO(overlay_data)).pages
+        overlays = {index: overlay_pages[position] for position, index in enumerate(targets)}
+        new_pages = [overlay_pages[len(targets) + position] for position in range(appended_count)]
+
+        if SIGNING_MODE == "incremental":
+            try:
+                with stage("write"), atomic_write(output_pdf_path) as output_file:
+                    page_count = write_incremental_update(original, output_file, new_pages, overlays, reader=reader)
+                    file_size = output_file.tell()
+                print(f"Đã ký PDF (incremental update): {output_pdf_path}, ký trên {len(targets)} trang, "
+                      f"nối thêm {appended_count} trang, số trang: {page_count}, kích thước: {file_size} bytes")
+                return
+            except Exception as incremental_error:
+                print(f"Không thể ký bằng incremental update, chuyển sang ghi lại toàn bộ: {str(incremental_error)}")
+
+        with stage("write"):
+            write_layout_rewrite(reader, output_pdf_path, overlays, new_pages, page_boxes)
+
+record_phase("import", time.perf_counter() - _import_started)
+print(f"Đã nạp main.py trong {time.perf_counter() - _import_started:.3f}s")
+
 # Để chạy ứng dụng: python -m uvicorn main:app --reload --host 0.0.0.0 --port 1046
 if __name__ == "__main__":
     import uvicorn
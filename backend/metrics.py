@@ -0,0 +1,312 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+
+# Thêm header Server-Timing vào từng response để theo dõi thời gian từng bước
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") != "0"
+DISK_USAGE_TTL_SECONDS = int(os.environ.get("DISK_USAGE_TTL_SECONDS", 30))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Metric cơ bản, giá trị lưu theo bộ label"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], object]] = None
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Sequence[Tuple[str, str]] = ()) -> str:
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def set_function(self, function: Callable[[], object]) -> None:
+        """Giá trị được tính khi scrape; hàm trả về số hoặc dict {bộ label: số}"""
+        self._function = function
+
+    def _snapshot(self) -> Dict[Tuple[str, ...], float]:
+        if self._function is None:
+            with self._lock:
+                return dict(self._values)
+        value = self._function()
+        if isinstance(value, dict):
+            return {key if isinstance(key, tuple) else (key,): number for key, number in value.items()}
+        return {(): value}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._snapshot().items()):
+            lines.append(f"{self.name}{self._labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [số lần theo từng bucket..., tổng, số lần quan sát]
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                labels = self._labels(key, [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format_value(values[-2])}")
+            lines.append(f"{self.name}_count{self._labels(key)} {values[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    """Tập các metric, xuất ra định dạng text của Prometheus"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                print(f"Lỗi khi xuất metric {metric.name}: {str(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "pdf_service_http_requests_total", "Số request HTTP theo handler và mã trạng thái",
+    ["handler", "method", "status"]))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "pdf_service_http_request_duration_seconds", "Thời gian xử lý request, tính đến khi gửi xong body",
+    ["handler"]))
+HTTP_BYTES_RECEIVED = REGISTRY.register(Counter(
+    "pdf_service_http_received_bytes_total", "Số byte body nhận được", ["handler"]))
+HTTP_BYTES_SENT = REGISTRY.register(Counter(
+    "pdf_service_http_sent_bytes_total", "Số byte body đã gửi", ["handler"]))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "pdf_service_stage_duration_seconds", "Thời gian từng bước xử lý", ["stage"]))
+HTTP_IN_PROGRESS = REGISTRY.register(Gauge(
+    "pdf_service_http_requests_in_progress", "Số request đang xử lý"))
+
+
+_request_stages: ContextVar[Optional[list]] = ContextVar("request_stages", default=None)
+
+
+def record_stage(name: str, elapsed: float) -> None:
+    STAGE_SECONDS.observe(elapsed, stage=name)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((name, elapsed))
+
+
+@contextmanager
+def stage(name: str):
+    """Đo thời gian một bước, ghi vào histogram và Server-Timing của request hiện tại"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def server_timing_header(stages: List[Tuple[str, float]], total: float) -> str:
+    # Bước lặp lại (ví dụ khi xử lý theo lô) được cộng dồn theo tên
+    durations: Dict[str, float] = {}
+    for name, elapsed in stages:
+        durations[name] = durations.get(name, 0.0) + elapsed
+    parts = [f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in durations.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def _handler_name(scope) -> str:
+    endpoint = scope.get("endpoint")
+    if endpoint is not None:
+        return getattr(endpoint, "__name__", "other")
+    if scope.get("path", "").startswith("/static"):
+        return "static"
+    return "other"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI đo số request, thời gian, số byte và gắn Server-Timing"""
+
+    def __init__(self, app, server_timing: bool = SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stages: List[Tuple[str, float]] = []
+        token = _request_stages.set(stages)
+        start = time.perf_counter()
+        state = {"status": 500, "received": 0, "sent": 0}
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                if self.server_timing:
+                    header = server_timing_header(stages, time.perf_counter() - start)
+                    message = dict(message)
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", header.encode("latin-1"))
+                    ]
+            elif message["type"] == "http.response.body":
+                state["sent"] += len(message.get("body", b""))
+            elif message["type"] == "http.response.zerocopysend":
+                state["sent"] += message.get("count", 0)
+            await send(message)
+
+        HTTP_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            HTTP_IN_PROGRESS.dec()
+            _request_stages.reset(token)
+            handler = _handler_name(scope)
+            HTTP_REQUESTS.inc(handler=handler, method=scope.get("method", ""), status=state["status"])
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, handler=handler)
+            HTTP_BYTES_RECEIVED.inc(state["received"], handler=handler)
+            HTTP_BYTES_SENT.inc(state["sent"], handler=handler)
+
+
+def directory_size(path: str) -> int:
+    """Tổng kích thước các file trong thư mục, tính cả thư mục con"""
+    total = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        total += directory_size(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        total += entry.stat().st_size
+                except FileNotFoundError:
+                    continue
+    except FileNotFoundError:
+        return 0
+    return total
+
+
+class DiskUsage:
+    """Dung lượng đĩa của các thư mục, tính lại tối đa mỗi ttl giây
+
+    Thư mục có trong sizers lấy dung lượng từ hàm tương ứng (ví dụ tổng trong
+    chỉ mục của kho PDF) thay vì duyệt cây thư mục.
+    """
+
+    def __init__(self, directories: Sequence[str], ttl: int = DISK_USAGE_TTL_SECONDS,
+                 sizers: Optional[Dict[str, Callable[[], int]]] = None):
+        self.directories = list(directories)
+        self.ttl = ttl
+        self.sizers = sizers or {}
+        self._measured_at = 0.0
+        self._sizes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _measure(self, directory: str) -> int:
+        sizer = self.sizers.get(directory)
+        return sizer() if sizer is not None else directory_size(directory)
+
+    def __call__(self) -> Dict[str, int]:
+        with self._lock:
+            if time.time() - self._measured_at > self.ttl:
+                self._sizes = {directory: self._measure(directory) for directory in self.directories}
+                self._measured_at = time.time()
+            return dict(self._sizes)
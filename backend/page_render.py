@@ -0,0 +1,192 @@
+import os
+import hashlib
+import importlib.util
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from artifacts import atomic_write
+
+
+PAGE_CACHE_DIR = os.environ.get("PAGE_CACHE_DIR", "cache/pages")
+PAGE_CACHE_MAX_ENTRIES = int(os.environ.get("PAGE_CACHE_MAX_ENTRIES", 5000))
+PAGE_CACHE_MAX_BYTES = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+# Kích thước tính theo cạnh dài của ảnh (pixel)
+PAGE_RENDER_DEFAULT_SIZE = int(os.environ.get("PAGE_RENDER_DEFAULT_SIZE", 1024))
+PAGE_RENDER_MAX_SIZE = int(os.environ.get("PAGE_RENDER_MAX_SIZE", 2048))
+PAGE_RENDER_MIN_SIZE = 16
+PAGE_RENDER_DEFAULT_FORMAT = os.environ.get("PAGE_RENDER_DEFAULT_FORMAT", "png")
+THUMBNAIL_SIZE = int(os.environ.get("THUMBNAIL_SIZE", 256))
+# Các kích thước trang đầu được render sẵn sau khi chuyển đổi hoặc ký, để trống để tắt
+PAGE_PREWARM_SIZES = [int(size) for size in os.environ.get("PAGE_PREWARM_SIZES", str(THUMBNAIL_SIZE)).split(",") if size.strip()]
+
+IMAGE_FORMATS = {
+    "png": ("PNG", "image/png"),
+    "webp": ("WEBP", "image/webp"),
+}
+
+
+# pypdfium2 chỉ được import khi render lần đầu
+RENDER_AVAILABLE = importlib.util.find_spec("pypdfium2") is not None
+
+
+class RenderUnavailable(Exception):
+    """Chưa cài pypdfium2 nên không render được trang"""
+
+
+class PageNotFound(Exception):
+    """Số trang nằm ngoài tài liệu"""
+
+
+# PDFium không an toàn khi gọi từ nhiều thread cùng lúc
+_pdfium_lock = threading.Lock()
+
+
+def render_page_image(pdf_path: str, page_number: int, size: int, image_format: str, dest: str) -> None:
+    """Render trang page_number (đếm từ 1) sao cho cạnh dài bằng size pixel"""
+    if not RENDER_AVAILABLE:
+        raise RenderUnavailable("Cần cài pypdfium2 để render trang PDF")
+    import pypdfium2 as pdfium
+    pil_format, _ = IMAGE_FORMATS[image_format]
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            if page_number < 1 or page_number > len(pdf):
+                raise PageNotFound(f"Trang {page_number} không tồn tại, tài liệu có {len(pdf)} trang")
+            page = pdf[page_number - 1]
+            try:
+                width, height = page.get_size()
+                bitmap = page.render(scale=size / max(width, height, 1))
+                image = bitmap.to_pil()
+            finally:
+                page.close()
+        finally:
+            pdf.close()
+    # Mã hóa ảnh không cần PDFium nên làm ngoài lock
+    with atomic_write(dest) as f:
+        image.save(f, format=pil_format)
+
+
+class PageRenderCache:
+    """Cache ảnh trang PDF trên đĩa theo (pdf_id, trang, kích thước, định dạng)
+
+    Tên file chứa phiên bản của PDF (sha256 hoặc ETag) nên file được tải lên
+    lại không dùng nhầm ảnh cũ. Thứ tự LRU giữ trong bộ nhớ và được dựng lại
+    từ mtime khi khởi động; mỗi lần trúng cache cập nhật mtime của file.
+    """
+
+    def __init__(self, cache_dir: str = PAGE_CACHE_DIR,
+                 max_entries: int = PAGE_CACHE_MAX_ENTRIES,
+                 max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        # Mỗi khóa chỉ render một lần dù nhiều request cùng hỏi
+        self._key_locks = {}
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        files = []
+        for directory, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if filename.endswith(".part"):
+                    os.remove(path)
+                    continue
+                try:
+                    stat_result = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat_result.st_mtime, os.path.relpath(path, self.cache_dir), stat_result.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        if files:
+            print(f"Đã nạp cache ảnh trang: {len(self._entries)} file")
+
+    def key(self, pdf_id: str, page_number: int, size: int, image_format: str, version: str) -> str:
+        version_hash = hashlib.sha1(version.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(pdf_id, f"{page_number}_{size}_{version_hash}.{image_format}")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def lookup(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        with self._lock:
+            if key not in self._entries:
+                return None
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                # File bị xóa bên ngoài, bỏ entry
+                self._total_bytes -= self._entries.pop(key)
+                return None
+            self._entries.move_to_end(key)
+            return path
+
+    def _add(self, key: str) -> None:
+        size = os.path.getsize(self._path(key))
+        with self._lock:
+            self._total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            while self._entries and (len(self._entries) > self.max_entries
+                                     or self._total_bytes > self.max_bytes):
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                self.evictions += 1
+                try:
+                    os.remove(self._path(old_key))
+                except FileNotFoundError:
+                    pass
+
+    def get_or_render(self, pdf_path: str, pdf_id: str, page_number: int, size: int,
+                      image_format: str, version: str) -> str:
+        """Trả về đường dẫn ảnh của trang, render và lưu cache nếu chưa có"""
+        key = self.key(pdf_id, page_number, size, image_format, version)
+        path = self.lookup(key)
+        if path is not None:
+            self.hits += 1
+            return path
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # Request khác có thể vừa render xong khóa này
+                path = self.lookup(key)
+                if path is not None:
+                    self.hits += 1
+                    return path
+                self.misses += 1
+                path = self._path(key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                render_page_image(pdf_path, page_number, size, image_format, path)
+                self._add(key)
+                return path
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def prewarm() -> None:
+    """Nạp sẵn PDFium để lần render đầu không phải chờ import"""
+    if RENDER_AVAILABLE:
+        import pypdfium2  # noqa: F401
@@ -0,0 +1,370 @@
+import re
+import shutil
+from io import BytesIO
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from PyPDF2 import PageObject, PdfReader
+from PyPDF2.generic import (
+    ArrayObject,
+    DecodedStreamObject,
+    DictionaryObject,
+    FloatObject,
+    IndirectObject,
+    NameObject,
+    NumberObject,
+    StreamObject,
+)
+
+
+# Thuộc tính trang có thể kế thừa từ nút /Pages cha
+INHERITABLE_KEYS = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+OVERLAY_XOBJECT_NAME = "/SigOv"
+
+
+class IncrementalUpdateError(Exception):
+    """Không thể thêm incremental update vào PDF này"""
+
+
+def _find_startxref(original: BinaryIO) -> int:
+    """Đọc offset của bảng xref cuối cùng từ phần đuôi file"""
+    original.seek(0, 2)
+    file_size = original.tell()
+    original.seek(max(0, file_size - 2048))
+    tail = original.read()
+    matches = re.findall(rb"startxref\s+(\d+)", tail)
+    if not matches:
+        raise IncrementalUpdateError("Không tìm thấy startxref")
+    return int(matches[-1])
+
+
+def _uses_xref_stream(original: BinaryIO, startxref: int) -> bool:
+    original.seek(startxref)
+    return not original.read(4).startswith(b"xref")
+
+
+def _object_count(reader: PdfReader) -> int:
+    """Giá trị /Size hiện tại; PyPDF2 không giữ /Size khi file dùng xref stream"""
+    if "/Size" in reader.trailer:
+        return int(reader.trailer["/Size"])
+    numbers = list(reader.xref_objStm)
+    for table in reader.xref.values():
+        numbers.extend(table)
+    return max(numbers) + 1
+
+
+class _ObjectCopier:
+    """Sao chép đồ thị object từ PDF khác, đánh số lại để nối vào file gốc"""
+
+    def __init__(self, next_number: int):
+        self.next_number = next_number
+        self.objects: Dict[int, object] = {}
+        self._mapping: Dict[Tuple[int, int, int], IndirectObject] = {}
+        self._queue: List[Tuple[IndirectObject, IndirectObject]] = []
+
+    def reserve(self) -> IndirectObject:
+        ref = IndirectObject(self.next_number, 0, None)
+        self.next_number += 1
+        return ref
+
+    def add_object(self, obj) -> IndirectObject:
+        ref = self.reserve()
+        self.objects[ref.idnum] = obj
+        return ref
+
+    def _map_reference(self, ref: IndirectObject) -> IndirectObject:
+        # Object có thể đến từ nhiều PDF nguồn khác nhau nên khóa gồm cả nguồn
+        key = (id(ref.pdf), ref.idnum, ref.generation)
+        if key not in self._mapping:
+            new_ref = self.reserve()
+            self._mapping[key] = new_ref
+            self._queue.append((ref, new_ref))
+        return self._mapping[key]
+
+    def clone(self, obj, skip_keys=()):
+        if isinstance(obj, IndirectObject):
+            return self._map_reference(obj)
+        if isinstance(obj, StreamObject):
+            copied = obj.__class__()
+            copied._data = obj._data
+            for key, value in obj.items():
+                copied[NameObject(key)] = self.clone(value)
+            return copied
+        if isinstance(obj, DictionaryObject):
+            copied = DictionaryObject()
+            for key, value in obj.items():
+                if key not in skip_keys:
+                    copied[NameObject(key)] = self.clone(value)
+            return copied
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self.clone(value) for value in obj])
+        return obj
+
+    def drain(self) -> None:
+        # Sao chép các object được tham chiếu gián tiếp cho đến khi hết
+        while self._queue:
+            source_ref, new_ref = self._queue.pop()
+            self.objects[new_ref.idnum] = self.clone(source_ref.get_object())
+
+
+def _serialize(obj) -> bytes:
+    buffer = BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
+
+
+def _xref_sections(numbers: List[int]) -> List[Tuple[int, List[int]]]:
+    """Chia danh sách số object thành các đoạn liên tiếp"""
+    sections = []
+    for number in sorted(numbers):
+        if sections and sections[-1][0] + len(sections[-1][1]) == number:
+            sections[-1][1].append(number)
+        else:
+            sections.append((number, [number]))
+    return sections
+
+
+def _resolve(value):
+    # DictionaryObject.get trả về giá trị thô, có thể là tham chiếu gián tiếp
+    return value.get_object() if isinstance(value, IndirectObject) else value
+
+
+def document_page_count(reader: PdfReader) -> int:
+    return int(_resolve(reader.trailer["/Root"]["/Pages"].get("/Count", 0)))
+
+
+def _find_page(pages_ref: IndirectObject, index: int):
+    """Tìm trang thứ index (đếm từ 0) theo /Count của cây trang, chỉ đọc các nút trên đường đi
+
+    Ở mỗi nút, /Count của từng kid được cộng dồn nên cây có nút /Pages rỗng hoặc
+    không đều vẫn cho đúng trang. Kid được duyệt từ đầu gần trang cần tìm hơn,
+    nhờ đó trang đầu và trang cuối chỉ cần đọc vài object.
+    Trả về (tham chiếu trang, dictionary trang, thuộc tính kế thừa từ nút cha).
+    """
+    node_ref = pages_ref
+    inherited = {}
+    while True:
+        node = node_ref.get_object()
+        if _resolve(node.get("/Type")) != "/Pages":
+            return node_ref, node, inherited
+        for key in INHERITABLE_KEYS:
+            if key in node:
+                inherited[key] = node[key]
+        kids = list(node["/Kids"])
+        total = int(_resolve(node.get("/Count", 0)))
+        from_end = index >= total / 2
+        # Khi duyệt từ cuối, đếm vị trí tính từ trang cuối của nút
+        position = total - 1 - index if from_end else index
+        for kid_ref in (reversed(kids) if from_end else kids):
+            kid = kid_ref.get_object()
+            count = int(_resolve(kid.get("/Count", 1))) if _resolve(kid.get("/Type")) == "/Pages" else 1
+            if position < count:
+                node_ref = kid_ref
+                index = count - 1 - position if from_end else position
+                break
+            position -= count
+        else:
+            raise IncrementalUpdateError("Cây trang không khớp với /Count")
+
+
+def _inherited(page, inherited: dict, key: str):
+    return page[key] if key in page else inherited.get(key)
+
+
+def _media_box(page, inherited: dict) -> Tuple[float, float, float, float]:
+    box = _inherited(page, inherited, "/MediaBox")
+    if box is None:
+        raise IncrementalUpdateError("Trang không có /MediaBox")
+    return tuple(float(_resolve(value)) for value in box)
+
+
+def page_box(reader: PdfReader, index: int) -> Tuple[float, float, float, float]:
+    """MediaBox (x0, y0, x1, y1) của trang index, tính cả giá trị kế thừa"""
+    _, page, inherited = _find_page(reader.trailer["/Root"].raw_get("/Pages"), index)
+    return _media_box(page, inherited)
+
+
+def _content_refs(page) -> List[IndirectObject]:
+    contents = page.raw_get("/Contents") if "/Contents" in page else None
+    if contents is None:
+        return []
+    if isinstance(contents, IndirectObject) and isinstance(contents.get_object(), ArrayObject):
+        contents = contents.get_object()
+    if isinstance(contents, ArrayObject):
+        return list(contents)
+    return [contents]
+
+
+def _stream_object(data: bytes) -> StreamObject:
+    stream = StreamObject()
+    stream._data = data
+    return stream
+
+
+def _overlay_page(copier: "_ObjectCopier", page, inherited: dict, overlay: PageObject) -> DictionaryObject:
+    """Trang gốc được vẽ thêm overlay ở trên cùng
+
+    Nội dung overlay thành một Form XObject; /Contents của trang chỉ được
+    bọc thêm hai stream nhỏ trước và sau, các stream gốc giữ nguyên tham chiếu
+    nên không bị giải nén hay mã hóa lại.
+    """
+    x0, y0, _, _ = _media_box(page, inherited)
+    overlay_contents = overlay.get_contents()
+    form = DecodedStreamObject()
+    form.set_data(overlay_contents.get_data() if overlay_contents is not None else b"")
+    form = form.flate_encode()
+    form[NameObject("/Type")] = NameObject("/XObject")
+    form[NameObject("/Subtype")] = NameObject("/Form")
+    form[NameObject("/BBox")] = ArrayObject([FloatObject(value) for value in overlay.mediabox])
+    # Toạ độ overlay tính từ góc dưới trái của MediaBox trang đích
+    form[NameObject("/Matrix")] = ArrayObject(
+        [NumberObject(1), NumberObject(0), NumberObject(0), NumberObject(1), FloatObject(x0), FloatObject(y0)]
+    )
+    form[NameObject("/Resources")] = copier.clone(overlay.raw_get("/Resources"))
+    form_ref = copier.add_object(form)
+
+    # Resources có thể dùng chung giữa nhiều trang nên chỉ sửa trên bản sao gắn vào trang này
+    resources = _inherited(page, inherited, "/Resources")
+    updated_resources = DictionaryObject(resources) if resources is not None else DictionaryObject()
+    xobjects = _resolve(updated_resources.get("/XObject"))
+    updated_xobjects = DictionaryObject(xobjects) if xobjects is not None else DictionaryObject()
+    name = OVERLAY_XOBJECT_NAME
+    suffix = 1
+    while name in updated_xobjects:
+        suffix += 1
+        name = f"{OVERLAY_XOBJECT_NAME}{suffix}"
+    updated_xobjects[NameObject(name)] = form_ref
+    updated_resources[NameObject("/XObject")] = updated_xobjects
+
+    # Bọc nội dung gốc trong q/Q để trạng thái đồ họa của nó không ảnh hưởng overlay
+    prefix_ref = copier.add_object(_stream_object(b"q\n"))
+    suffix_ref = copier.add_object(_stream_object(f"\nQ\nq {name} Do Q\n".encode("ascii")))
+    updated_page = DictionaryObject(page)
+    updated_page[NameObject("/Contents")] = ArrayObject([prefix_ref] + _content_refs(page) + [suffix_ref])
+    updated_page[NameObject("/Resources")] = updated_resources
+    return updated_page
+
+
+def append_pages_incremental(original: BinaryIO, output: BinaryIO, new_pages: List[PageObject]) -> int:
+    """Nối new_pages vào cuối PDF gốc bằng incremental update
+
+    Các byte của file gốc được chép nguyên vẹn, sau đó chỉ ghi thêm object
+    của trang mới, cây /Pages đã cập nhật và một phần xref mới trỏ về xref cũ.
+    Trả về số trang của tài liệu sau khi ghi.
+    """
+    return write_incremental_update(original, output, new_pages)
+
+
+def write_incremental_update(original: BinaryIO, output: BinaryIO, new_pages: List[PageObject] = (),
+                             overlays: Optional[Dict[int, PageObject]] = None,
+                             reader: Optional[PdfReader] = None) -> int:
+    """Incremental update gồm các trang nối thêm và overlay vẽ lên trang có sẵn
+
+    overlays ánh xạ chỉ số trang (đếm từ 0) tới trang chứa lớp cần vẽ lên.
+    Chỉ các trang trong overlays được ghi lại (dictionary trang, không gồm
+    nội dung), nên chi phí tỉ lệ với số trang được ký chứ không với độ dài
+    tài liệu. Trả về số trang của tài liệu sau khi ghi.
+    """
+    if reader is None:
+        reader = PdfReader(original)
+    if reader.is_encrypted:
+        raise IncrementalUpdateError("PDF đã mã hóa")
+    startxref = _find_startxref(original)
+    xref_stream = _uses_xref_stream(original, startxref)
+
+    trailer = reader.trailer
+    root_ref = trailer.raw_get("/Root")
+    pages_ref = root_ref.get_object().raw_get("/Pages")
+    if not isinstance(root_ref, IndirectObject) or not isinstance(pages_ref, IndirectObject):
+        raise IncrementalUpdateError("Cấu trúc /Root hoặc /Pages không hợp lệ")
+    pages = pages_ref.get_object()
+    page_count = int(_resolve(pages.get("/Count", 0)))
+    if page_count == 0:
+        raise IncrementalUpdateError("PDF gốc không có trang nào")
+
+    copier = _ObjectCopier(_object_count(reader))
+    updated: Dict[Tuple[int, int], object] = {}
+
+    # Vẽ overlay lên các trang có sẵn, mỗi trang chỉ ghi lại dictionary của nó
+    for index, overlay in (overlays or {}).items():
+        if not 0 <= index < page_count:
+            raise IncrementalUpdateError(f"Trang {index + 1} không tồn tại")
+        page_ref, page, inherited = _find_page(pages_ref, index)
+        if not isinstance(page_ref, IndirectObject):
+            raise IncrementalUpdateError("Trang không phải object gián tiếp")
+        updated[(page_ref.idnum, page_ref.generation)] = _overlay_page(copier, page, inherited, overlay)
+
+    # Sao chép trang mới, gắn /Parent vào cây trang của file gốc
+    new_refs = []
+    for page in new_pages:
+        new_page = copier.clone(page, skip_keys=("/Parent",))
+        new_page[NameObject("/Parent")] = IndirectObject(pages_ref.idnum, pages_ref.generation, None)
+        new_refs.append(copier.add_object(new_page))
+    copier.drain()
+
+    if new_refs:
+        updated_pages = DictionaryObject(pages)
+        kids_raw = pages.raw_get("/Kids")
+        if isinstance(kids_raw, IndirectObject):
+            # /Kids là object riêng, cập nhật chính object đó
+            updated[(kids_raw.idnum, kids_raw.generation)] = ArrayObject(list(kids_raw.get_object()) + new_refs)
+        else:
+            updated_pages[NameObject("/Kids")] = ArrayObject(list(kids_raw) + new_refs)
+        updated_pages[NameObject("/Count")] = NumberObject(page_count + len(new_refs))
+        updated[(pages_ref.idnum, pages_ref.generation)] = updated_pages
+
+    # Chép nguyên vẹn file gốc theo từng khối
+    original.seek(0)
+    shutil.copyfileobj(original, output)
+    output.write(b"\n")
+
+    offsets: Dict[int, Tuple[int, int]] = {}
+    entries = [(number, 0, obj) for number, obj in copier.objects.items()]
+    entries += [(number, generation, obj) for (number, generation), obj in updated.items()]
+    for number, generation, obj in entries:
+        offsets[number] = (output.tell(), generation)
+        output.write(f"{number} {generation} obj\n".encode("ascii"))
+        output.write(_serialize(obj))
+        output.write(b"\nendobj\n")
+
+    new_trailer = DictionaryObject()
+    new_trailer[NameObject("/Size")] = NumberObject(copier.next_number)
+    new_trailer[NameObject("/Root")] = root_ref
+    new_trailer[NameObject("/Prev")] = NumberObject(startxref)
+    for key in ("/Info", "/ID"):
+        if key in trailer:
+            new_trailer[NameObject(key)] = trailer.raw_get(key)
+
+    xref_offset = output.tell()
+    sections = _xref_sections(list(offsets))
+    if xref_stream:
+        # File gốc dùng xref stream thì phần cập nhật cũng dùng xref stream
+        xref_number = copier.next_number
+        offsets[xref_number] = (xref_offset, 0)
+        sections = _xref_sections(list(offsets))
+        new_trailer[NameObject("/Size")] = NumberObject(xref_number + 1)
+        rows = b"".join(
+            b"\x01" + offsets[number][0].to_bytes(4, "big") + offsets[number][1].to_bytes(2, "big")
+            for _, numbers in sections for number in numbers
+        )
+        stream = _stream_object(rows)
+        stream.update(new_trailer)
+        stream[NameObject("/Type")] = NameObject("/XRef")
+        stream[NameObject("/W")] = ArrayObject([NumberObject(1), NumberObject(4), NumberObject(2)])
+        stream[NameObject("/Index")] = ArrayObject(
+            [NumberObject(value) for start, numbers in sections for value in (start, len(numbers))]
+        )
+        output.write(f"{xref_number} 0 obj\n".encode("ascii"))
+        output.write(_serialize(stream))
+        output.write(b"\nendobj\n")
+    else:
+        output.write(b"xref\n")
+        for start, numbers in sections:
+            output.write(f"{start} {len(numbers)}\n".encode("ascii"))
+            for number in numbers:
+                offset, generation = offsets[number]
+                output.write(f"{offset:010d} {generation:05d} n\r\n".encode("ascii"))
+        output.write(b"trailer\n")
+        output.write(_serialize(new_trailer))
+        output.write(b"\n")
+    output.write(f"startxref\n{xref_offset}\n%%EOF\n".encode("ascii"))
+    return page_count + len(new_refs)
@@ -0,0 +1,179 @@
+"""Tối ưu PDF sau khi chuyển đổi hoặc ký: gộp object trùng, nén lại stream, linearize
+
+Chạy trực tiếp để xem mức giảm dung lượng của các file có sẵn (không ghi đè):
+
+    python pdf_optimize.py a.pdf b.pdf
+"""
+import os
+import sys
+import hashlib
+import importlib.util
+
+from metrics import REGISTRY, Counter, stage
+
+# pikepdf chỉ được import khi tối ưu lần đầu
+PIKEPDF_AVAILABLE = importlib.util.find_spec("pikepdf") is not None
+
+
+# Bật bước tối ưu sau chuyển đổi và sau khi ký (chế độ ghi lại toàn bộ)
+PDF_OPTIMIZE = os.environ.get("PDF_OPTIMIZE", "0") != "0"
+# Linearize để viewer hiện trang đầu trước khi tải xong file, chỉ có khi dùng pikepdf
+PDF_OPTIMIZE_LINEARIZE = os.environ.get("PDF_OPTIMIZE_LINEARIZE", "1") != "0"
+
+OPTIMIZE_INPUT_BYTES = REGISTRY.register(Counter(
+    "pdf_service_optimize_input_bytes_total", "Tổng kích thước PDF trước khi tối ưu", ["kind"]))
+OPTIMIZE_OUTPUT_BYTES = REGISTRY.register(Counter(
+    "pdf_service_optimize_output_bytes_total", "Tổng kích thước PDF sau khi tối ưu", ["kind"]))
+
+# Loại dictionary có thể gộp khi giống hệt nhau, sau khi stream con đã được gộp
+DEDUP_DICTIONARY_TYPES = ("/Font", "/FontDescriptor", "/ExtGState", "/Encoding")
+
+
+def _unparse(value) -> bytes:
+    import pikepdf
+    # pikepdf trả số và bool dạng kiểu Python
+    return value.unparse() if isinstance(value, pikepdf.Object) else repr(value).encode("ascii")
+
+
+def _stream_key(stream) -> tuple:
+    stream_dict = sorted(
+        (str(key), _unparse(value)) for key, value in stream.stream_dict.items() if key != "/Length"
+    )
+    return ("stream", hashlib.sha256(stream.read_raw_bytes()).hexdigest(), tuple(stream_dict))
+
+
+def _replace_references(container, replacements: dict) -> None:
+    """Đổi tham chiếu tới object trùng sang bản được giữ lại, kể cả trong object lồng trực tiếp"""
+    import pikepdf
+    if isinstance(container, pikepdf.Array):
+        items = list(enumerate(container))
+    else:
+        items = list(container.items())
+    for key, value in items:
+        if not isinstance(value, pikepdf.Object):
+            continue
+        if value.is_indirect:
+            if value.objgen in replacements:
+                container[key] = replacements[value.objgen]
+        elif isinstance(value, (pikepdf.Dictionary, pikepdf.Array)):
+            _replace_references(value, replacements)
+
+
+def _dedup_objects(pdf) -> int:
+    """Gộp các stream (ảnh, font nhúng) và dictionary font giống hệt nhau, trả về số object bị gộp"""
+    import pikepdf
+    total = 0
+    # Gộp stream trước, lượt sau các font dictionary trỏ tới cùng stream mới trở nên giống nhau
+    for _ in range(3):
+        canonical = {}
+        replacements = {}
+        for obj in pdf.objects:
+            if isinstance(obj, pikepdf.Stream):
+                key = _stream_key(obj)
+            elif isinstance(obj, pikepdf.Dictionary) and str(obj.get("/Type", "")) in DEDUP_DICTIONARY_TYPES:
+                key = ("dict", obj.unparse(resolved=True))
+            else:
+                continue
+            if key in canonical:
+                replacements[obj.objgen] = canonical[key]
+            else:
+                canonical[key] = obj
+        if not replacements:
+            break
+        for obj in pdf.objects:
+            if isinstance(obj, pikepdf.Stream):
+                _replace_references(obj.stream_dict, replacements)
+            elif isinstance(obj, (pikepdf.Dictionary, pikepdf.Array)):
+                _replace_references(obj, replacements)
+        _replace_references(pdf.trailer, replacements)
+        total += len(replacements)
+    return total
+
+
+def _optimize_pikepdf(src: str, dest: str) -> None:
+    import pikepdf
+    with pikepdf.open(src) as pdf:
+        merged = _dedup_objects(pdf)
+        pdf.remove_unreferenced_resources()
+        pdf.save(
+            dest,
+            compress_streams=True,
+            recompress_flate=True,
+            object_stream_mode=pikepdf.ObjectStreamMode.generate,
+            linearize=PDF_OPTIMIZE_LINEARIZE,
+        )
+    if merged:
+        print(f"Đã gộp {merged} object trùng lặp")
+
+
+def _optimize_pypdf2(src: str, dest: str) -> None:
+    # PyPDF2 chỉ nén lại content stream của từng trang, không gộp object hay linearize
+    from PyPDF2 import PdfReader, PdfWriter
+    reader = PdfReader(src)
+    writer = PdfWriter()
+    for page in reader.pages:
+        writer.add_page(page)
+    for page in writer.pages:
+        page.compress_content_streams()
+    if reader.metadata:
+        writer.add_metadata(reader.metadata)
+    with open(dest, "wb") as f:
+        writer.write(f)
+
+
+def prewarm() -> None:
+    if PIKEPDF_AVAILABLE:
+        import pikepdf  # noqa: F401
+
+
+def optimize_pdf(path: str, kind: str = "converted") -> dict:
+    """Tối ưu PDF tại chỗ, chỉ thay file khi kết quả nhỏ hơn hoặc đã được linearize
+
+    Linearize thêm bảng hint nên file có thể lớn hơn một chút, khi đã bật thì
+    vẫn giữ bản linearize để viewer hiện trang đầu sớm.
+    Trả về {"before", "after", "method"}; lỗi khi tối ưu không làm hỏng file gốc.
+    """
+    before = os.path.getsize(path)
+    after = before
+    method = "pikepdf" if PIKEPDF_AVAILABLE else "pypdf2"
+    linearize = PIKEPDF_AVAILABLE and PDF_OPTIMIZE_LINEARIZE
+    dest = f"{path}.opt"
+    try:
+        with stage("optimize"):
+            if PIKEPDF_AVAILABLE:
+                _optimize_pikepdf(path, dest)
+            else:
+                _optimize_pypdf2(path, dest)
+        optimized_size = os.path.getsize(dest)
+        if optimized_size < before or linearize:
+            if optimized_size >= before:
+                print(f"Giữ bản linearize của {path} dù lớn hơn {optimized_size - before} bytes")
+            os.replace(dest, path)
+            after = os.path.getsize(path)
+        else:
+            print(f"Bỏ kết quả tối ưu của {path}: không nhỏ hơn bản gốc ({optimized_size} >= {before} bytes)")
+    except Exception as e:
+        print(f"Không thể tối ưu PDF {path}: {str(e)}")
+        method = "none"
+    finally:
+        if os.path.exists(dest):
+            os.remove(dest)
+
+    OPTIMIZE_INPUT_BYTES.inc(before, kind=kind)
+    OPTIMIZE_OUTPUT_BYTES.inc(after, kind=kind)
+    saved = before - after
+    print(f"Tối ưu PDF ({method}): {before} -> {after} bytes, giảm {saved} bytes ({saved * 100 / max(before, 1):.1f}%)")
+    return {"before": before, "after": after, "method": method}
+
+
+if __name__ == "__main__":
+    if not sys.argv[1:]:
+        print(__doc__)
+        sys.exit(1)
+    import shutil
+    import tempfile
+    with tempfile.TemporaryDirectory() as work_dir:
+        for source in sys.argv[1:]:
+            copy_path = os.path.join(work_dir, os.path.basename(source))
+            shutil.copyfile(source, copy_path)
+            print(f"{source}: {optimize_pdf(copy_path, 'cli')}")
@@ -0,0 +1,184 @@
+import os
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+from typing import List, Optional, Tuple
+
+import anyio
+from fastapi import Request
+from starlette.responses import Response
+
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def make_etag(stat_result: os.stat_result) -> str:
+    """ETag mạnh từ inode, kích thước và mtime; file PDF không bị sửa sau khi ghi"""
+    return f'"{stat_result.st_ino:x}-{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    return etag in [tag.strip() for tag in header.split(",")]
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Phân tích header Range một đoạn, trả về (start, end) bao gồm cả end
+
+    Trả về None khi header không hợp lệ hoặc có nhiều đoạn (phục vụ cả file),
+    ném ValueError khi đoạn nằm ngoài file (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    if (first and not first.isdigit()) or (last and not last.isdigit()) or not (first or last):
+        return None
+    if not first:
+        # Dạng bytes=-n: n byte cuối file
+        length = int(last)
+        if length == 0:
+            raise ValueError("Range rỗng")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and start > end:
+        return None
+    if start >= size:
+        raise ValueError("Range nằm ngoài file")
+    return start, min(end, size - 1)
+
+
+async def _send_file_range(scope, send, path: str, offset: int, count: int, more_body: bool) -> None:
+    """Gửi count byte của file từ offset, more_body cho biết còn dữ liệu phía sau"""
+    async with await anyio.open_file(path, mode="rb") as f:
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            # Server gửi thẳng từ file descriptor bằng sendfile
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": f.wrapped.fileno(),
+                "offset": offset,
+                "count": count,
+                "more_body": more_body,
+            })
+            return
+        await f.seek(offset)
+        remaining = count
+        while remaining > 0:
+            chunk = await f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0 or more_body})
+        if not more_body and (remaining > 0 or count == 0):
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class FileRangeResponse(Response):
+    """Trả về một đoạn của nội dung ghép từ các file liên tiếp, dùng zero-copy nếu server ASGI hỗ trợ
+
+    segments là danh sách (đường dẫn, số byte); PDF lưu thường chỉ có một file,
+    bản ký lưu dạng delta gồm file gốc và phần được nối thêm.
+    """
+
+    def __init__(self, segments: List[Tuple[str, int]], start: int, end: int, status_code: int, headers: dict):
+        super().__init__(status_code=status_code, headers=headers)
+        self.segments = segments
+        self.start = start
+        self.end = end
+        self.headers["content-length"] = str(end - start + 1)
+
+    def _pieces(self) -> List[Tuple[str, int, int]]:
+        pieces = []
+        position = 0
+        for path, length in self.segments:
+            first = max(self.start, position)
+            last = min(self.end, position + length - 1)
+            if first <= last:
+                pieces.append((path, first - position, last - first + 1))
+            position += length
+        return pieces
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+        pieces = self._pieces()
+        if scope.get("method") == "HEAD" or not pieces:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        for index, (path, offset, count) in enumerate(pieces):
+            await _send_file_range(scope, send, path, offset, count, index < len(pieces) - 1)
+
+
+def content_etag(sha256: str) -> str:
+    """ETag mạnh từ hash nội dung trong chỉ mục, không đổi khi file được tải lại vào bộ đệm"""
+    return f'"{sha256}"'
+
+
+def pdf_file_response(request: Request, path: str, filename: str, immutable: bool = True,
+                      media_type: str = "application/pdf", etag: Optional[str] = None,
+                      mtime: Optional[float] = None) -> Response:
+    """Trả về PDF (hoặc ảnh trang đã render) có ETag/Last-Modified, hỗ trợ 304 và Range 206
+
+    Khi không truyền etag/mtime, chúng được tính từ inode, kích thước và mtime của file.
+    """
+    stat_result = os.stat(path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise FileNotFoundError(path)
+    return segmented_file_response(
+        request, [(path, stat_result.st_size)], etag or make_etag(stat_result),
+        stat_result.st_mtime if mtime is None else mtime, filename, immutable, media_type
+    )
+
+
+def segmented_file_response(request: Request, segments: List[Tuple[str, int]], etag: str, mtime: float,
+                            filename: str, immutable: bool = True,
+                            media_type: str = "application/pdf") -> Response:
+    """Như pdf_file_response nhưng nội dung được ghép từ nhiều file khi gửi"""
+    size = sum(length for _, length in segments)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL,
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"inline; filename={filename}",
+        "X-Content-Type-Options": "nosniff",
+    }
+
+    if _not_modified(request, etag, mtime):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Type"] = media_type
+            return FileRangeResponse(segments, start, end, 206, headers)
+
+    headers["Content-Type"] = media_type
+    return FileRangeResponse(segments, 0, size - 1, 200, headers)
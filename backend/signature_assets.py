@@ -0,0 +1,121 @@
+import os
+import base64
+import hashlib
+import binascii
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+
+
+SIGNATURE_DIR = "static/signatures"
+# Độ phân giải khi in chữ ký, khung mặc định 180x120 pt của trang chữ ký A/B
+SIGNATURE_DPI = int(os.environ.get("SIGNATURE_DPI", 150))
+SIGNATURE_BOX_PT = (180, 120)
+SIGNATURE_COLORS = int(os.environ.get("SIGNATURE_COLORS", 32))
+SIGNATURE_CACHE_SIZE = int(os.environ.get("SIGNATURE_CACHE_SIZE", 256))
+# Số pixel tối đa của ảnh gửi lên, kiểm tra từ header trước khi giải mã
+MAX_SIGNATURE_PIXELS = int(os.environ.get("MAX_SIGNATURE_PIXELS", 4096 * 3072))
+
+
+class SignatureAssetStore:
+    """Chuẩn hóa và khử trùng lặp ảnh chữ ký
+
+    Data URL được giải mã một lần, thu nhỏ về đúng kích thước in, làm phẳng
+    nền trong suốt thành nền trắng và lượng tử hóa bảng màu. File được đặt tên
+    theo hash nội dung gửi lên nên cùng một chữ ký chỉ được xử lý và lưu một
+    lần; ImageReader đã giải mã được giữ trong cache để nhúng lại không tốn CPU.
+    Khung in lớn hơn khung mặc định (bố cục nhiều bên) có bản lưu riêng ở độ
+    phân giải tương ứng để chữ ký không bị phóng to và mờ.
+    """
+
+    def __init__(self, directory: str = SIGNATURE_DIR, dpi: int = SIGNATURE_DPI,
+                 colors: int = SIGNATURE_COLORS, cache_size: int = SIGNATURE_CACHE_SIZE):
+        self.directory = directory
+        self.dpi = dpi
+        self.max_size = self._pixel_size(SIGNATURE_BOX_PT)
+        self.colors = colors
+        self.cache_size = cache_size
+        self._readers = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _pixel_size(self, box_pt) -> tuple:
+        return tuple(max(1, round(pt * self.dpi / 72)) for pt in box_pt)
+
+    def _normalize(self, binary_data: bytes, max_size: tuple) -> bytes:
+        img = Image.open(BytesIO(binary_data))
+        if img.width * img.height > MAX_SIGNATURE_PIXELS:
+            raise ValueError(f"Ảnh chữ ký quá lớn: {img.width}x{img.height} px")
+        # JPEG được giải mã thẳng ở độ phân giải gần kích thước in, không cần giải mã cả ảnh gốc
+        img.draft("RGB", max_size)
+        img.load()
+
+        # Làm phẳng nền trong suốt thành nền trắng
+        if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+
+        img.thumbnail(max_size, Image.LANCZOS)
+        img = img.quantize(colors=self.colors)
+
+        output = BytesIO()
+        img.save(output, format="PNG", optimize=True)
+        return output.getvalue()
+
+    def save_data_url(self, data_url: str, box_pt: Optional[Tuple[float, float]] = None) -> str:
+        """Giải mã data URL, trả về đường dẫn ảnh đã chuẩn hóa
+
+        box_pt là khung lớn nhất (rộng, cao tính bằng point) mà ảnh sẽ được vẽ vào;
+        khung nhỏ hơn khung mặc định dùng chung bản mặc định.
+        """
+        try:
+            _, encoded = data_url.split(",", 1)
+            binary_data = base64.b64decode(encoded, validate=False)
+        except (ValueError, binascii.Error) as e:
+            raise ValueError(f"Data URL chữ ký không hợp lệ: {str(e)}")
+
+        digest = hashlib.sha256(binary_data).hexdigest()
+        max_size = self.max_size
+        if box_pt is not None:
+            max_size = tuple(max(default, size) for default, size in zip(self.max_size, self._pixel_size(box_pt)))
+        if max_size == self.max_size:
+            file_path = os.path.join(self.directory, f"signature_{digest[:32]}.png")
+        else:
+            file_path = os.path.join(self.directory, f"signature_{digest[:32]}_{max_size[0]}x{max_size[1]}.png")
+        if os.path.exists(file_path):
+            # Chữ ký đã có, làm mới mtime để janitor không xóa ảnh đang dùng
+            os.utime(file_path)
+            print(f"Dùng lại chữ ký đã lưu: {file_path}")
+            return file_path
+
+        normalized = self._normalize(binary_data, max_size)
+        part_path = f"{file_path}.{threading.get_ident()}.part"
+        with open(part_path, "wb") as f:
+            f.write(normalized)
+        os.replace(part_path, file_path)
+        print(f"Đã lưu chữ ký: {file_path}, {len(binary_data)} -> {len(normalized)} bytes")
+        return file_path
+
+    def image_reader(self, path: str) -> ImageReader:
+        """ImageReader đã giải mã cho ảnh chữ ký, dùng chung giữa các lần ký"""
+        with self._lock:
+            reader = self._readers.get(path)
+            if reader is not None:
+                self._readers.move_to_end(path)
+                return reader
+        reader = ImageReader(Image.open(path))
+        # Giải mã trước để các lần nhúng sau dùng lại dữ liệu RGB
+        reader.getRGBData()
+        with self._lock:
+            self._readers[path] = reader
+            while len(self._readers) > self.cache_size:
+                self._readers.popitem(last=False)
+        return reader
@@ -0,0 +1,217 @@
+"""Bố cục chữ ký nhiều bên: mỗi bên ký vào một khung trên trang có sẵn hoặc trên trang chữ ký nối thêm
+
+Bố cục được gửi dạng JSON trong trường form "layout":
+
+    {"parties": [
+        {"label": "BÊN A", "name": "Nguyễn Văn A", "signature_field": "signature_a_data",
+         "page": 3, "box": [360, 80, 180, 90]},
+        {"label": "BÊN B", "name": "Trần Thị B", "signature": "data:image/png;base64,..."}
+    ]}
+
+page đếm từ 1, số âm tính từ cuối (-1 là trang cuối); bỏ trống để ký trên
+trang chữ ký nối thêm. box là [x, y, rộng, cao] tính bằng point từ góc dưới
+trái của trang; trên trang nối thêm có thể bỏ trống để xếp khung tự động.
+"""
+import os
+import copy
+import json
+import math
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+
+MAX_SIGNATURE_PARTIES = int(os.environ.get("MAX_SIGNATURE_PARTIES", 50))
+
+# Khung xếp tự động trên trang chữ ký nối thêm, các cột giống trang chữ ký A/B.
+# Hàng đầu cách mép trên 110 point, ngay dưới tiêu đề
+AUTO_ROWS = 3
+AUTO_FIRST_ROW_OFFSET = 110
+AUTO_ROW_PITCH = 210
+# Nhãn được vẽ phía trên khung trên trang nối thêm, tính vào vùng chiếm chỗ khi kiểm tra chồng lấn
+LABEL_HEIGHT = 24
+# Khoảng cách giữa viền khung và vùng vẽ chữ ký trên trang nối thêm (ngang, dọc)
+FRAME_PADDING = (20, 10)
+
+
+class LayoutError(ValueError):
+    """Bố cục chữ ký không hợp lệ hoặc không khớp với tài liệu"""
+
+
+class SignatureParty:
+    """Một bên ký trong bố cục; page là chỉ số trang đếm từ 0, None là trang nối thêm"""
+
+    def __init__(self, label: Optional[str], name: Optional[str], signature_data: Optional[str],
+                 page: Optional[int], box: Optional[Tuple[float, float, float, float]]):
+        self.label = label
+        self.name = name
+        self.signature_data = signature_data
+        self.page = page
+        self.box = box
+        self.signature_path: Optional[str] = None
+
+
+def _parse_box(value) -> Tuple[float, float, float, float]:
+    if not isinstance(value, list) or len(value) != 4:
+        raise LayoutError("box phải có dạng [x, y, rộng, cao]")
+    try:
+        x, y, width, height = (float(item) for item in value)
+    except (TypeError, ValueError):
+        raise LayoutError("box phải gồm các số")
+    # JSON như 1e400 được đọc thành inf, ReportLab không vẽ được
+    for field, number in (("x", x), ("y", y), ("rộng", width), ("cao", height)):
+        if not math.isfinite(number):
+            raise LayoutError(f"Giá trị {field} của box phải là số hữu hạn")
+    if width <= 0 or height <= 0:
+        raise LayoutError("Chiều rộng và chiều cao của box phải lớn hơn 0")
+    return x, y, width, height
+
+
+def _overlaps(a: Tuple[float, float, float, float], b: Tuple[float, float, float, float]) -> bool:
+    """Hai khung trên trang nối thêm có chồng lên nhau không, tính cả nhãn phía trên khung"""
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    return ax < bx + bw and bx < ax + aw and ay < by + bh + LABEL_HEIGHT and by < ay + ah + LABEL_HEIGHT
+
+
+def parse_layout(value: str, fields: dict) -> List[SignatureParty]:
+    """Đọc bố cục JSON, ảnh chữ ký lấy trực tiếp hoặc từ trường form khác; ném LayoutError nếu không hợp lệ"""
+    try:
+        layout = json.loads(value)
+    except ValueError:
+        raise LayoutError("layout không phải JSON hợp lệ")
+    items = layout.get("parties") if isinstance(layout, dict) else layout
+    if not isinstance(items, list) or not items:
+        raise LayoutError("layout cần danh sách parties")
+    if len(items) > MAX_SIGNATURE_PARTIES:
+        raise LayoutError(f"Tối đa {MAX_SIGNATURE_PARTIES} bên ký")
+
+    parties = []
+    for number, item in enumerate(items, 1):
+        if not isinstance(item, dict):
+            raise LayoutError(f"Bên ký thứ {number} không hợp lệ")
+        page = item.get("page")
+        if page in (None, "append"):
+            page = None
+        elif isinstance(page, int) and not isinstance(page, bool) and page != 0:
+            # Đổi sang chỉ số đếm từ 0, số âm được phân giải khi biết số trang
+            page = page - 1 if page > 0 else page
+        else:
+            raise LayoutError(f"page của bên ký thứ {number} phải là số trang khác 0 hoặc \"append\"")
+        box = item.get("box")
+        if box is not None:
+            box = _parse_box(box)
+        elif page is not None:
+            raise LayoutError(f"Bên ký thứ {number} ký trên trang có sẵn cần box")
+        signature_data = item.get("signature")
+        if item.get("signature_field"):
+            signature_data = fields.get(item["signature_field"])
+        parties.append(SignatureParty(item.get("label"), item.get("name"), signature_data, page, box))
+
+    # Khung tự chọn trên trang nối thêm cùng nằm trên một trang nên không được chồng lên nhau
+    custom = [(number, party.box) for number, party in enumerate(parties, 1)
+              if party.page is None and party.box is not None]
+    for position, (number, box) in enumerate(custom):
+        for other_number, other_box in custom[:position]:
+            if _overlaps(box, other_box):
+                raise LayoutError(f"Khung của bên ký thứ {number} chồng lên bên ký thứ {other_number} trên trang nối thêm")
+    return parties
+
+
+def signature_area(party: SignatureParty) -> Tuple[float, float]:
+    """Kích thước lớn nhất (point) mà ảnh chữ ký của bên này được vẽ vào"""
+    if party.box is None:
+        from signature_template import FRAME_HEIGHT, FRAME_WIDTH
+        return FRAME_WIDTH - FRAME_PADDING[0], FRAME_HEIGHT - FRAME_PADDING[1]
+    _, _, width, height = party.box
+    if party.page is None:
+        return width - FRAME_PADDING[0], height - FRAME_PADDING[1]
+    return width, height
+
+
+def resolve_pages(parties: List[SignatureParty], page_count: int) -> List[SignatureParty]:
+    """Bản sao của parties với số trang âm đã đổi thành chỉ số thật, kiểm tra trang nằm trong tài liệu
+
+    Không sửa parties vì cùng một bố cục được dùng cho nhiều tài liệu khi ký theo lô.
+    """
+    resolved = []
+    for party in parties:
+        party = copy.copy(party)
+        if party.page is not None:
+            index = party.page + page_count if party.page < 0 else party.page
+            if not 0 <= index < page_count:
+                raise LayoutError(f"Trang {party.page + 1 if party.page >= 0 else party.page} không tồn tại, "
+                                  f"tài liệu có {page_count} trang")
+            party.page = index
+        resolved.append(party)
+    return resolved
+
+
+def _appended_pages(parties: List[SignatureParty]) -> List[List[Tuple[SignatureParty, tuple]]]:
+    """Chia các bên ký trên trang nối thêm thành từng trang kèm khung của mỗi bên
+
+    Các bên không có box được xếp tự động trước. Các khung tự chọn được đặt
+    chung trên trang nối thêm đầu tiên không có khung tự động nào chồng lên
+    chúng, nếu không có trang nào như vậy thì thêm một trang riêng.
+    """
+    from signature_template import FRAME_HEIGHT, FRAME_WIDTH, PAGE_HEIGHT, PARTY_FRAMES
+    columns = [frame_x for frame_x, _ in PARTY_FRAMES.values()]
+    slots_per_page = len(columns) * AUTO_ROWS
+    pages = []
+    auto_parties = [party for party in parties if party.box is None]
+    for auto_index, party in enumerate(auto_parties):
+        page_number, slot = divmod(auto_index, slots_per_page)
+        if len(pages) <= page_number:
+            pages.append([])
+        row, column = divmod(slot, len(columns))
+        top = PAGE_HEIGHT - AUTO_FIRST_ROW_OFFSET - row * AUTO_ROW_PITCH
+        pages[page_number].append((party, (columns[column], top - 24 - FRAME_HEIGHT, FRAME_WIDTH, FRAME_HEIGHT)))
+
+    custom = [(party, party.box) for party in parties if party.box is not None]
+    if custom:
+        for frames in pages:
+            if not any(_overlaps(box, frame) for _, box in custom for _, frame in frames):
+                frames.extend(custom)
+                break
+        else:
+            pages.append(custom)
+    return pages
+
+
+def render_layout(template, parties: List[SignatureParty],
+                  page_boxes: Dict[int, Tuple[float, float, float, float]]) -> Tuple[bytes, List[int], int]:
+    """Vẽ mọi chữ ký trong một canvas duy nhất
+
+    Mỗi trang đích có một trang overlay cùng kích thước MediaBox (theo thứ tự
+    chỉ số trang), sau đó là các trang chữ ký nối thêm. Trả về (PDF, danh
+    sách chỉ số trang đích theo thứ tự overlay, số trang nối thêm).
+    """
+    from reportlab.pdfgen import canvas
+    from signature_template import PAGE_HEIGHT, PAGE_WIDTH
+
+    targets = sorted({party.page for party in parties if party.page is not None})
+    appended = _appended_pages([party for party in parties if party.page is None])
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer)
+    for index in targets:
+        x0, y0, x1, y1 = page_boxes[index]
+        c.setPageSize((x1 - x0, y1 - y0))
+        for party in parties:
+            if party.page == index:
+                template.draw_party(c, party.signature_path, party.name, *party.box)
+        c.showPage()
+    for frames in appended:
+        c.setPageSize((PAGE_WIDTH, PAGE_HEIGHT))
+        template.draw_header(c)
+        for party, (x, y, width, height) in frames:
+            c.setLineWidth(1)
+            c.rect(x, y, width, height)
+            if party.label:
+                label = template.normalize(party.label)
+                c.setFont(template.bold_font, 14)
+                c.drawString(x + (width - c.stringWidth(label, template.bold_font, 14)) / 2, y + height + 10, label)
+            template.draw_party(c, party.signature_path, party.name, x + FRAME_PADDING[0] / 2, y,
+                                width - FRAME_PADDING[0], height - FRAME_PADDING[1])
+        template.draw_date(c)
+        c.showPage()
+    c.save()
+    return buffer.getvalue(), targets, len(appended)
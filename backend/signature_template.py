@@ -0,0 +1,223 @@
+import os
+from io import BytesIO
+from datetime import datetime
+from typing import Callable, Optional
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DecodedStreamObject, NameObject
+from PIL import Image
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfgen import canvas
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+
+
+# Kích thước trang A4 (595 x 842 points)
+PAGE_WIDTH, PAGE_HEIGHT = A4
+
+# Khung chữ ký của từng bên: (x của khung, x của nhãn)
+PARTY_FRAMES = {
+    "a": (50, 145),
+    "b": (315, 410),
+}
+FRAME_WIDTH = 230
+FRAME_HEIGHT = 150
+SIGNATURE_WIDTH = 180
+SIGNATURE_HEIGHT = 120
+
+
+class SignaturePageTemplate:
+    """Trang chữ ký dựng sẵn: phần tĩnh được vẽ một lần khi dùng lần đầu
+
+    Tiêu đề, đường kẻ, khung và nhãn bên A/B được render một lần thành content
+    stream. Mỗi request chỉ vẽ lớp động (ảnh chữ ký, tên, ngày ký) rồi chèn
+    stream tĩnh vào trước, không cần vẽ lại hay phân tích lại phần tĩnh.
+
+    Hai lớp dùng chung một bộ font nhúng: cả hai canvas đều giữ chỗ glyph của
+    chữ tĩnh trước khi vẽ, nên tên font và mã glyph trong stream tĩnh khớp với
+    font subset của trang động và trang chỉ nhúng font một lần.
+    """
+
+    def __init__(self, main_font: str, bold_font: str, normalize: Callable[[str], str],
+                 image_loader: Optional[Callable[[str], ImageReader]] = None):
+        self.main_font = main_font
+        self.bold_font = bold_font
+        self.normalize = normalize
+        self.image_loader = image_loader or (lambda path: ImageReader(Image.open(path)))
+        self.title = normalize("TRANG CHỮ KÝ XÁC NHẬN")
+        self.subtitle = normalize("Tài liệu này đã được ký điện tử bởi các bên")
+        self.party_labels = {"a": normalize("BÊN A"), "b": normalize("BÊN B")}
+        self._static_content = self._build_static_content()
+        print(f"Đã dựng sẵn mẫu trang chữ ký với font {main_font}/{bold_font}")
+
+    def draw_header(self, c: canvas.Canvas) -> None:
+        c.setFillColorRGB(0, 0, 0)  # Đảm bảo màu chữ là đen
+
+        # Vẽ các tiêu đề
+        c.setFont(self.bold_font, 18)
+        c.drawString(PAGE_WIDTH/2 - 110, PAGE_HEIGHT - 50, self.title)
+        c.setFont(self.main_font, 12)
+        c.drawString(PAGE_WIDTH/2 - 140, PAGE_HEIGHT - 70, self.subtitle)
+
+        # Vẽ đường kẻ ngang
+        c.setLineWidth(1)
+        c.line(50, PAGE_HEIGHT - 90, PAGE_WIDTH - 50, PAGE_HEIGHT - 90)
+
+    def draw_date(self, c: canvas.Canvas) -> None:
+        date_label = self.normalize(f"Ngày ký: {datetime.now().strftime('%d/%m/%Y')}")
+        c.setFont(self.main_font, 10)
+        c.drawString(PAGE_WIDTH/2 - 50, 50, date_label)
+
+    def draw_party(self, c: canvas.Canvas, signature_path: Optional[str], name: Optional[str],
+                   x: float, y: float, width: float, height: float) -> None:
+        """Vẽ một chữ ký vào khung bất kỳ: ảnh căn giữa phía trên, tên người ký ở đáy khung"""
+        c.setFillColorRGB(0, 0, 0)
+        font_size = max(6, min(12, height / 8))
+        name_height = 0
+        if name:
+            name = self.normalize(name)
+            text_width = c.stringWidth(name, self.bold_font, font_size)
+            if text_width > width:
+                font_size = max(4, font_size * width / text_width)
+                text_width = c.stringWidth(name, self.bold_font, font_size)
+            c.setFont(self.bold_font, font_size)
+            c.drawString(x + (width - text_width) / 2, y + 5, name)
+            name_height = font_size + 10
+        if signature_path and height > name_height:
+            try:
+                c.drawImage(self.image_loader(signature_path), x, y + name_height,
+                            width=width, height=height - name_height,
+                            preserveAspectRatio=True, anchor="c")
+            except Exception as img_error:
+                print(f"Lỗi khi thêm ảnh chữ ký {signature_path}: {str(img_error)}")
+
+    def _draw_static(self, c: canvas.Canvas) -> None:
+        self.draw_header(c)
+
+        # Vẽ khung chữ ký và nhãn của từng bên
+        for party, (frame_x, label_x) in PARTY_FRAMES.items():
+            c.setLineWidth(1)
+            c.rect(frame_x, PAGE_HEIGHT/2 - 50, FRAME_WIDTH, FRAME_HEIGHT)
+            c.setFont(self.bold_font, 14)
+            c.drawString(label_x, PAGE_HEIGHT/2 + 120, self.party_labels[party])
+
+    def _static_strings(self):
+        """Chữ của phần tĩnh theo thứ tự vẽ trong _draw_static"""
+        yield self.bold_font, self.title
+        yield self.main_font, self.subtitle
+        for party in PARTY_FRAMES:
+            yield self.bold_font, self.party_labels[party]
+
+    def _reserve_static_glyphs(self, c: canvas.Canvas) -> None:
+        # Gán tên font và mã glyph cho chữ tĩnh trước mọi thứ khác trên canvas,
+        # nhờ đó mọi canvas gọi hàm này có cùng mã cho phần chữ tĩnh
+        for font_name, text in self._static_strings():
+            font = pdfmetrics.getFont(font_name)
+            if font._dynamicFont:
+                for subset, _ in font.splitString(text, c._doc):
+                    font.getSubsetInternalName(subset, c._doc)
+            else:
+                c._doc.getInternalFontName(font_name)
+
+    @staticmethod
+    def _glyph_counts(c: canvas.Canvas) -> dict:
+        counts = {}
+        for font_name in pdfmetrics.getRegisteredFontNames():
+            font = pdfmetrics.getFont(font_name)
+            state = getattr(font, "state", {}).get(c._doc) if font._dynamicFont else None
+            if state is not None:
+                counts[font_name] = len(state.assignments)
+        return counts
+
+    def _draw_dynamic(self, c: canvas.Canvas, signatures: dict, names: dict) -> None:
+        c.setFillColorRGB(0, 0, 0)
+        for party, (frame_x, _) in PARTY_FRAMES.items():
+            signature_path = signatures.get(party)
+            if signature_path:
+                try:
+                    if not os.path.exists(signature_path):
+                        print(f"CẢNH BÁO: File chữ ký {party.upper()} không tồn tại: {signature_path}")
+                    else:
+                        # Căn giữa chữ ký trong khung
+                        sig_x = frame_x + (FRAME_WIDTH - SIGNATURE_WIDTH) / 2
+                        sig_y = PAGE_HEIGHT/2 - 30
+                        c.drawImage(self.image_loader(signature_path), sig_x, sig_y,
+                                    width=SIGNATURE_WIDTH, height=SIGNATURE_HEIGHT,
+                                    preserveAspectRatio=True)
+                except Exception as img_error:
+                    print(f"Lỗi khi thêm ảnh chữ ký {party.upper()}: {str(img_error)}")
+                    # Tiếp tục mà không dừng lại
+
+            name = names.get(party)
+            if name:
+                # Căn giữa tên người ký với font lớn hơn
+                name = self.normalize(name)
+                c.setFont(self.bold_font, 12)
+                text_width = c.stringWidth(name, self.bold_font, 12)
+                c.drawString(frame_x + (FRAME_WIDTH - text_width) / 2, PAGE_HEIGHT/2 - 45, name)
+
+        # Thêm ngày tháng ở cuối trang
+        self.draw_date(c)
+
+    def _build_static_content(self) -> Optional[bytes]:
+        buffer = BytesIO()
+        c = canvas.Canvas(buffer, pagesize=A4)
+        self._reserve_static_glyphs(c)
+        reserved = self._glyph_counts(c)
+        self._draw_static(c)
+        if self._glyph_counts(c) != reserved:
+            # Phần tĩnh dùng glyph chưa được giữ chỗ, mã glyph sẽ lệch với trang động
+            print("CẢNH BÁO: _static_strings không khớp _draw_static, dùng cách vẽ toàn bộ trang")
+            return None
+        c.save()
+        buffer.seek(0)
+        static_page = PdfReader(buffer).pages[0]
+        return b"q\n" + static_page.get_contents().get_data() + b"\nQ\n"
+
+    @staticmethod
+    def _render_canvas(draw, prepare=None) -> BytesIO:
+        buffer = BytesIO()
+        c = canvas.Canvas(buffer, pagesize=A4)
+        if prepare is not None:
+            prepare(c)
+        draw(c)
+        c.save()
+        buffer.seek(0)
+        return buffer
+
+    def render(self, signature_a_path: Optional[str], signature_a_name: Optional[str],
+               signature_b_path: Optional[str], signature_b_name: Optional[str]):
+        """Vẽ lớp động rồi chèn phần tĩnh dựng sẵn vào trước, trả về PageObject"""
+        if self._static_content is None:
+            return self.render_full(signature_a_path, signature_a_name, signature_b_path, signature_b_name)
+        signatures = {"a": signature_a_path, "b": signature_b_path}
+        names = {"a": signature_a_name, "b": signature_b_name}
+        buffer = self._render_canvas(lambda c: self._draw_dynamic(c, signatures, names),
+                                     prepare=self._reserve_static_glyphs)
+        reader = PdfReader(buffer)
+        page = reader.pages[0]
+
+        # Stream tĩnh dùng chính /Resources của trang động (cùng font subset).
+        # Stream mới được đăng ký như một object gián tiếp của reader: với PyPDF2
+        # 3.0.1, cache_indirect_object chỉ ghi vào reader.resolved_objects và gán
+        # indirect_reference, get_object đọc cache này trước bảng xref. Số object
+        # là /Size của file ReportLab vừa ghi, lớn hơn mọi object thật nên không
+        # trùng; reader chỉ dùng cho trang này nên khi clone sang writer stream
+        # được sao chép như mọi object khác, nội dung động không phải mã hóa lại.
+        prefix = DecodedStreamObject()
+        prefix.set_data(self._static_content)
+        reader.cache_indirect_object(0, int(reader.trailer["/Size"]), prefix)
+        page[NameObject("/Contents")] = ArrayObject([prefix.indirect_reference, page.raw_get("/Contents")])
+        return page
+
+    def render_full(self, signature_a_path: Optional[str], signature_a_name: Optional[str],
+                    signature_b_path: Optional[str], signature_b_name: Optional[str]):
+        """Vẽ toàn bộ trang chữ ký trong một lần, dùng khi tắt mẫu dựng sẵn"""
+        signatures = {"a": signature_a_path, "b": signature_b_path}
+        names = {"a": signature_a_name, "b": signature_b_name}
+
+        def draw(c):
+            self._draw_static(c)
+            self._draw_dynamic(c, signatures, names)
+
+        return PdfReader(self._render_canvas(draw)).pages[0]
@@ -0,0 +1,86 @@
+"""Tài nguyên dùng khi ký: font tiếng Việt, kho ảnh chữ ký và mẫu trang chữ ký
+
+Tất cả được tạo khi dùng lần đầu (hoặc khi prewarm) thay vì lúc import, nhờ
+đó process chỉ phục vụ /view không phải nạp ReportLab, PIL, PyPDF2 và phân
+tích file font.
+"""
+import os
+import threading
+import unicodedata
+
+
+FONT_DIR = os.path.join(os.path.dirname(__file__), "fonts")
+
+_lock = threading.RLock()
+_fonts = None
+_signature_assets = None
+_signature_template = None
+
+
+def register_fonts():
+    """Đăng ký font hỗ trợ tiếng Việt với ReportLab, trả về (font thường, font đậm, có tiếng Việt)"""
+    global _fonts
+    with _lock:
+        if _fonts is not None:
+            return _fonts
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        try:
+            font_path = os.path.join(FONT_DIR, 'DejaVuSans.ttf')
+            if os.path.exists(font_path):
+                pdfmetrics.registerFont(TTFont('DejaVuSans', font_path))
+                pdfmetrics.registerFont(TTFont('DejaVuSans-Bold', os.path.join(FONT_DIR, 'DejaVuSans-Bold.ttf')))
+                _fonts = ("DejaVuSans", "DejaVuSans-Bold", True)
+                print("Đã đăng ký font DejaVuSans để hỗ trợ tiếng Việt")
+            else:
+                noto_path = os.path.join(FONT_DIR, 'NotoSans-Regular.ttf')
+                if os.path.exists(noto_path):
+                    pdfmetrics.registerFont(TTFont('NotoSans', noto_path))
+                    pdfmetrics.registerFont(TTFont('NotoSans-Bold', os.path.join(FONT_DIR, 'NotoSans-Bold.ttf')))
+                    _fonts = ("NotoSans", "NotoSans-Bold", True)
+                    print("Đã đăng ký font NotoSans để hỗ trợ tiếng Việt")
+                else:
+                    raise Exception("Không tìm thấy font hỗ trợ tiếng Việt")
+        except Exception as e:
+            _fonts = ("Helvetica", "Helvetica-Bold", False)
+            print(f"Không thể đăng ký font hỗ trợ tiếng Việt: {str(e)}")
+            print("Sử dụng font Helvetica mặc định của ReportLab")
+        return _fonts
+
+
+def normalize_vietnamese_text(text):
+    # Font mặc định không có dấu tiếng Việt nên bỏ dấu trước khi vẽ
+    if not register_fonts()[2]:
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join([c for c in text if not unicodedata.combining(c)])
+    return text
+
+
+def get_signature_assets():
+    """Kho ảnh chữ ký dùng chung, tạo khi dùng lần đầu"""
+    global _signature_assets
+    with _lock:
+        if _signature_assets is None:
+            from signature_assets import SignatureAssetStore
+            _signature_assets = SignatureAssetStore()
+        return _signature_assets
+
+
+def get_signature_template():
+    """Mẫu trang chữ ký dựng sẵn phần tĩnh, tạo khi dùng lần đầu"""
+    global _signature_template
+    with _lock:
+        if _signature_template is None:
+            from signature_template import SignaturePageTemplate
+            main_font, bold_font, _ = register_fonts()
+            _signature_template = SignaturePageTemplate(
+                main_font, bold_font, normalize_vietnamese_text,
+                image_loader=get_signature_assets().image_reader
+            )
+        return _signature_template
+
+
+def prewarm() -> None:
+    """Nạp sẵn font, mẫu trang chữ ký và module ghi PDF"""
+    get_signature_template()
+    import pdf_incremental  # noqa: F401
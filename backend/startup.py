@@ -0,0 +1,73 @@
+"""Đo thời gian khởi động và prewarm các phân hệ nặng khi process mới lên
+
+Các phân hệ chuyển đổi, ký và render được nạp khi dùng lần đầu. PREWARM cho
+phép nạp sẵn một số phân hệ ngay sau khi khởi động, theo tên đã đăng ký hoặc
+dạng "module:hàm" cho hook tùy chỉnh.
+"""
+import os
+import time
+import importlib
+from typing import Callable, Dict, List, Optional
+
+from metrics import REGISTRY, Gauge
+
+
+# Danh sách phân hệ prewarm, phân tách bằng dấu phẩy, ví dụ "conversion,signing,render"
+PREWARM = os.environ.get("PREWARM", "conversion")
+# Chờ prewarm xong mới nhận request, hợp với readiness probe của pod mới
+PREWARM_BLOCKING = os.environ.get("PREWARM_BLOCKING", "0") != "0"
+
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    "pdf_service_startup_seconds", "Thời gian từng giai đoạn khởi động", ["phase"]))
+
+PREWARM_HOOKS: Dict[str, Callable[[], None]] = {}
+
+
+def record_phase(phase: str, seconds: float) -> None:
+    STARTUP_SECONDS.set(seconds, phase=phase)
+
+
+def process_uptime() -> Optional[float]:
+    """Số giây từ khi process bắt đầu chạy, None nếu không đọc được /proc"""
+    try:
+        with open("/proc/self/stat", "rb") as f:
+            # Tên lệnh có thể chứa dấu cách nên tách sau dấu ngoặc đóng cuối cùng
+            fields = f.read().rsplit(b")", 1)[1].split()
+        with open("/proc/uptime", "rb") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def register_prewarm(name: str, hook: Callable[[], None]) -> None:
+    PREWARM_HOOKS[name] = hook
+
+
+def prewarm_names(value: str = PREWARM) -> List[str]:
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+
+def _resolve_hook(name: str) -> Callable[[], None]:
+    if name in PREWARM_HOOKS:
+        return PREWARM_HOOKS[name]
+    if ":" in name:
+        module_name, function_name = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), function_name)
+    raise ValueError(f"Phân hệ prewarm không hợp lệ: {name}")
+
+
+def run_prewarm(names: List[str]) -> None:
+    """Chạy lần lượt các hook prewarm, lỗi của một hook không chặn các hook khác"""
+    started = time.perf_counter()
+    for name in names:
+        hook_started = time.perf_counter()
+        try:
+            _resolve_hook(name)()
+        except Exception as e:
+            print(f"Không thể prewarm {name}: {str(e)}")
+            continue
+        elapsed = time.perf_counter() - hook_started
+        record_phase(f"prewarm_{name}", elapsed)
+        print(f"Đã prewarm {name} trong {elapsed:.3f}s")
+    record_phase("prewarm", time.perf_counter() - started)
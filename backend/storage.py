@@ -0,0 +1,510 @@
+"""Lưu trữ PDF theo thư mục phân mảnh kèm chỉ mục metadata SQLite
+
+Chạy trực tiếp để chuyển các file cũ trong static/pdfs sang bố cục mới:
+
+    python storage.py migrate
+"""
+import os
+import re
+import sys
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import List, Optional
+
+from artifacts import atomic_write, publish_file
+
+
+# Cấu hình lưu trữ qua biến môi trường
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "local")
+STORAGE_DIR = os.environ.get("STORAGE_DIR", "static/pdfs")
+STORAGE_INDEX_PATH = os.environ.get("STORAGE_INDEX_PATH", "data/storage_index.sqlite3")
+LEGACY_PDF_DIR = "static/pdfs"
+S3_BUCKET = os.environ.get("S3_BUCKET", "")
+S3_PREFIX = os.environ.get("S3_PREFIX", "pdfs/")
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None
+S3_REGION = os.environ.get("S3_REGION") or None
+S3_CACHE_DIR = os.environ.get("S3_CACHE_DIR", "cache/s3")
+S3_CACHE_TTL_SECONDS = int(os.environ.get("S3_CACHE_TTL_SECONDS", 24 * 3600))
+# Bản ký nối thêm vào file gốc chỉ lưu phần delta, "full" để lưu nguyên file
+SIGNED_STORAGE = os.environ.get("SIGNED_STORAGE", "delta")
+# Bản ghép đầy đủ của PDF lưu dạng delta, dùng khi cần đường dẫn file (render, ký tiếp)
+ASSEMBLED_CACHE_DIR = os.environ.get("ASSEMBLED_CACHE_DIR", "cache/assembled")
+ASSEMBLED_CACHE_TTL_SECONDS = int(os.environ.get("ASSEMBLED_CACHE_TTL_SECONDS", 3600))
+
+# pdf_id chỉ gồm ký tự an toàn, không thể trỏ ra ngoài thư mục lưu trữ
+PDF_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+CHUNK_SIZE = 1024 * 1024
+
+
+def valid_pdf_id(pdf_id: str) -> bool:
+    return bool(PDF_ID_PATTERN.match(pdf_id or "")) and ".." not in pdf_id
+
+
+def shard_key(pdf_id: str, suffix: str = ".pdf") -> str:
+    """Khóa lưu trữ dạng ab/cd/{pdf_id}.pdf, phân mảnh theo hash của id"""
+    digest = hashlib.sha1(pdf_id.encode("utf-8")).hexdigest()
+    return f"{digest[:2]}/{digest[2:4]}/{pdf_id}{suffix}"
+
+
+def file_digest(path: str):
+    """Trả về (sha256, kích thước) của file"""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def file_digest_with_prefix(path: str, prefix_size: int):
+    """Trả về (sha256, kích thước, sha256 của prefix_size byte đầu) trong một lượt đọc"""
+    digest = hashlib.sha256()
+    prefix_digest = None
+    size = 0
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if prefix_digest is None and size + len(chunk) >= prefix_size:
+                digest.update(chunk[:prefix_size - size])
+                prefix_digest = digest.copy().hexdigest()
+                digest.update(chunk[prefix_size - size:])
+            else:
+                digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size, prefix_digest
+
+
+class MetadataIndex:
+    """Chỉ mục SQLite: id, hash, kích thước, thời điểm tạo, tài liệu nguồn, lineage ký
+
+    base_size khác NULL nghĩa là file chỉ lưu phần nối thêm sau base_size byte
+    đầu tiên, phần đó chính là toàn bộ nội dung của parent_id.
+    """
+
+    COLUMNS = ("id", "kind", "backend", "storage_key", "sha256", "size", "created_at",
+               "source_name", "source_sha256", "parent_id", "base_size")
+
+    def __init__(self, path: str = STORAGE_INDEX_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS artifacts (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    backend TEXT NOT NULL,
+                    storage_key TEXT NOT NULL,
+                    sha256 TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    source_name TEXT,
+                    source_sha256 TEXT,
+                    parent_id TEXT,
+                    base_size INTEGER
+                )
+            """)
+            # Chỉ mục tạo trước khi có lưu trữ delta
+            columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(artifacts)")}
+            if "base_size" not in columns:
+                self._conn.execute("ALTER TABLE artifacts ADD COLUMN base_size INTEGER")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS artifacts_sha256 ON artifacts (sha256)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS artifacts_parent ON artifacts (parent_id)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS artifacts_kind_created ON artifacts (kind, created_at)")
+
+    def put(self, record: dict) -> None:
+        placeholders = ", ".join("?" for _ in self.COLUMNS)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO artifacts ({', '.join(self.COLUMNS)}) VALUES ({placeholders})",
+                [record.get(column) for column in self.COLUMNS]
+            )
+
+    def get(self, pdf_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM artifacts WHERE id = ?", (pdf_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def children(self, pdf_id: str) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM artifacts WHERE parent_id = ? ORDER BY created_at", (pdf_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def expired(self, kind: str, before: float) -> List[dict]:
+        # Bản ghi còn được tài liệu khác tham chiếu thì giữ lại
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT * FROM artifacts AS a
+                WHERE a.kind = ? AND a.created_at < ?
+                  AND NOT EXISTS (SELECT 1 FROM artifacts AS c WHERE c.parent_id = a.id)
+            """, (kind, before)).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete(self, pdf_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM artifacts WHERE id = ?", (pdf_id,))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+
+    def totals(self, backend: Optional[str] = None) -> dict:
+        """Tổng kích thước tài liệu và số byte thực sự lưu, của mọi backend hoặc chỉ một backend"""
+        query = "SELECT COALESCE(SUM(size), 0), COALESCE(SUM(size - COALESCE(base_size, 0)), 0) FROM artifacts"
+        with self._lock:
+            if backend is None:
+                logical, stored = self._conn.execute(query).fetchone()
+            else:
+                logical, stored = self._conn.execute(f"{query} WHERE backend = ?", (backend,)).fetchone()
+        return {"logical": logical, "stored": stored}
+
+
+class LocalStorage:
+    """Lưu file trên đĩa local theo khóa phân mảnh"""
+
+    name = "local"
+
+    def __init__(self, root: str = STORAGE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key)
+
+    def put(self, src_path: str, key: str) -> str:
+        """Chuyển file vào kho bằng rename, trả về đường dẫn local"""
+        dest = self.path(key)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        publish_file(src_path, dest)
+        return dest
+
+    def local_path(self, key: str) -> Optional[str]:
+        return self.path(key)
+
+    def delete(self, key: str) -> None:
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def prune(self, ttl: int) -> int:
+        """Xóa file không được truy cập quá ttl giây, dùng cho bộ đệm local"""
+        removed = 0
+        now = time.time()
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    if now - os.stat(path).st_mtime > ttl:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+        return removed
+
+
+class S3Storage:
+    """Lưu file trên S3 hoặc dịch vụ tương thích (MinIO, moto server)
+
+    Bản local của file được giữ trong bộ đệm phân mảnh để /view vẫn phục vụ
+    được Range và sendfile; file chưa có trong bộ đệm được tải về khi cần.
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX,
+                 endpoint_url: Optional[str] = S3_ENDPOINT_URL, region: Optional[str] = S3_REGION,
+                 cache_dir: str = S3_CACHE_DIR):
+        try:
+            import boto3
+        except ImportError:
+            raise Exception("Cần cài boto3 để dùng STORAGE_BACKEND=s3")
+        if not bucket:
+            raise Exception("Thiếu S3_BUCKET")
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+        self.cache = LocalStorage(cache_dir)
+        self._download_lock = threading.Lock()
+
+    def put(self, src_path: str, key: str) -> str:
+        self.client.upload_file(src_path, self.bucket, self.prefix + key,
+                                ExtraArgs={"ContentType": "application/pdf"})
+        return self.cache.put(src_path, key)
+
+    def local_path(self, key: str) -> Optional[str]:
+        path = self.cache.path(key)
+        if os.path.exists(path):
+            # Làm mới mtime để bộ đệm giữ lại file đang được xem
+            os.utime(path)
+            return path
+        from botocore.exceptions import ClientError
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part_path = f"{path}.{threading.get_ident()}.part"
+        try:
+            self.client.download_file(self.bucket, self.prefix + key, part_path)
+        except ClientError as e:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise
+        os.replace(part_path, path)
+        return path
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+        self.cache.delete(key)
+
+    def prune(self, ttl: int = S3_CACHE_TTL_SECONDS) -> int:
+        return self.cache.prune(ttl)
+
+
+class ArtifactStore:
+    """Điểm truy cập chung: lưu file vào backend và ghi metadata vào chỉ mục
+
+    Id được phân giải qua chỉ mục nên không cần dò hệ thống file; file cũ
+    nằm phẳng trong static/pdfs vẫn đọc được khi chưa có trong chỉ mục.
+    Bản ký bắt đầu bằng đúng các byte của tài liệu gốc chỉ lưu phần nối thêm.
+    """
+
+    def __init__(self, backend, index: MetadataIndex, legacy_dir: str = LEGACY_PDF_DIR,
+                 signed_storage: str = SIGNED_STORAGE, assembled_dir: str = ASSEMBLED_CACHE_DIR):
+        self.backend = backend
+        self.index = index
+        self.legacy_dir = legacy_dir
+        self.signed_storage = signed_storage
+        self.assembled = LocalStorage(assembled_dir)
+        self._assemble_lock = threading.Lock()
+
+    def put(self, src_path: str, pdf_id: str, kind: str, source_name: Optional[str] = None,
+            source_sha256: Optional[str] = None, parent_id: Optional[str] = None,
+            created_at: Optional[float] = None, delta: bool = False) -> dict:
+        """Chuyển file vào kho, trả về bản ghi metadata kèm đường dẫn local
+
+        delta=True cho phép chỉ lưu phần nối thêm nếu file bắt đầu bằng nội dung của parent_id.
+        """
+        if not valid_pdf_id(pdf_id):
+            raise ValueError(f"pdf_id không hợp lệ: {pdf_id}")
+        base = self.index.get(parent_id) if delta and parent_id and self.signed_storage == "delta" else None
+        base_size = None
+        if base is not None:
+            sha256, size, prefix_sha256 = file_digest_with_prefix(src_path, base["size"])
+            if size > base["size"] and prefix_sha256 == base["sha256"]:
+                base_size = base["size"]
+        else:
+            sha256, size = file_digest(src_path)
+
+        # Id được ghi lại với nội dung khác (ví dụ local_* tải lên lần nữa): bản ký dạng delta phải tách ra trước
+        existing = self.index.get(pdf_id)
+        if existing is not None:
+            if existing["sha256"] != sha256:
+                self._detach_delta_children(pdf_id)
+            self.assembled.delete(shard_key(pdf_id))
+
+        if base_size is None:
+            key = shard_key(pdf_id)
+            path = self.backend.put(src_path, key)
+        else:
+            key = shard_key(pdf_id, ".delta")
+            delta_path = f"{src_path}.delta"
+            with open(src_path, "rb") as src, open(delta_path, "wb") as dest:
+                src.seek(base_size)
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+            self.backend.put(delta_path, key)
+            # File đầy đủ vừa ghi vẫn còn, giữ làm bản ghép sẵn cho lần đọc đầu
+            path = self.assembled.put(src_path, shard_key(pdf_id))
+        record = {
+            "id": pdf_id,
+            "kind": kind,
+            "backend": self.backend.name,
+            "storage_key": key,
+            "sha256": sha256,
+            "size": size,
+            "created_at": created_at or time.time(),
+            "source_name": source_name,
+            "source_sha256": source_sha256,
+            "parent_id": parent_id,
+            "base_size": base_size,
+        }
+        self.index.put(record)
+        return dict(record, path=path)
+
+    def get(self, pdf_id: str) -> Optional[dict]:
+        if not valid_pdf_id(pdf_id):
+            return None
+        return self.index.get(pdf_id)
+
+    def segments(self, pdf_id: str) -> Optional[List[tuple]]:
+        """Danh sách (đường dẫn local, số byte) ghép lại thành PDF, None nếu thiếu phần nào"""
+        if not valid_pdf_id(pdf_id):
+            return None
+        record = self.index.get(pdf_id)
+        if record is None:
+            legacy_path = os.path.join(self.legacy_dir, f"{pdf_id}.pdf")
+            return [(legacy_path, os.path.getsize(legacy_path))] if os.path.isfile(legacy_path) else None
+        path = self.backend.local_path(record["storage_key"])
+        if path is None:
+            return None
+        if record["base_size"] is None:
+            return [(path, record["size"])]
+        base_segments = self.segments(record["parent_id"])
+        if base_segments is None:
+            return None
+        return base_segments + [(path, record["size"] - record["base_size"])]
+
+    def resolve(self, pdf_id: str) -> Optional[str]:
+        """Đường dẫn local của PDF, None nếu id không tồn tại"""
+        if not valid_pdf_id(pdf_id):
+            return None
+        record = self.index.get(pdf_id)
+        if record is None:
+            legacy_path = os.path.join(self.legacy_dir, f"{pdf_id}.pdf")
+            return legacy_path if os.path.isfile(legacy_path) else None
+        if record["base_size"] is None:
+            return self.backend.local_path(record["storage_key"])
+        return self._assemble(record)
+
+    def _assemble(self, record: dict) -> Optional[str]:
+        """Ghép bản delta với tài liệu gốc thành file đầy đủ trong bộ đệm"""
+        key = shard_key(record["id"])
+        path = self.assembled.path(key)
+        with self._assemble_lock:
+            if os.path.exists(path):
+                os.utime(path)
+                return path
+            segments = self.segments(record["id"])
+            if segments is None:
+                return None
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with atomic_write(path) as dest:
+                for segment_path, length in segments:
+                    with open(segment_path, "rb") as src:
+                        remaining = length
+                        while remaining > 0:
+                            chunk = src.read(min(CHUNK_SIZE, remaining))
+                            if not chunk:
+                                raise Exception(f"Thiếu dữ liệu khi ghép {record['id']}: {segment_path}")
+                            dest.write(chunk)
+                            remaining -= len(chunk)
+        return path
+
+    def _detach_delta_children(self, pdf_id: str) -> None:
+        """Chuyển các bản ký dạng delta của pdf_id sang lưu đầy đủ"""
+        for child in self.index.children(pdf_id):
+            if child["base_size"] is None:
+                continue
+            path = self._assemble(child)
+            if path is None:
+                print(f"Không thể tách bản ký {child['id']} khỏi {pdf_id}")
+                continue
+            full_path = f"{path}.{threading.get_ident()}.full"
+            with open(path, "rb") as src, open(full_path, "wb") as dest:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+            key = shard_key(child["id"])
+            self.backend.put(full_path, key)
+            self.index.put(dict(child, storage_key=key, base_size=None))
+            self.backend.delete(child["storage_key"])
+            print(f"Đã chuyển bản ký {child['id']} sang lưu đầy đủ")
+
+    def exists(self, pdf_id: str) -> bool:
+        """Kiểm tra id có trong kho mà không tải file từ backend về"""
+        if not valid_pdf_id(pdf_id):
+            return False
+        if self.index.get(pdf_id) is not None:
+            return True
+        return os.path.isfile(os.path.join(self.legacy_dir, f"{pdf_id}.pdf"))
+
+    def delete(self, pdf_id: str) -> None:
+        record = self.get(pdf_id)
+        if record is not None:
+            self._detach_delta_children(pdf_id)
+            self.backend.delete(record["storage_key"])
+            self.assembled.delete(shard_key(pdf_id))
+            self.index.delete(pdf_id)
+
+    def expire(self, kind: str, ttl: int) -> int:
+        """Xóa tài liệu loại kind quá ttl giây mà không còn tài liệu nào tham chiếu"""
+        if ttl <= 0:
+            return 0
+        records = self.index.expired(kind, time.time() - ttl)
+        for record in records:
+            try:
+                self.backend.delete(record["storage_key"])
+                self.assembled.delete(shard_key(record["id"]))
+            except Exception as e:
+                print(f"Lỗi khi xóa {record['id']}: {str(e)}")
+                continue
+            self.index.delete(record["id"])
+        if records:
+            print(f"Đã xóa {len(records)} PDF loại {kind} quá hạn")
+        return len(records)
+
+    def prune_assembled(self, ttl: int = ASSEMBLED_CACHE_TTL_SECONDS) -> int:
+        """Dọn bản ghép đầy đủ không được đọc quá ttl giây, có thể ghép lại khi cần"""
+        return self.assembled.prune(ttl)
+
+    def import_legacy(self) -> int:
+        """Chuyển các file phẳng cũ trong legacy_dir vào kho và chỉ mục"""
+        imported = 0
+        with os.scandir(self.legacy_dir) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.endswith(".pdf"):
+                    continue
+                pdf_id = entry.name[:-len(".pdf")]
+                if not valid_pdf_id(pdf_id) or self.index.get(pdf_id) is not None:
+                    continue
+                if pdf_id.startswith("signed_"):
+                    kind = "signed"
+                elif pdf_id.startswith("local_"):
+                    kind = "local"
+                else:
+                    kind = "converted"
+                self.put(entry.path, pdf_id, kind, created_at=entry.stat().st_mtime)
+                imported += 1
+        return imported
+
+
+def create_storage_backend(name: str = STORAGE_BACKEND):
+    if name == "local":
+        return LocalStorage()
+    if name == "s3":
+        return S3Storage()
+    raise ValueError(f"Backend lưu trữ không hợp lệ: {name}")
+
+
+def create_artifact_store() -> ArtifactStore:
+    store = ArtifactStore(create_storage_backend(), MetadataIndex())
+    print(f"Kho PDF: backend {store.backend.name}, {store.index.count()} tài liệu trong chỉ mục")
+    return store
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print(__doc__)
+        sys.exit(1)
+    count = create_artifact_store().import_legacy()
+    print(f"Đã chuyển {count} file sang kho phân mảnh")
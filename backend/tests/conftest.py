@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Các module của backend nằm phẳng trong thư mục cha
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
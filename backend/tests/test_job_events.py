@@ -0,0 +1,115 @@
+"""Chặn SSRF khi gửi webhook: địa chỉ nội bộ bị từ chối và redirect không được đi theo"""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import job_events
+from job_events import deliver_webhook, validate_callback_url
+
+
+@pytest.fixture(autouse=True)
+def webhook_config(monkeypatch):
+    monkeypatch.setattr(job_events, "WEBHOOK_ALLOWED_HOSTS", [])
+    monkeypatch.setattr(job_events, "WEBHOOK_ALLOW_PRIVATE", False)
+    monkeypatch.setattr(job_events, "WEBHOOK_RETRIES", 0)
+    monkeypatch.setattr(job_events, "WEBHOOK_TIMEOUT_SECONDS", 2)
+
+
+@pytest.fixture
+def receiver():
+    """Server HTTP local ghi lại các path nhận được, /redirect trả 302 sang /target"""
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            hits.append(self.path)
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.path == "/redirect":
+                self.send_response(302)
+                self.send_header("Location", "/target")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", hits
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/hook",
+    "http://127.1.2.3:8080/hook",
+    "http://localhost/hook",
+    "http://api.localhost/hook",
+    "http://10.0.0.5/hook",
+    "http://172.16.1.1/hook",
+    "http://192.168.1.10/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://100.64.0.1/hook",
+    "http://0.0.0.0/hook",
+    "http://[::1]/hook",
+    "http://[fe80::1]/hook",
+    "http://[fd00::1]/hook",
+    "http://[::ffff:127.0.0.1]/hook",
+    "http://224.0.0.1/hook",
+])
+def test_rejects_internal_addresses(url):
+    with pytest.raises(ValueError):
+        validate_callback_url(url)
+
+
+@pytest.mark.parametrize("url", ["ftp://example.com/hook", "file:///etc/passwd", "http:///hook", "hook"])
+def test_rejects_non_http_urls(url):
+    with pytest.raises(ValueError):
+        validate_callback_url(url)
+
+
+def test_accepts_public_addresses():
+    assert validate_callback_url("https://93.184.216.34/hook") == "https://93.184.216.34/hook"
+    # Tên miền được kiểm tra lúc kết nối
+    assert validate_callback_url("https://hooks.example.com/x") == "https://hooks.example.com/x"
+
+
+def test_allowlist_rejects_other_hosts(monkeypatch):
+    monkeypatch.setattr(job_events, "WEBHOOK_ALLOWED_HOSTS", ["hooks.example.com"])
+    assert validate_callback_url("https://hooks.example.com/x")
+    with pytest.raises(ValueError):
+        validate_callback_url("https://evil.example.com/x")
+
+
+def test_delivery_blocks_names_resolving_to_internal_addresses(receiver, monkeypatch):
+    base_url, hits = receiver
+    port = base_url.rsplit(":", 1)[1]
+    real_getaddrinfo = job_events.socket.getaddrinfo
+    # Tên miền công khai nhưng DNS trả về loopback
+    monkeypatch.setattr(job_events.socket, "getaddrinfo",
+                        lambda host, *args: real_getaddrinfo("127.0.0.1", *args))
+    url = f"http://rebind.example.com:{port}/hook"
+    assert validate_callback_url(url) == url
+
+    assert deliver_webhook(url, {"job_id": "1"}) is False
+    assert hits == []
+
+
+def test_delivery_to_allowlisted_host(receiver, monkeypatch):
+    base_url, hits = receiver
+    monkeypatch.setattr(job_events, "WEBHOOK_ALLOWED_HOSTS", ["127.0.0.1"])
+
+    assert deliver_webhook(f"{base_url}/hook", {"job_id": "1"}) is True
+    assert hits == ["/hook"]
+
+
+def test_delivery_does_not_follow_redirects(receiver, monkeypatch):
+    base_url, hits = receiver
+    monkeypatch.setattr(job_events, "WEBHOOK_ALLOWED_HOSTS", ["127.0.0.1"])
+
+    assert deliver_webhook(f"{base_url}/redirect", {"job_id": "1"}) is False
+    assert hits == ["/redirect"]
@@ -0,0 +1,45 @@
+"""Tìm trang trong cây /Pages có nút rỗng và nhánh không đều"""
+import pytest
+from PyPDF2 import PdfReader
+from reportlab.pdfgen import canvas
+
+from pdf_incremental import _find_page
+
+pikepdf = pytest.importorskip("pikepdf")
+
+
+@pytest.fixture
+def uneven_pdf(tmp_path):
+    """5 trang, Kids của gốc là [rỗng, P0, (P1 P2 P3), rỗng, P4]: /Count bằng số kid nhưng không phải toàn trang lá"""
+    flat_path = str(tmp_path / "flat.pdf")
+    c = canvas.Canvas(flat_path)
+    for number in range(5):
+        c.drawString(100, 100, f"P{number}")
+        c.showPage()
+    c.save()
+
+    with pikepdf.open(flat_path) as pdf:
+        root = pdf.Root.Pages
+        pages = [page.obj for page in pdf.pages]
+
+        def pages_node(kids):
+            node = pdf.make_indirect(pikepdf.Dictionary(
+                Type=pikepdf.Name.Pages, Kids=pikepdf.Array(kids), Count=len(kids), Parent=root))
+            for kid in kids:
+                kid.Parent = node
+            return node
+
+        root.Kids = pikepdf.Array([pages_node([]), pages[0], pages_node(pages[1:4]), pages_node([]), pages[4]])
+        root.Count = 5
+        path = str(tmp_path / "uneven.pdf")
+        pdf.save(path)
+    return path
+
+
+@pytest.mark.parametrize("index", range(5))
+def test_find_page_in_uneven_tree(uneven_pdf, index):
+    reader = PdfReader(uneven_pdf)
+
+    _, page, _ = _find_page(reader.trailer["/Root"].raw_get("/Pages"), index)
+
+    assert f"P{index}".encode() in page["/Contents"].get_object().get_data()
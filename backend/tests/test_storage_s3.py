@@ -0,0 +1,147 @@
+"""S3Storage chạy với client boto3 giả giữ object trong bộ nhớ"""
+import os
+import sys
+import types
+
+import pytest
+
+from storage import ArtifactStore, MetadataIndex, S3Storage, shard_key
+
+
+class ClientError(Exception):
+    def __init__(self, code: str):
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3Client:
+    def __init__(self):
+        self.objects = {}
+        self.downloads = 0
+        self.fail_with = None
+
+    def upload_file(self, filename, bucket, key, ExtraArgs=None):
+        with open(filename, "rb") as f:
+            self.objects[(bucket, key)] = f.read()
+
+    def download_file(self, bucket, key, filename):
+        self.downloads += 1
+        if self.fail_with:
+            raise ClientError(self.fail_with)
+        if (bucket, key) not in self.objects:
+            raise ClientError("404")
+        with open(filename, "wb") as f:
+            f.write(self.objects[(bucket, key)])
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    client = FakeS3Client()
+    boto3 = types.ModuleType("boto3")
+    boto3.client = lambda service, endpoint_url=None, region_name=None: client
+    botocore = types.ModuleType("botocore")
+    exceptions = types.ModuleType("botocore.exceptions")
+    exceptions.ClientError = ClientError
+    botocore.exceptions = exceptions
+    monkeypatch.setitem(sys.modules, "boto3", boto3)
+    monkeypatch.setitem(sys.modules, "botocore", botocore)
+    monkeypatch.setitem(sys.modules, "botocore.exceptions", exceptions)
+    return client
+
+
+@pytest.fixture
+def storage(s3_client, tmp_path):
+    return S3Storage(bucket="pdfs", prefix="test/", cache_dir=str(tmp_path / "cache"))
+
+
+def write_file(path, data: bytes) -> str:
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+def test_put_uploads_and_keeps_local_copy(storage, s3_client, tmp_path):
+    src = write_file(tmp_path / "a.pdf", b"%PDF-1.4 a")
+    key = shard_key("doc_a")
+
+    path = storage.put(src, key)
+
+    assert s3_client.objects[("pdfs", "test/" + key)] == b"%PDF-1.4 a"
+    assert path == storage.cache.path(key)
+    assert not os.path.exists(src)
+    assert storage.local_path(key) == path
+    assert s3_client.downloads == 0
+
+
+def test_local_path_downloads_missing_cache_entry(storage, s3_client, tmp_path):
+    key = shard_key("doc_b")
+    storage.put(write_file(tmp_path / "b.pdf", b"%PDF-1.4 b"), key)
+    os.remove(storage.cache.path(key))
+
+    path = storage.local_path(key)
+
+    assert s3_client.downloads == 1
+    with open(path, "rb") as f:
+        assert f.read() == b"%PDF-1.4 b"
+    # Lần sau đọc từ bộ đệm
+    assert storage.local_path(key) == path
+    assert s3_client.downloads == 1
+
+
+def test_local_path_missing_object_returns_none(storage, s3_client):
+    key = shard_key("doc_missing")
+
+    assert storage.local_path(key) is None
+    directory = os.path.dirname(storage.cache.path(key))
+    assert not [name for name in os.listdir(directory) if name.endswith(".part")]
+
+
+def test_local_path_reraises_other_errors(storage, s3_client):
+    s3_client.fail_with = "AccessDenied"
+
+    with pytest.raises(ClientError):
+        storage.local_path(shard_key("doc_denied"))
+
+
+def test_delete_removes_object_and_cache(storage, s3_client, tmp_path):
+    key = shard_key("doc_c")
+    path = storage.put(write_file(tmp_path / "c.pdf", b"%PDF-1.4 c"), key)
+
+    storage.delete(key)
+
+    assert ("pdfs", "test/" + key) not in s3_client.objects
+    assert not os.path.exists(path)
+    assert storage.local_path(key) is None
+
+
+def test_prune_evicts_cache_but_keeps_object(storage, s3_client, tmp_path):
+    key = shard_key("doc_d")
+    path = storage.put(write_file(tmp_path / "d.pdf", b"%PDF-1.4 d"), key)
+    os.utime(path, (0, 0))
+
+    assert storage.prune(ttl=60) == 1
+    assert not os.path.exists(path)
+    assert storage.local_path(key) == path
+    assert s3_client.downloads == 1
+
+
+def test_artifact_store_resolves_delta_after_cache_eviction(storage, s3_client, tmp_path):
+    store = ArtifactStore(storage, MetadataIndex(str(tmp_path / "index.sqlite3")),
+                          legacy_dir=str(tmp_path / "legacy"), assembled_dir=str(tmp_path / "assembled"))
+    original = b"%PDF-1.4 original\n"
+    store.put(write_file(tmp_path / "o.pdf", original), "doc_e", "converted")
+    signed = store.put(write_file(tmp_path / "s.pdf", original + b"update\n"), "signed_e", "signed",
+                       parent_id="doc_e", delta=True)
+    assert signed["base_size"] == len(original)
+    assert s3_client.objects[("pdfs", "test/" + shard_key("signed_e", ".delta"))] == b"update\n"
+
+    # Xóa toàn bộ bản local, kho phải tải lại cả file gốc và phần delta
+    storage.prune(ttl=-1)
+    store.prune_assembled(ttl=-1)
+
+    with open(store.resolve("signed_e"), "rb") as f:
+        assert f.read() == original + b"update\n"
+    assert store.segments("signed_e")[1][1] == len(b"update\n")
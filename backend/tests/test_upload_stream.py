@@ -0,0 +1,50 @@
+"""Body multipart hỏng bị từ chối với 400 và không để lại file tạm"""
+import asyncio
+import os
+
+import pytest
+from starlette.requests import Request
+
+from upload_stream import UploadRejected, ingest_multipart
+
+
+def make_request(body: bytes, content_type: str) -> Request:
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/convert",
+        "headers": [
+            (b"content-type", content_type.encode("latin-1")),
+            (b"content-length", str(len(body)).encode("ascii")),
+        ],
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            return {"type": "http.disconnect"}
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    return Request(scope, receive)
+
+
+@pytest.mark.parametrize("body", [
+    # Header có boundary hợp lệ nhưng body không bắt đầu bằng boundary
+    b"garbage garbage",
+    b"--xyz\r\nno-colon-header\r\n\r\ndata\r\n--xyz--\r\n",
+])
+def test_malformed_multipart_is_rejected(tmp_path, body):
+    request = make_request(body, "multipart/form-data; boundary=xyz")
+    with pytest.raises(UploadRejected) as excinfo:
+        asyncio.run(ingest_multipart(request, str(tmp_path), {"file": "docx"}))
+    assert excinfo.value.status_code == 400
+    assert os.listdir(tmp_path) == []
+
+
+def test_urlencoded_form_is_parsed(tmp_path):
+    request = make_request(b"pdf_id=abc&signature_a_name=", "application/x-www-form-urlencoded")
+    fields, files = asyncio.run(ingest_multipart(request, str(tmp_path), {}))
+    assert fields == {"pdf_id": "abc", "signature_a_name": ""}
+    assert files == {}
@@ -0,0 +1,223 @@
+import os
+import uuid
+import hashlib
+import urllib.parse
+from typing import Dict, List, Optional
+
+from fastapi import Request
+from multipart.exceptions import ParseError
+from multipart.multipart import MultipartParser, parse_options_header
+
+
+# Giới hạn kích thước upload, có thể cấu hình qua biến môi trường
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 50 * 1024 * 1024))
+MAX_FIELD_BYTES = int(os.environ.get("MAX_FIELD_BYTES", 10 * 1024 * 1024))
+# Tổng dung lượng cho các request gửi nhiều file một lúc
+MAX_BATCH_UPLOAD_BYTES = int(os.environ.get("MAX_BATCH_UPLOAD_BYTES", 500 * 1024 * 1024))
+
+# Chữ ký đầu file của từng loại tài liệu
+MAGIC_BYTES = {
+    "pdf": b"%PDF-",
+    "docx": b"PK\x03\x04",
+}
+
+
+class UploadRejected(Exception):
+    """Upload bị từ chối, mang theo mã HTTP để endpoint trả về"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class IngestedFile:
+    """File đã được ghi thẳng xuống đĩa trong lúc nhận upload"""
+
+    def __init__(self, field_name: str, filename: str, path: str, kind: Optional[str]):
+        self.field_name = field_name
+        self.filename = filename
+        self.path = path
+        self.kind = kind
+        self.size = 0
+        self.header = b""
+        self._hash = hashlib.sha256()
+        self._file = open(path, "wb")
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def write(self, data: bytes, max_bytes: int) -> None:
+        self.size += len(data)
+        if self.size > max_bytes:
+            raise UploadRejected(413, f"File vượt quá giới hạn {max_bytes} bytes")
+        if len(self.header) < 8:
+            self.header += data[:8 - len(self.header)]
+            self._check_magic()
+        self._hash.update(data)
+        self._file.write(data)
+
+    def _check_magic(self) -> None:
+        magic = MAGIC_BYTES.get(self.kind)
+        if magic is None:
+            return
+        # Header có thể mới nhận được một phần, chỉ so sánh phần đã có
+        if not magic.startswith(self.header[:len(magic)]):
+            header_hex = ' '.join([f'{b:02x}' for b in self.header])
+            raise UploadRejected(400, f"File không đúng định dạng {self.kind.upper()}, header: {header_hex}")
+
+    def finish(self) -> None:
+        self._file.close()
+        magic = MAGIC_BYTES.get(self.kind)
+        if magic is not None and not self.header.startswith(magic):
+            raise UploadRejected(400, f"File không đúng định dạng {self.kind.upper()}")
+
+    def discard(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _StreamingMultipart:
+    """Bộ nhận multipart ghi từng chunk thẳng xuống file đích"""
+
+    def __init__(self, upload_dir: str, file_kinds: Dict[str, str],
+                 max_bytes: int, max_field_bytes: int, max_total_bytes: int):
+        self.upload_dir = upload_dir
+        self.file_kinds = file_kinds
+        self.max_bytes = max_bytes
+        self.max_field_bytes = max_field_bytes
+        self.max_total_bytes = max_total_bytes
+        self.fields: Dict[str, str] = {}
+        self.files: Dict[str, IngestedFile] = {}
+        # Mọi file theo thứ tự nhận, kể cả khi nhiều file cùng tên trường
+        self.uploads: List[IngestedFile] = []
+        self.total_bytes = 0
+        self._header_name = b""
+        self._header_value = b""
+        self._disposition = b""
+        self._field_name = ""
+        self._field_data = b""
+        self._current_file: Optional[IngestedFile] = None
+
+    def on_part_begin(self) -> None:
+        self._disposition = b""
+        self._field_name = ""
+        self._field_data = b""
+        self._current_file = None
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        if self._header_name.lower() == b"content-disposition":
+            self._disposition = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._disposition)
+        self._field_name = options.get(b"name", b"").decode("utf-8", errors="replace")
+        if b"filename" not in options:
+            return
+        filename = options[b"filename"].decode("utf-8", errors="replace")
+        if not filename:
+            # Trường file rỗng, bỏ qua như khi không gửi file
+            return
+        path = os.path.join(self.upload_dir, f"upload_{uuid.uuid4()}.part")
+        self._current_file = IngestedFile(
+            self._field_name, filename, path, self.file_kinds.get(self._field_name)
+        )
+        self.files[self._field_name] = self._current_file
+        self.uploads.append(self._current_file)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._current_file is not None:
+            self.total_bytes += end - start
+            if self.total_bytes > self.max_total_bytes:
+                raise UploadRejected(413, f"Tổng dung lượng upload vượt quá giới hạn {self.max_total_bytes} bytes")
+            self._current_file.write(data[start:end], self.max_bytes)
+            return
+        self._field_data += data[start:end]
+        if len(self._field_data) > self.max_field_bytes:
+            raise UploadRejected(413, f"Trường {self._field_name} vượt quá giới hạn {self.max_field_bytes} bytes")
+
+    def on_part_end(self) -> None:
+        if self._current_file is not None:
+            self._current_file.finish()
+        elif self._field_name:
+            self.fields[self._field_name] = self._field_data.decode("utf-8", errors="replace")
+
+    def discard(self) -> None:
+        for ingested in self.uploads:
+            ingested.discard()
+
+
+async def ingest_multipart(request: Request, upload_dir: str, file_kinds: Dict[str, str],
+                           max_bytes: int = MAX_UPLOAD_BYTES,
+                           max_field_bytes: int = MAX_FIELD_BYTES,
+                           multiple: bool = False,
+                           max_total_bytes: Optional[int] = None):
+    """Nhận body multipart theo luồng, trả về (fields, files)
+
+    File được ghi thẳng vào upload_dir, hash SHA-256 và kiểm tra chữ ký đầu
+    file trong cùng một lượt đọc. Upload bị hủy ngay khi vượt max_bytes.
+    Với multiple=True, files là danh sách mọi file theo thứ tự nhận và tổng
+    dung lượng bị giới hạn bởi max_total_bytes.
+    """
+    if max_total_bytes is None:
+        max_total_bytes = MAX_BATCH_UPLOAD_BYTES if multiple else max_bytes
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type == b"application/x-www-form-urlencoded":
+        # Form không có file, chỉ cần giới hạn kích thước body ngay trong lúc nhận
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > max_field_bytes:
+            raise UploadRejected(413, f"Form vượt quá giới hạn {max_field_bytes} bytes")
+        body = bytearray()
+        async for chunk in request.stream():
+            body += chunk
+            if len(body) > max_field_bytes:
+                raise UploadRejected(413, f"Form vượt quá giới hạn {max_field_bytes} bytes")
+        fields = dict(urllib.parse.parse_qsl(body.decode("utf-8", errors="replace"), keep_blank_values=True))
+        return fields, ([] if multiple else {})
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(400, "Yêu cầu phải là multipart/form-data")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_total_bytes + max_field_bytes:
+        raise UploadRejected(413, f"File vượt quá giới hạn {max_total_bytes} bytes")
+
+    receiver = _StreamingMultipart(upload_dir, file_kinds, max_bytes, max_field_bytes, max_total_bytes)
+    callbacks = {
+        "on_part_begin": receiver.on_part_begin,
+        "on_part_data": receiver.on_part_data,
+        "on_part_end": receiver.on_part_end,
+        "on_header_field": receiver.on_header_field,
+        "on_header_value": receiver.on_header_value,
+        "on_header_end": receiver.on_header_end,
+        "on_headers_finished": receiver.on_headers_finished,
+    }
+    parser = MultipartParser(params[b"boundary"], callbacks)
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        parser.finalize()
+    except (ParseError, IndexError) as e:
+        # python-multipart báo body hỏng bằng ParseError, một số trường hợp bằng IndexError từ bộ đệm boundary
+        receiver.discard()
+        raise UploadRejected(400, f"Body multipart không hợp lệ: {str(e)}")
+    except Exception:
+        receiver.discard()
+        raise
+    if multiple:
+        return receiver.fields, receiver.uploads
+    # Trường file gửi lặp lại chỉ giữ file cuối, các file trước bị bỏ
+    for ingested in receiver.uploads:
+        if receiver.files.get(ingested.field_name) is not ingested:
+            ingested.discard()
+    return receiver.fields, receiver.files
@@ -0,0 +1,131 @@
+import os
+import time
+import uuid
+import zipfile
+import hashlib
+from typing import AsyncIterator, List, Tuple
+
+import anyio
+
+
+CHUNK_SIZE = 64 * 1024
+DOCX_MAGIC = b"PK\x03\x04"
+
+
+class _ZipSink:
+    """Đích ghi không seek được, gom byte ZIP để đẩy dần ra response"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStreamWriter:
+    """Ghi file ZIP theo luồng, không giữ toàn bộ archive trong bộ nhớ
+
+    Đích ghi không seek được nên zipfile dùng data descriptor sau mỗi entry;
+    mỗi lần ghi xong một chunk, byte đã tạo ra được trả về cho response ngay.
+    PDF đã được nén sẵn nên các entry được lưu không nén lại.
+    """
+
+    def __init__(self):
+        self._sink = _ZipSink()
+        self._zip = zipfile.ZipFile(self._sink, "w", zipfile.ZIP_STORED)
+        self._names = set()
+
+    def unique_name(self, name: str) -> str:
+        """Tên entry không trùng với các entry đã ghi"""
+        stem, ext = os.path.splitext(name)
+        candidate = name
+        index = 1
+        while candidate in self._names:
+            candidate = f"{stem} ({index}){ext}"
+            index += 1
+        self._names.add(candidate)
+        return candidate
+
+    def _entry(self, name: str) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        return info
+
+    async def add_file(self, name: str, path: str) -> AsyncIterator[bytes]:
+        """Thêm file vào archive, trả về từng đoạn byte ZIP đã sẵn sàng gửi"""
+        async with await anyio.open_file(path, mode="rb") as f:
+            with self._zip.open(self._entry(name), "w") as dest:
+                while True:
+                    chunk = await f.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dest.write(chunk)
+                    yield self._sink.drain()
+        yield self._sink.drain()
+
+    def add_bytes(self, name: str, data: bytes) -> bytes:
+        self._zip.writestr(self._entry(name), data)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        """Ghi central directory, trả về các byte cuối của archive"""
+        self._zip.close()
+        return self._sink.drain()
+
+
+def extract_docx_entries(zip_path: str, dest_dir: str, max_entries: int,
+                         max_bytes: int, max_total_bytes: int) -> List[Tuple[str, str, str]]:
+    """Giải nén các file .docx trong ZIP, trả về [(tên file, đường dẫn, sha256)]
+
+    Kích thước từng entry và tổng dung lượng giải nén được đếm trong lúc giải
+    nén, không tin vào header của ZIP. Tên entry chỉ dùng để đặt tên PDF, file
+    luôn được ghi với tên ngẫu nhiên.
+    """
+    documents = []
+    total = 0
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            for info in archive.infolist():
+                filename = os.path.basename(info.filename.replace("\\", "/"))
+                if info.is_dir() or info.filename.startswith("__MACOSX/"):
+                    continue
+                if not filename.lower().endswith(".docx") or filename.startswith(("~$", "._")):
+                    continue
+                if len(documents) >= max_entries:
+                    raise ValueError(f"ZIP chứa quá {max_entries} file DOCX")
+
+                path = os.path.join(dest_dir, f"{uuid.uuid4()}.docx")
+                digest = hashlib.sha256()
+                size = 0
+                documents.append((filename, path, ""))
+                with archive.open(info) as src, open(path, "wb") as dest:
+                    while True:
+                        chunk = src.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        if size == 0 and not chunk.startswith(DOCX_MAGIC):
+                            raise ValueError(f"{filename} không phải file DOCX hợp lệ")
+                        size += len(chunk)
+                        total += len(chunk)
+                        if size > max_bytes:
+                            raise ValueError(f"{filename} vượt quá giới hạn {max_bytes} bytes")
+                        if total > max_total_bytes:
+                            raise ValueError(f"Tổng dung lượng sau giải nén vượt quá giới hạn {max_total_bytes} bytes")
+                        digest.update(chunk)
+                        dest.write(chunk)
+                documents[-1] = (filename, path, digest.hexdigest())
+    except (zipfile.BadZipFile, ValueError, OSError) as e:
+        for _, path, _ in documents:
+            if os.path.exists(path):
+                os.remove(path)
+        raise ValueError(f"Không thể đọc file ZIP: {str(e)}")
+    return documents